@@ -48,12 +48,18 @@ INSTALLED_APPS = [
 ]
 
 REST_FRAMEWORK = {
+    "DEFAULT_AUTHENTICATION_CLASSES": (
+        "rest_framework.authentication.SessionAuthentication",
+        "core.authentication.SignedTokenAuthentication",
+        "rest_framework.authentication.BasicAuthentication",
+    ),
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
     'PAGE_SIZE': 1
 }
 
 
 MIDDLEWARE = [
+    "core.middleware.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -143,7 +149,105 @@ MEDIA_URL = "/static/media/"
 MEDIA_ROOT = "/vol/web/media"
 STATIC_ROOT = "vol/web/static"
 
+# "hashed" stores uploads in uploads/<aa>/<bb>/<user id>/<cc>/, fanned out
+# by hashes of the user id and of the file name, "username" in
+# uploads/<username>/. migrate_media_layout moves existing files.
+MEDIA_PATH_LAYOUT = "username"
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+# Thumbnails
+
+THUMBNAIL_BACKEND = "core.thumbnails.ThumbnailBackend"
+THUMBNAIL_ENGINE = "core.thumbnail_engine.Engine"
+THUMBNAIL_KVSTORE = "core.thumbnails.KVStore"
+
+# Thumbnails looked up before they are generated are remembered as missing
+# for THUMBNAIL_MISS_CACHE_TIMEOUT seconds only.
+THUMBNAIL_MISS_CACHE_TIMEOUT = 10
+
+# Background image tasks
+
+IMAGE_TASK_WORKERS = 1
+IMAGE_TASKS_ALWAYS_EAGER = True
+
+# Images listed with thumbnails still missing THUMBNAIL_TASK_TIMEOUT seconds
+# after their generation was queued, because the task was lost or failed,
+# are queued again.
+THUMBNAIL_TASK_TIMEOUT = 5 * 60
+
+# When a tier gains or loses heights, or a user changes tiers, generate
+# the thumbnails that became available and delete those that no longer
+# are in the background, at most THUMBNAIL_SYNC_RATE per second, in tasks
+# of THUMBNAIL_SYNC_BATCH_SIZE images. The backfill_thumbnails command
+# generates missing thumbnails on demand.
+THUMBNAIL_SYNC_ON_TIER_CHANGE = False
+THUMBNAIL_SYNC_RATE = 20
+THUMBNAIL_SYNC_BATCH_SIZE = 100
+
+# Processes read the shared tier version at most every
+# TIERS_VERSION_CHECK_INTERVAL seconds, so tier changes made in another
+# process show up that much later.
+TIERS_VERSION_CHECK_INTERVAL = 1
+
+# Image uploads
+
+IMAGE_UPLOAD_MAX_BYTES = 20 * 1024 * 1024
+IMAGE_UPLOAD_MAX_PIXELS = 50_000_000
+IMAGE_HEADER_MAX_BYTES = 64 * 1024
+IMAGE_BATCH_UPLOAD_MAX_FILES = 1000
+
+# Media delivery
+# "x-accel-redirect" (nginx) or "x-sendfile" (Apache/lighttpd). Without a
+# front proxy media is only served in DEBUG.
+
+MEDIA_SENDFILE_BACKEND = None
+MEDIA_ACCEL_REDIRECT_LOCATION = "/protected-media/"
+
+# Object storage
+# Set DEFAULT_FILE_STORAGE = "core.storage.MediaStorage" to keep media in
+# the AWS_STORAGE_BUCKET_NAME bucket of an S3 compatible store (the minio
+# service of docker-compose.yml) instead of MEDIA_ROOT. Files larger than
+# MEDIA_MULTIPART_THRESHOLD are uploaded in MEDIA_MULTIPART_CHUNK_SIZE parts,
+# MEDIA_UPLOAD_CONCURRENCY at a time. Media URLs are presigned against
+# MEDIA_PUBLIC_ENDPOINT_URL for AWS_QUERYSTRING_EXPIRE seconds, binary
+# image links for their remaining lifetime, so reads bypass Django.
+
+AWS_STORAGE_BUCKET_NAME = "media"
+AWS_S3_ENDPOINT_URL = "http://minio:9000"
+AWS_S3_REGION_NAME = "us-east-1"
+AWS_S3_SIGNATURE_VERSION = "s3v4"
+AWS_ACCESS_KEY_ID = "dev_minio"
+AWS_SECRET_ACCESS_KEY = "dev_minio_password"
+AWS_QUERYSTRING_EXPIRE = 3600
+MEDIA_PUBLIC_ENDPOINT_URL = "http://localhost:9000"
+MEDIA_MULTIPART_THRESHOLD = 8 * 1024 * 1024
+MEDIA_MULTIPART_CHUNK_SIZE = 8 * 1024 * 1024
+MEDIA_UPLOAD_CONCURRENCY = 8
+
+# Token authentication
+
+AUTH_TOKEN_MAX_AGE = 30 * 24 * 60 * 60
+AUTH_USER_CACHE_TIMEOUT = 60
+
+# Serve link retrieval and the image list with native async views. Enable
+# when running under ASGI.
+
+ASYNC_VIEWS = False
+
+# Metrics
+# Every worker process dumps its metrics into METRICS_DIR so /metrics can
+# aggregate them. Leave it unset for a single process. /metrics requires
+# "Authorization: Bearer <METRICS_TOKEN>" and is disabled without a token
+# unless DEBUG is on.
+
+METRICS_DIR = None
+METRICS_FLUSH_INTERVAL = 1
+METRICS_TOKEN = None
+
+# Log every image decode, resize, encode and storage write as a JSON line
+# on the "core.instrumentation" logger.
+IMAGE_OPERATION_LOGS = False
@@ -0,0 +1,130 @@
+"""
+Native async versions of the hottest read endpoints, routed instead of the
+DRF views when ``ASYNC_VIEWS`` is enabled for ASGI deployments.
+
+Django 4.0 has no async ORM, so queries still run through
+``sync_to_async``, but cache reads are awaited and a warm request never
+leaves the event loop.
+"""
+from asgiref.sync import sync_to_async
+
+from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotAllowed
+from django.utils.cache import patch_vary_headers
+from django.utils.translation import gettext as _
+
+from .authentication import SignedTokenAuthentication
+from .binary_images import (
+    binary_link_cache_key,
+    binary_link_url,
+    load_binary_link,
+)
+from .permissions import DoesUserHaveTier
+from .serializers import ImagesSerializer
+from .thumbnails import aresolve_thumbnails, negotiate_variant
+from .tiers import get_tier
+from .views import TIER_FIELDS, ImageListViewSet
+
+
+def json_response(data, status_code=status.HTTP_200_OK):
+    return HttpResponse(
+        JSONRenderer().render(data),
+        status=status_code,
+        content_type="application/json",
+    )
+
+
+async def retrieve_binary_link(request, binary_pk):
+    """
+    Async ``RetrieveBinaryLinkView``.
+    """
+    if request.method != "GET":
+        return HttpResponseNotAllowed(["GET"])
+
+    url = await cache.aget(binary_link_cache_key(binary_pk))
+
+    if url is None:
+        binary_link = await sync_to_async(load_binary_link)(binary_pk)
+
+        if binary_link is None:
+            return json_response(
+                {"image": _("Link expired")},
+                status_code=status.HTTP_400_BAD_REQUEST,
+            )
+
+        binary_image = binary_link.rendered_image
+        if not binary_image:
+            return json_response(
+                {"image": _("Rendering in progress")},
+                status_code=status.HTTP_202_ACCEPTED,
+            )
+
+        url = binary_link_url(binary_link)
+
+    return json_response({"image": request.build_absolute_uri(url)})
+
+
+sync_image_list = ImageListViewSet.as_view({"get": "list"})
+
+
+async def image_list(request):
+    """
+    Async ``ImageListViewSet.list`` for bearer token clients. Session and
+    basic auth clients are handed to the DRF view.
+    """
+    if request.method != "GET":
+        return HttpResponseNotAllowed(["GET"])
+
+    try:
+        user_auth = await SignedTokenAuthentication().aauthenticate(request)
+    except AuthenticationFailed as exc:
+        return json_response(
+            {"detail": exc.detail}, status_code=status.HTTP_403_FORBIDDEN
+        )
+
+    if user_auth is None:
+        return await sync_to_async(sync_image_list)(request)
+
+    user, payload = user_auth
+    tier = await sync_to_async(get_tier)(user.tier_id)
+    if tier is None:
+        return json_response(
+            {"detail": DoesUserHaveTier.message},
+            status_code=status.HTTP_403_FORBIDDEN,
+        )
+
+    drf_request = Request(request)
+    drf_request.user, drf_request.auth = user, payload
+    view = ImageListViewSet(
+        request=drf_request, args=(), kwargs={}, action="list"
+    )
+    view.format_kwarg = None
+
+    paginator = view.paginator
+    images = await sync_to_async(paginator.paginate_queryset)(
+        view.get_queryset(), drf_request, view
+    )
+
+    variant = negotiate_variant(request)
+    fields = TIER_FIELDS.get(tier.name)
+    context = view.get_serializer_context()
+    context["thumbnail_heights"] = tier.heights
+    context["thumbnail_variant"] = variant
+    if fields is None or "thumbnails" in fields:
+        context["thumbnails"] = await aresolve_thumbnails(
+            images, tier.heights, variant
+        )
+
+    serializer = ImagesSerializer(
+        images, fields=fields, many=True, context=context
+    )
+    response = json_response(
+        paginator.get_paginated_response(serializer.data).data
+    )
+    patch_vary_headers(response, ("Accept",))
+    return response
@@ -0,0 +1,297 @@
+"""
+Keeps generated thumbnails in line with the heights tiers give access to.
+Thumbnails missing after a tier gains a height, or a user changes tiers,
+are generated in the background rather than in bulk by users' list
+requests, and those of heights no longer available are deleted.
+"""
+import time
+
+from django.conf import settings
+from django.db.models import F
+
+from sorl.thumbnail import default
+
+import core.models
+
+from .tasks import enqueue_batches, run_task
+from .thumbnails import (
+    THUMBNAIL_VARIANTS,
+    thumbnail_geometry,
+    thumbnail_options,
+)
+from .tiers import load_tiers
+
+
+class RateLimiter:
+    """
+    Spaces work out to at most ``rate`` items per second. 0 disables it.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self.next = time.monotonic()
+
+    def wait(self, count):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        if self.next > now:
+            time.sleep(self.next - now)
+        self.next = max(self.next, now) + count * self.interval
+
+
+def lookup_thumbnails(images, heights):
+    """
+    Looks up every thumbnail of ``images`` in one batch, once per file, and
+    returns ``((image_pk, height, variant), image, thumbnail or None)``.
+    ``heights`` maps tier ids to the heights wanted, and every image carries
+    a ``tier_id`` annotation.
+    """
+    items, lookups, seen = [], [], set()
+    for image in images:
+        for height in heights.get(image.tier_id, ()):
+            for variant in (None, *THUMBNAIL_VARIANTS):
+                # Identical uploads share their file and thumbnails.
+                if (image.image.name, height, variant) in seen:
+                    continue
+                seen.add((image.image.name, height, variant))
+                items.append(((image.pk, height, variant), image))
+                lookups.append(
+                    (
+                        image.image,
+                        thumbnail_geometry(height),
+                        thumbnail_options(variant),
+                    )
+                )
+
+    thumbnails = default.backend.get_cached_thumbnails(lookups)
+    return [
+        (item, image, thumbnail)
+        for (item, image), thumbnail in zip(items, thumbnails)
+    ]
+
+
+def missing_thumbnails(images, heights):
+    """
+    Returns ``(image_pk, height, variant)`` for every thumbnail of
+    ``images`` that has not been generated, see ``lookup_thumbnails``.
+    """
+    return [
+        item
+        for item, _, thumbnail in lookup_thumbnails(images, heights)
+        if thumbnail is None
+    ]
+
+
+def scan_images(tier_ids=None, user_ids=None, start_after=0, batch_size=500):
+    """
+    Yields the images of users of ``tier_ids`` and/or ``user_ids`` in
+    batches ordered by pk, annotated with their owner's ``tier_id``.
+    """
+    images = (
+        core.models.Image.objects.annotate(tier_id=F("user__tier_id"))
+        .only("pk", "image")
+        .order_by("pk")
+    )
+    if tier_ids is not None:
+        images = images.filter(user__tier_id__in=tier_ids)
+    if user_ids is not None:
+        images = images.filter(user_id__in=user_ids)
+
+    last_pk = start_after
+    while True:
+        batch = list(images.filter(pk__gt=last_pk)[:batch_size])
+        if not batch:
+            return
+        last_pk = batch[-1].pk
+        yield batch
+
+
+def generate_thumbnail_batch(items):
+    """
+    Generates ``(image_pk, height, variant)`` thumbnails, skipping images
+    deleted in the meantime. Returns how many were generated.
+    """
+    images = core.models.Image.objects.only("image").in_bulk(
+        {image_pk for image_pk, _, _ in items}
+    )
+    generated = 0
+    for image_pk, height, variant in items:
+        image = images.get(image_pk)
+        if image is None:
+            continue
+        default.backend.get_thumbnail(
+            image.image,
+            thumbnail_geometry(height),
+            **thumbnail_options(variant),
+        )
+        generated += 1
+    return generated
+
+
+def backfill_thumbnails(
+    tier_ids=None,
+    heights=None,
+    user_ids=None,
+    start_after=0,
+    batch_size=500,
+    chunk_size=50,
+    rate=0,
+    executor=None,
+    dry_run=False,
+):
+    """
+    Generates every missing thumbnail of the images of ``tier_ids`` (all
+    tiers by default), restricted to ``heights`` and the images of
+    ``user_ids`` when given.
+
+    Images are scanned ``batch_size`` at a time in pk order, starting after
+    ``start_after``. Every batch yields ``(last_pk, images, missing,
+    generated)``, and everything before ``last_pk`` is done by then, so a
+    run can be resumed from it.
+
+    Missing thumbnails are generated ``chunk_size`` at a time on
+    ``executor`` (inline without one), at most ``rate`` per second.
+    """
+    wanted = {}
+    for tier in load_tiers().values():
+        if tier_ids is not None and tier.id not in tier_ids:
+            continue
+        tier_heights = [
+            height
+            for height in tier.heights
+            if heights is None or height in heights
+        ]
+        if tier_heights:
+            wanted[tier.id] = tier_heights
+    if not wanted:
+        return
+
+    limiter = RateLimiter(rate)
+    for batch in scan_images(wanted, user_ids, start_after, batch_size):
+        last_pk = batch[-1].pk
+        missing = missing_thumbnails(batch, wanted)
+        if dry_run:
+            yield last_pk, len(batch), len(missing), 0
+            continue
+
+        results = []
+        for start in range(0, len(missing), chunk_size):
+            end = start + chunk_size
+            chunk = missing[start:end]
+            limiter.wait(len(chunk))
+            if executor is None:
+                results.append(generate_thumbnail_batch(chunk))
+            else:
+                results.append(
+                    executor.submit(run_task, generate_thumbnail_batch, chunk)
+                )
+
+        generated = sum(
+            result if executor is None else result.result()
+            for result in results
+        )
+        yield last_pk, len(batch), len(missing), generated
+
+
+def drop_thumbnails(
+    heights,
+    tier_ids=None,
+    user_ids=None,
+    start_after=0,
+    batch_size=500,
+    rate=0,
+):
+    """
+    Deletes the ``heights`` thumbnails of the images of ``tier_ids`` and/or
+    ``user_ids``, files and kvstore entries, except for heights the owner's
+    tier has (again) by now. Yields ``(last_pk, deleted)`` per batch, like
+    ``backfill_thumbnails``.
+    """
+    tiers = load_tiers()
+    limiter = RateLimiter(rate)
+
+    for batch in scan_images(tier_ids, user_ids, start_after, batch_size):
+        unwanted = {}
+        for tier_id in {image.tier_id for image in batch}:
+            tier = tiers.get(tier_id)
+            kept = () if tier is None else tier.heights
+            unwanted[tier_id] = [
+                height for height in heights if height not in kept
+            ]
+
+        generated = [
+            (image.image, thumbnail)
+            for _, image, thumbnail in lookup_thumbnails(batch, unwanted)
+            if thumbnail is not None
+        ]
+        limiter.wait(len(generated))
+        default.backend.delete_thumbnails(generated)
+        yield batch[-1].pk, len(generated)
+
+
+def sync_thumbnail_batch(sync):
+    """
+    Applies ``sync``, a ``ThumbnailSync``, to the next
+    ``THUMBNAIL_SYNC_BATCH_SIZE`` images of its phase and moves its
+    checkpoint on. Returns False once all phases are done.
+    """
+    options = {
+        "user_ids": sync.user_ids,
+        "start_after": sync.last_pk,
+        "batch_size": settings.THUMBNAIL_SYNC_BATCH_SIZE,
+        "rate": settings.THUMBNAIL_SYNC_RATE,
+    }
+    batches = iter(())
+    if sync.phase == "create" and sync.create:
+        batches = backfill_thumbnails(sync.tier_ids, sync.create, **options)
+    elif sync.phase == "drop" and sync.drop:
+        batches = drop_thumbnails(sync.drop, sync.tier_ids, **options)
+
+    batch = next(batches, None)
+    if batch is not None:
+        sync.last_pk = batch[0]
+        return True
+
+    phases = core.models.ThumbnailSync.PHASES
+    next_phase = phases.index(sync.phase) + 1
+    if next_phase == len(phases):
+        return False
+    sync.phase, sync.last_pk = phases[next_phase], 0
+    return True
+
+
+def sync_thumbnails(sync_pk):
+    """
+    Background task applying one batch of a ``ThumbnailSync`` and saving
+    its checkpoint. Returns True while batches remain; the task is then
+    enqueued again behind the tasks queued meanwhile, so a sync never holds
+    a worker for long and uploads are not held up behind it.
+    ``backfill_thumbnails --resume-syncs`` finishes syncs interrupted by a
+    restart.
+    """
+    sync = core.models.ThumbnailSync.objects.filter(pk=sync_pk).first()
+    if sync is None:
+        return False
+
+    if not sync_thumbnail_batch(sync):
+        sync.delete()
+        return False
+    sync.save()
+    return True
+
+
+def schedule_thumbnail_sync(tier_ids=None, user_ids=None, create=(), drop=()):
+    """
+    Records a ``ThumbnailSync`` and enqueues ``sync_thumbnails`` for it when
+    ``THUMBNAIL_SYNC_ON_TIER_CHANGE`` is set and there is anything to do.
+    """
+    create, drop = sorted(set(create)), sorted(set(drop))
+    if settings.THUMBNAIL_SYNC_ON_TIER_CHANGE and (create or drop):
+        sync = core.models.ThumbnailSync.objects.create(
+            tier_ids=None if tier_ids is None else list(tier_ids),
+            user_ids=None if user_ids is None else list(user_ids),
+            create=create,
+            drop=drop,
+        )
+        enqueue_batches(sync_thumbnails, sync.pk)
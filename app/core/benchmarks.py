@@ -0,0 +1,83 @@
+"""
+Helpers shared by the benchmark and dataset management commands.
+"""
+import hashlib
+import os
+import statistics
+
+from io import BytesIO
+
+from PIL import Image as pillow_image
+
+# Same tiers as fixtures.json: thumbnail heights and can_create_link.
+TIERS = {
+    "Basic": ((200,), False),
+    "Premium": ((200, 400), False),
+    "Enterprise": ((200, 400), True),
+}
+
+EXTENSIONS = {"JPEG": ".jpg", "PNG": ".png", "WEBP": ".webp"}
+
+
+def synthetic_image(width, height, fmt="PNG"):
+    """
+    Returns an encoded ``width`` x ``height`` image. The noise channel makes
+    every call unique and keeps it from compressing unrealistically well.
+    """
+    size = (width, height)
+    image = pillow_image.merge(
+        "RGB",
+        (
+            pillow_image.effect_noise(size, 32),
+            pillow_image.linear_gradient("L").resize(size),
+            pillow_image.radial_gradient("L").resize(size),
+        ),
+    )
+    buffer = BytesIO()
+    image.save(buffer, fmt, quality=90)
+    return buffer.getvalue()
+
+
+def write_synthetic_image(args):
+    """
+    Writes a ``synthetic_image`` into a directory, named by its SHA-256
+    like a deduplicated upload. Takes ``(directory, width, height, fmt)``
+    so it can be mapped over the image worker pool.
+    """
+    directory, width, height, fmt = args
+    data = synthetic_image(width, height, fmt)
+    content_hash = hashlib.sha256(data).hexdigest()
+    path = os.path.join(directory, f"{content_hash}{EXTENSIONS[fmt]}")
+    with open(path, "wb") as image_file:
+        image_file.write(data)
+    return path, content_hash
+
+
+def summarize(latencies, elapsed, queries=None):
+    """
+    Returns throughput and latency percentiles in milliseconds for one run,
+    plus the mean number of queries per request when they were counted.
+    """
+    quantiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "requests": len(latencies),
+        "throughput": len(latencies) / elapsed,
+        "p50": quantiles[49] * 1000,
+        "p95": quantiles[94] * 1000,
+        "p99": quantiles[98] * 1000,
+        "queries_per_request": (
+            None if queries is None else statistics.fmean(queries)
+        ),
+    }
+
+
+def format_summary(summary):
+    line = (
+        f"{summary['throughput']:9.1f} req/s  "
+        f"p50 {summary['p50']:8.2f} ms  "
+        f"p95 {summary['p95']:8.2f} ms  "
+        f"p99 {summary['p99']:8.2f} ms"
+    )
+    if summary["queries_per_request"] is not None:
+        line += f"  {summary['queries_per_request']:5.1f} queries"
+    return line
@@ -0,0 +1,125 @@
+from io import BytesIO
+
+from PIL import Image as pillow_image
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.utils import timezone
+
+import core.models
+
+from .instrumentation import image_tags, measure, pixel_buffer_estimate
+from .media import media_url
+
+
+def binary_link_cache_key(link_id):
+    return f"binary-link:{link_id}"
+
+
+def binary_link_url(link, lifetime=None):
+    """
+    Media URL of a rendered link. On object storage it is presigned for the
+    link's remaining ``lifetime``, so the store enforces the expiry too.
+    """
+    if lifetime is None:
+        lifetime = int((link.expires_at - timezone.now()).total_seconds())
+    return media_url(link.rendered_image, max(lifetime, 1))
+
+
+def cache_binary_link(link):
+    """
+    Cache the media URL of a rendered link for exactly its remaining
+    lifetime, so expiry is handled by key eviction.
+    """
+    binary_image = link.rendered_image
+    timeout = int((link.expires_at - timezone.now()).total_seconds())
+
+    if binary_image and timeout > 0:
+        cache.set(
+            binary_link_cache_key(link.id),
+            binary_link_url(link, timeout),
+            timeout,
+        )
+
+
+def load_binary_link(link_id):
+    """
+    Returns the unexpired link ``link_id`` and caches its URL once it is
+    rendered, or None when it has expired.
+    """
+    link = (
+        core.models.BinaryImageLink.objects.select_related("image")
+        .filter(id=link_id, expires_at__gt=timezone.now())
+        .first()
+    )
+    if link is not None:
+        cache_binary_link(link)
+    return link
+
+
+def render_binary_image(image_pk):
+    """
+    Render the grayscale derivative shared by every binary link of an image.
+    """
+    image = (
+        core.models.Image.objects.select_related("user")
+        .filter(pk=image_pk)
+        .first()
+    )
+    if image is None or image.binary_image:
+        return
+
+    if image.content_hash:
+        shared = (
+            core.models.Image.objects.filter(
+                content_hash=image.content_hash, image=image.image.name
+            )
+            .exclude(binary_image="")
+            .values_list("binary_image", flat=True)
+            .first()
+        )
+        if shared:
+            core.models.Image.objects.filter(pk=image.pk).update(
+                binary_image=shared
+            )
+            cache_pending_links(image.pk)
+            return
+
+    with pillow_image.open(image.image) as source:
+        tags = image_tags(source, "grayscale")
+        with measure("decode", tags) as measurement:
+            source.load()
+            measurement.buffer_estimate = pixel_buffer_estimate(source)
+
+        with measure("convert", tags) as measurement:
+            grayscale = source.convert("L")
+            measurement.buffer_estimate = pixel_buffer_estimate(grayscale)
+
+        with measure("encode", tags) as measurement:
+            io_img = BytesIO()
+            grayscale.save(io_img, "png")
+            measurement.data_bytes = io_img.tell()
+
+    binary_image = image.binary_image
+    with measure("storage_write", tags) as measurement:
+        binary_image.save(
+            "image.png", ContentFile(io_img.getvalue()), save=False
+        )
+        measurement.data_bytes = io_img.tell()
+
+    # Another worker may have rendered the same image in the meantime.
+    updated = core.models.Image.objects.filter(
+        pk=image.pk, binary_image=""
+    ).update(binary_image=binary_image.name)
+    if not updated:
+        binary_image.delete(save=False)
+    cache_pending_links(image.pk)
+
+
+def cache_pending_links(image_pk):
+    links = core.models.BinaryImageLink.objects.select_related(
+        "image"
+    ).filter(image_id=image_pk, expires_at__gt=timezone.now())
+
+    for link in links:
+        cache_binary_link(link)
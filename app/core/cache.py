@@ -0,0 +1,70 @@
+from django.core.cache.backends import locmem, redis
+
+from .metrics import record_cache_call, untracked
+
+_missing = object()
+
+
+class InstrumentedCacheMixin:
+    """
+    Counts calls, hits and misses of the request being measured by
+    ``MetricsMiddleware``. The async methods of the base cache delegate to
+    these, so they are counted as well.
+    """
+
+    def get(self, key, default=None, version=None):
+        value = super().get(key, _missing, version)
+        if value is _missing:
+            record_cache_call(misses=1)
+            return default
+        record_cache_call(hits=1)
+        return value
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        with untracked():
+            values = super().get_many(keys, version)
+        record_cache_call(hits=len(values), misses=len(keys) - len(values))
+        return values
+
+    def set(self, *args, **kwargs):
+        record_cache_call()
+        return super().set(*args, **kwargs)
+
+    def set_many(self, *args, **kwargs):
+        record_cache_call()
+        with untracked():
+            return super().set_many(*args, **kwargs)
+
+    def add(self, *args, **kwargs):
+        record_cache_call()
+        return super().add(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        record_cache_call()
+        return super().delete(*args, **kwargs)
+
+    def delete_many(self, *args, **kwargs):
+        record_cache_call()
+        with untracked():
+            return super().delete_many(*args, **kwargs)
+
+    def incr(self, *args, **kwargs):
+        record_cache_call()
+        return super().incr(*args, **kwargs)
+
+    def touch(self, *args, **kwargs):
+        record_cache_call()
+        return super().touch(*args, **kwargs)
+
+    def has_key(self, *args, **kwargs):
+        record_cache_call()
+        return super().has_key(*args, **kwargs)  # noqa: W601
+
+
+class RedisCache(InstrumentedCacheMixin, redis.RedisCache):
+    pass
+
+
+class LocMemCache(InstrumentedCacheMixin, locmem.LocMemCache):
+    pass
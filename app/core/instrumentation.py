@@ -0,0 +1,108 @@
+"""
+Timing and size hooks around the expensive image operations: decode,
+resize, encode and storage writes.
+
+Every measurement is recorded in the metrics registry, labelled by
+operation, source format, source size class and target geometry. With
+``IMAGE_OPERATION_LOGS`` each one is also logged as a JSON line carrying
+the exact source dimensions.
+"""
+import json
+import logging
+import time
+
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in megapixels; exact dimensions would explode the number of
+# label combinations, so metrics only carry the class.
+SIZE_CLASSES = ((1, "<1MP"), (4, "1-4MP"), (12, "4-12MP"), (24, "12-24MP"))
+
+
+def size_class(width, height):
+    megapixels = width * height / 1_000_000
+    for bound, name in SIZE_CLASSES:
+        if megapixels < bound:
+            return name
+    return ">24MP"
+
+
+def pixel_buffer_estimate(image):
+    """
+    Estimated size of a Pillow image's pixel buffer: one byte per band and
+    pixel, ignoring wider modes, padding and palettes.
+    """
+    width, height = image.size
+    return width * height * len(image.getbands())
+
+
+def image_tags(image, geometry=""):
+    """
+    Describes the source ``image`` before any draft or decode.
+    """
+    return {
+        "format": image.format or "",
+        "width": image.size[0],
+        "height": image.size[1],
+        "geometry": geometry,
+    }
+
+
+class Measurement:
+    __slots__ = ("buffer_estimate", "data_bytes")
+
+    def __init__(self):
+        self.buffer_estimate = None
+        self.data_bytes = None
+
+
+@contextmanager
+def measure(operation, tags):
+    """
+    Times the block. Set ``buffer_estimate`` on the yielded measurement to
+    the pixel buffer estimate of the image the operation produced, or
+    ``data_bytes`` to the size of the data it encoded or stored.
+    """
+    measurement = Measurement()
+    start = time.perf_counter()
+    yield measurement
+    elapsed = time.perf_counter() - start
+
+    labels = (
+        ("operation", operation),
+        ("format", tags["format"]),
+        ("source", size_class(tags["width"], tags["height"])),
+        ("geometry", tags["geometry"]),
+    )
+    metrics.registry.observe(
+        "image_operation_duration_seconds", labels, elapsed
+    )
+    if measurement.buffer_estimate is not None:
+        metrics.registry.observe(
+            "image_pixel_buffer_estimated_bytes",
+            labels,
+            measurement.buffer_estimate,
+        )
+    if measurement.data_bytes is not None:
+        metrics.registry.observe(
+            "image_operation_data_bytes", labels, measurement.data_bytes
+        )
+    metrics.maybe_flush()
+
+    if settings.IMAGE_OPERATION_LOGS:
+        logger.info(
+            json.dumps(
+                {
+                    "operation": operation,
+                    **tags,
+                    "duration_ms": round(elapsed * 1000, 3),
+                    "buffer_estimate_bytes": measurement.buffer_estimate,
+                    "data_bytes": measurement.data_bytes,
+                }
+            )
+        )
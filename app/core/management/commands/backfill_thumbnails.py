@@ -0,0 +1,174 @@
+import json
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.backfill import backfill_thumbnails, sync_thumbnails
+from core.models import ThumbnailSync, Tier
+from core.tasks import create_executor
+
+
+class Command(BaseCommand):
+    """Generate the thumbnails missing for tier heights"""
+
+    help = (
+        "Generate every thumbnail missing for the images of the given tiers "
+        "on a process pool, with resumable progress and rate limiting."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--tiers", nargs="+", help="Tier names. Defaults to every tier."
+        )
+        parser.add_argument(
+            "--heights",
+            nargs="+",
+            type=int,
+            help="Only these heights. Defaults to every height of the tier.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=settings.IMAGE_TASK_WORKERS,
+            help="Worker processes. 0 generates in this process.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Images checked for missing thumbnails at a time.",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=50,
+            help="Thumbnails sent to a worker at a time.",
+        )
+        parser.add_argument(
+            "--rate",
+            type=float,
+            default=0,
+            help="Maximum thumbnails generated per second. 0 is unlimited.",
+        )
+        parser.add_argument(
+            "--checkpoint",
+            help=(
+                "Progress file. An interrupted run started again with the "
+                "same file resumes where it stopped."
+            ),
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only count the missing thumbnails.",
+        )
+        parser.add_argument(
+            "--resume-syncs",
+            action="store_true",
+            help=(
+                "Instead, finish the background syncs of tier changes "
+                "interrupted by a restart, from their checkpoints."
+            ),
+        )
+
+    def handle(self, *args, **options):
+        if options["resume_syncs"]:
+            self.resume_syncs()
+            return
+
+        tier_ids = None
+        if options["tiers"]:
+            tiers = dict(
+                Tier.objects.filter(name__in=options["tiers"]).values_list(
+                    "name", "id"
+                )
+            )
+            unknown = set(options["tiers"]) - set(tiers)
+            if unknown:
+                raise CommandError(f"Unknown tiers: {', '.join(unknown)}.")
+            tier_ids = set(tiers.values())
+
+        # A dry run neither records nor consumes progress.
+        checkpoint = None if options["dry_run"] else options["checkpoint"]
+        scope = {"tiers": options["tiers"], "heights": options["heights"]}
+        start_after = self.read_checkpoint(checkpoint, scope)
+
+        executor = None
+        if not (
+            settings.IMAGE_TASKS_ALWAYS_EAGER
+            or options["dry_run"]
+            or options["workers"] == 0
+        ):
+            executor = create_executor(options["workers"])
+
+        start = time.perf_counter()
+        totals = [0, 0, 0]
+        try:
+            for last_pk, *counts in backfill_thumbnails(
+                tier_ids,
+                options["heights"],
+                start_after=start_after,
+                batch_size=options["batch_size"],
+                chunk_size=options["chunk_size"],
+                rate=options["rate"],
+                executor=executor,
+                dry_run=options["dry_run"],
+            ):
+                totals = [a + b for a, b in zip(totals, counts)]
+                self.write_checkpoint(checkpoint, scope, last_pk)
+                self.report(totals, time.perf_counter() - start)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        if checkpoint and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+        verb = "Found" if options["dry_run"] else "Generated"
+        count = totals[1] if options["dry_run"] else totals[2]
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{verb} {count} missing thumbnails for {totals[0]} images."
+            )
+        )
+
+    def resume_syncs(self):
+        pks = list(
+            ThumbnailSync.objects.order_by("pk").values_list("pk", flat=True)
+        )
+        for pk in pks:
+            self.stdout.write(f"Resuming sync {pk}")
+            while sync_thumbnails(pk):
+                pass
+
+        self.stdout.write(self.style.SUCCESS(f"Finished {len(pks)} syncs."))
+
+    def read_checkpoint(self, path, scope):
+        if not path or not os.path.exists(path):
+            return 0
+
+        with open(path) as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+        if checkpoint["scope"] != scope:
+            raise CommandError(
+                f"{path} belongs to a run with other tiers or heights."
+            )
+        self.stdout.write(f"Resuming after image {checkpoint['last_pk']}")
+        return checkpoint["last_pk"]
+
+    def write_checkpoint(self, path, scope, last_pk):
+        if not path:
+            return
+
+        with open(f"{path}.tmp", "w") as checkpoint_file:
+            json.dump({"scope": scope, "last_pk": last_pk}, checkpoint_file)
+        os.replace(f"{path}.tmp", path)
+
+    def report(self, totals, elapsed):
+        images, missing, generated = totals
+        self.stdout.write(
+            f"{images} images checked, {missing} thumbnails missing, "
+            f"{generated} generated ({generated / elapsed:.1f}/s)"
+        )
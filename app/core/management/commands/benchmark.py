@@ -0,0 +1,363 @@
+import itertools
+import json
+import os
+import shutil
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+from uuid import uuid4
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.urls import reverse
+from django.utils import timezone
+
+from core.authentication import create_token
+from core.benchmarks import TIERS, format_summary, summarize, synthetic_image
+from core.binary_images import render_binary_image
+from core.models import (
+    BinaryImageLink,
+    Image,
+    Thumbnail,
+    Tier,
+    user_upload_dir,
+)
+from core.thumbnails import generate_thumbnails
+
+ENDPOINTS = (
+    "images-list",
+    "images-image-upload",
+    "create-link",
+    "get-binary-link",
+)
+
+# Statuses a healthy endpoint answers with.
+EXPECTED_STATUSES = {
+    "images-list": (200,),
+    "images-image-upload": (201,),
+    "create-link": (201, 202),
+    "get-binary-link": (200, 202),
+}
+
+
+class InProcessClient:
+    """
+    Drives the WSGI handler in this process, one test client per thread.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+
+    @property
+    def client(self):
+        if not hasattr(self.local, "client"):
+            self.local.client = Client()
+        return self.local.client
+
+    def get(self, path, token):
+        return self.client.get(
+            path, HTTP_AUTHORIZATION=f"Bearer {token}"
+        ).status_code
+
+    def post(self, path, data, token):
+        return self.client.post(
+            path, data, HTTP_AUTHORIZATION=f"Bearer {token}"
+        ).status_code
+
+
+class HTTPClient:
+    """
+    Sends real HTTP requests to a running server.
+    """
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+
+    def get(self, path, token):
+        return self.send(Request(self.base_url + path), token)
+
+    def post(self, path, data, token):
+        request = Request(
+            self.base_url + path,
+            data=encode_multipart(BOUNDARY, data),
+            headers={"Content-Type": MULTIPART_CONTENT},
+        )
+        return self.send(request, token)
+
+    def send(self, request, token):
+        request.add_header("Authorization", f"Bearer {token}")
+        try:
+            with urlopen(request) as response:
+                response.read()
+                return response.status
+        except HTTPError as exc:
+            return exc.code
+
+
+class Command(BaseCommand):
+    """Load test the core endpoints"""
+
+    help = (
+        "Seed a synthetic dataset, drive concurrent requests against the "
+        "core endpoints and report latency percentiles, throughput and "
+        "queries per request."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--users-per-tier",
+            type=int,
+            default=2,
+            help="Users seeded for each of Basic, Premium and Enterprise.",
+        )
+        parser.add_argument("--images-per-user", type=int, default=10)
+        parser.add_argument(
+            "--image-size",
+            default="800x600",
+            help="WIDTHxHEIGHT of seeded and uploaded images.",
+        )
+        parser.add_argument(
+            "--requests",
+            type=int,
+            default=200,
+            help="Requests sent to each endpoint.",
+        )
+        parser.add_argument("--concurrency", type=int, default=10)
+        parser.add_argument(
+            "--endpoints",
+            nargs="+",
+            choices=ENDPOINTS,
+            default=list(ENDPOINTS),
+        )
+        parser.add_argument(
+            "--server",
+            help=(
+                "Base URL of a running server, e.g. http://localhost:8000. "
+                "Requests go through this process' WSGI handler otherwise. "
+                "The server must share this database."
+            ),
+        )
+        parser.add_argument(
+            "--output", help="Write the results as JSON to this file."
+        )
+        parser.add_argument(
+            "--keep",
+            action="store_true",
+            help="Keep the seeded dataset.",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            width, height = map(int, options["image_size"].split("x"))
+        except ValueError:
+            raise CommandError("--image-size must look like 800x600.")
+        self.image_size = (width, height)
+
+        if options["server"]:
+            client = HTTPClient(options["server"])
+        else:
+            client = InProcessClient()
+
+        run_id = uuid4().hex[:8]
+        dataset = self.seed(run_id, **options)
+        # The test client sends "Host: testserver".
+        allowed_hosts = override_settings(
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]
+        )
+        allowed_hosts.enable()
+        try:
+            results = {
+                endpoint: self.run(endpoint, client, dataset, **options)
+                for endpoint in options["endpoints"]
+            }
+        finally:
+            allowed_hosts.disable()
+            if not options["keep"]:
+                self.clean_up(dataset)
+
+        if options["output"]:
+            report = {
+                "run_id": run_id,
+                "date": timezone.now().isoformat(),
+                "target": options["server"] or "in-process",
+                "options": {
+                    key: options[key]
+                    for key in (
+                        "users_per_tier",
+                        "images_per_user",
+                        "image_size",
+                        "requests",
+                        "concurrency",
+                    )
+                },
+                "endpoints": results,
+            }
+            with open(options["output"], "w") as output:
+                json.dump(report, output, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+    def seed(self, run_id, **options):
+        """
+        Creates ``users_per_tier`` users for every tier with
+        ``images_per_user`` images each, and a rendered binary link for every
+        Enterprise image. Missing tiers and thumbnails are created too.
+        """
+        dataset = {"tiers": [], "thumbnails": [], "users": []}
+
+        for name, (heights, can_create_link) in TIERS.items():
+            thumbnails = []
+            for value in heights:
+                thumbnail, created = Thumbnail.objects.get_or_create(
+                    value=value
+                )
+                thumbnails.append(thumbnail)
+                if created:
+                    dataset["thumbnails"].append(thumbnail)
+
+            tier, created = Tier.objects.get_or_create(
+                name=name, defaults={"can_create_link": can_create_link}
+            )
+            if created:
+                tier.thumbnails.set(thumbnails)
+                dataset["tiers"].append(tier)
+
+            password = make_password(None)
+            users = []
+            for index in range(options["users_per_tier"]):
+                username = f"benchmark-{run_id}-{name.lower()}-{index}"
+                users.append(
+                    get_user_model().objects.create(
+                        username=username,
+                        email=f"{username}@example.com",
+                        password=password,
+                        tier=tier,
+                    )
+                )
+
+            for user in users:
+                user.token = create_token(user)
+                user.images = [
+                    self.seed_image(user, tier.can_create_link)
+                    for _ in range(options["images_per_user"])
+                ]
+            dataset["users"].extend(users)
+
+        self.stdout.write(
+            f"Seeded {len(dataset['users'])} users with "
+            f"{options['images_per_user']} images each"
+        )
+        return dataset
+
+    def seed_image(self, user, can_create_link):
+        image = Image.objects.create(
+            user=user,
+            image=SimpleUploadedFile(
+                "image.png", synthetic_image(*self.image_size)
+            ),
+        )
+        generate_thumbnails(image.pk)
+
+        if can_create_link:
+            render_binary_image(image.pk)
+            image.link = BinaryImageLink.objects.create(
+                user=user, image=image, exist_seconds=30000
+            )
+        return image
+
+    def clean_up(self, dataset):
+        for user in dataset["users"]:
+            # The hashed layout names the directory after the pk, which
+            # delete() clears.
+            upload_dir = user_upload_dir(user)
+            user.delete()
+            shutil.rmtree(
+                os.path.join(settings.MEDIA_ROOT, upload_dir),
+                ignore_errors=True,
+            )
+        for obj in dataset["tiers"] + dataset["thumbnails"]:
+            obj.delete()
+
+    def get_requests(self, endpoint, dataset, count):
+        """
+        Returns ``count`` request thunks for ``endpoint``, spread round robin
+        over the seeded users allowed to call it. Upload payloads are
+        encoded up front so they are not timed.
+        """
+        users = dataset["users"]
+        if endpoint in ("create-link", "get-binary-link"):
+            users = [user for user in users if user.tier.can_create_link]
+        images = itertools.cycle(
+            [(user, image) for user in users for image in user.images]
+        )
+
+        requests = []
+        for user, image in itertools.islice(images, count):
+            if endpoint == "images-list":
+                path = reverse("core:images-list")
+                requests.append(("get", path, None, user.token))
+            elif endpoint == "images-image-upload":
+                path = reverse("core:images-image-upload")
+                data = {
+                    "image": SimpleUploadedFile(
+                        "image.png", synthetic_image(*self.image_size)
+                    )
+                }
+                requests.append(("post", path, data, user.token))
+            elif endpoint == "create-link":
+                path = reverse("core:create-link", args=[image.pk])
+                data = {"exist_seconds": 300}
+                requests.append(("post", path, data, user.token))
+            else:
+                path = reverse("core:get-binary-link", args=[image.link.id])
+                requests.append(("get", path, None, user.token))
+        return requests
+
+    def run(self, endpoint, client, dataset, **options):
+        requests = self.get_requests(endpoint, dataset, options["requests"])
+        count_queries = options["server"] is None
+        expected = EXPECTED_STATUSES[endpoint]
+
+        def call(request):
+            method, path, data, token = request
+            queries = []
+
+            def counter(execute, sql, params, many, context):
+                queries.append(sql)
+                return execute(sql, params, many, context)
+
+            with connection.execute_wrapper(counter):
+                start = time.perf_counter()
+                if method == "get":
+                    status_code = client.get(path, token)
+                else:
+                    status_code = client.post(path, data, token)
+                latency = time.perf_counter() - start
+            return latency, len(queries), status_code
+
+        with ThreadPoolExecutor(options["concurrency"]) as executor:
+            start = time.perf_counter()
+            outcomes = list(executor.map(call, requests))
+            elapsed = time.perf_counter() - start
+
+        latencies, queries, statuses = zip(*outcomes)
+        summary = summarize(
+            latencies, elapsed, queries if count_queries else None
+        )
+        summary["errors"] = sum(
+            status_code not in expected for status_code in statuses
+        )
+
+        self.stdout.write(
+            f"{endpoint:<20} {format_summary(summary)}  "
+            f"{summary['errors']} errors"
+        )
+        return summary
@@ -0,0 +1,161 @@
+import asyncio
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+
+from rest_framework.test import APIRequestFactory
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncRequestFactory, override_settings
+
+from core import async_views, views
+from core.authentication import create_token
+from core.benchmarks import format_summary, summarize, synthetic_image
+from core.binary_images import render_binary_image
+from core.models import BinaryImageLink, Image, Thumbnail, Tier
+from core.thumbnails import generate_thumbnails
+
+
+class Command(BaseCommand):
+    """Compare the sync (WSGI) and async (ASGI) read views"""
+
+    help = (
+        "Compare the sync DRF views served on a thread pool with the async "
+        "views served on one event loop, for link retrieval and the image "
+        "list."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=1000)
+        parser.add_argument("--concurrency", type=int, default=100)
+        parser.add_argument("--images", type=int, default=10)
+
+    def handle(self, *args, **options):
+        for option in ("requests", "concurrency", "images"):
+            if options[option] < 1:
+                raise CommandError(f"--{option} must be at least 1.")
+
+        user, link = self.seed(options["images"])
+        # The request factories send "Host: testserver".
+        allowed_hosts = override_settings(
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]
+        )
+        try:
+            allowed_hosts.enable()
+            authorization = f"Bearer {create_token(user)}"
+            endpoints = (
+                (
+                    "get-binary-link",
+                    f"/api/images/{link.id}/",
+                    {"binary_pk": link.id},
+                    views.RetrieveBinaryLinkView.as_view(),
+                    async_views.retrieve_binary_link,
+                ),
+                (
+                    "images-list",
+                    f"/api/images/?limit={options['images']}",
+                    {},
+                    views.ImageListViewSet.as_view({"get": "list"}),
+                    async_views.image_list,
+                ),
+            )
+
+            for name, path, kwargs, sync_view, async_view in endpoints:
+                wsgi = self.run_sync(
+                    sync_view, path, kwargs, authorization, **options
+                )
+                asgi = asyncio.run(
+                    self.run_async(
+                        async_view, path, kwargs, authorization, **options
+                    )
+                )
+                for mode, latencies, elapsed in (wsgi, asgi):
+                    self.report(name, mode, latencies, elapsed)
+        finally:
+            allowed_hosts.disable()
+            user.delete()
+            user.tier.delete()
+
+    def seed(self, images):
+        """
+        Creates a throwaway Enterprise user with ``images`` images and a
+        rendered binary link. Everything is removed with the user.
+        """
+        suffix = uuid4().hex[:8]
+        tier = Tier.objects.create(
+            name=f"Benchmark {suffix}", can_create_link=True
+        )
+        tier.thumbnails.set(
+            [
+                Thumbnail.objects.get_or_create(value=value)[0]
+                for value in (100, 300)
+            ]
+        )
+        user = get_user_model().objects.create_user(
+            username=f"benchmark-{suffix}",
+            email=f"benchmark-{suffix}@example.com",
+            password=uuid4().hex,
+            tier=tier,
+        )
+
+        for _ in range(images):
+            image = Image.objects.create(
+                user=user,
+                image=SimpleUploadedFile(
+                    "image.png", synthetic_image(400, 300)
+                ),
+            )
+            generate_thumbnails(image.pk)
+
+        render_binary_image(image.pk)
+        link = BinaryImageLink.objects.create(
+            user=user, image=image, exist_seconds=30000
+        )
+        return user, link
+
+    def run_sync(self, view, path, kwargs, authorization, **options):
+        factory = APIRequestFactory()
+
+        def call(_):
+            request = factory.get(path, HTTP_AUTHORIZATION=authorization)
+            start = time.perf_counter()
+            response = view(request, **kwargs)
+            response.render()
+            latency = time.perf_counter() - start
+            if response.status_code != 200:
+                raise RuntimeError(f"{path} returned {response.status_code}")
+            return latency
+
+        with ThreadPoolExecutor(options["concurrency"]) as executor:
+            start = time.perf_counter()
+            latencies = list(executor.map(call, range(options["requests"])))
+            elapsed = time.perf_counter() - start
+        return "wsgi", latencies, elapsed
+
+    async def run_async(self, view, path, kwargs, authorization, **options):
+        factory = AsyncRequestFactory()
+        semaphore = asyncio.Semaphore(options["concurrency"])
+
+        async def call():
+            async with semaphore:
+                request = factory.get(path, authorization=authorization)
+                start = time.perf_counter()
+                response = await view(request, **kwargs)
+                latency = time.perf_counter() - start
+            if response.status_code != 200:
+                raise RuntimeError(f"{path} returned {response.status_code}")
+            return latency
+
+        start = time.perf_counter()
+        latencies = await asyncio.gather(
+            *(call() for _ in range(options["requests"]))
+        )
+        return "asgi", latencies, time.perf_counter() - start
+
+    def report(self, name, mode, latencies, elapsed):
+        summary = summarize(latencies, elapsed)
+        self.stdout.write(f"{name:<16} {mode}  {format_summary(summary)}")
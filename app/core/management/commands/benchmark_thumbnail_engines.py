@@ -0,0 +1,83 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from sorl.thumbnail import default
+from sorl.thumbnail.helpers import get_module_class
+from sorl.thumbnail.parsers import parse_geometry
+
+from core.benchmarks import synthetic_image
+from core.thumbnails import THUMBNAIL_OPTIONS, thumbnail_geometry
+
+DEFAULT_ENGINES = (
+    "sorl.thumbnail.engines.pil_engine.Engine",
+    "core.thumbnail_engine.Engine",
+)
+
+
+class BytesSource:
+    def __init__(self, data):
+        self.data = data
+
+    def read(self):
+        return self.data
+
+
+class Command(BaseCommand):
+    """Compare thumbnail engine throughput"""
+
+    help = "Compare the throughput of sorl thumbnail engines."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--width", type=int, default=4000)
+        parser.add_argument("--height", type=int, default=3000)
+        parser.add_argument(
+            "--format", default="JPEG", choices=("JPEG", "PNG")
+        )
+        parser.add_argument(
+            "--heights", type=int, nargs="+", default=[100, 300, 1000]
+        )
+        parser.add_argument("--iterations", type=int, default=10)
+        parser.add_argument(
+            "--engines", nargs="+", default=list(DEFAULT_ENGINES)
+        )
+
+    def handle(self, *args, **options):
+        data = synthetic_image(
+            options["width"], options["height"], options["format"]
+        )
+        self.stdout.write(
+            f"Source: {options['width']}x{options['height']} "
+            f"{options['format']}, {len(data)} bytes"
+        )
+
+        engines = [get_module_class(path)() for path in options["engines"]]
+        for height in options["heights"]:
+            rates = [
+                self.benchmark(engine, data, height, options["iterations"])
+                for engine in engines
+            ]
+            for path, rate in zip(options["engines"], rates):
+                self.stdout.write(
+                    f"x{height:<6} {path:<45} {rate:8.2f} thumbnails/s "
+                    f"({rate / rates[0]:.2f}x)"
+                )
+
+    def benchmark(self, engine, data, height, iterations):
+        thumbnail_options = dict(default.backend.default_options)
+        thumbnail_options.update(THUMBNAIL_OPTIONS)
+
+        start = time.perf_counter()
+        for _ in range(iterations):
+            image = engine.get_image(BytesSource(data))
+            ratio = engine.get_image_ratio(image, thumbnail_options)
+            geometry = parse_geometry(thumbnail_geometry(height), ratio)
+
+            thumbnail = engine.create(image, geometry, thumbnail_options)
+            engine._get_raw_data(
+                thumbnail,
+                thumbnail_options["format"],
+                thumbnail_options["quality"],
+                engine.get_image_info(image),
+            )
+        return iterations / (time.perf_counter() - start)
@@ -0,0 +1,322 @@
+import itertools
+import os
+import time
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from sorl.thumbnail import default
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.helpers import deserialize
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix, del_prefix
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+from core.models import BinaryImageLink, Image, upload_owner
+
+UPLOADS_DIR = "uploads"
+
+
+def walk_files(path):
+    """
+    Yields the ``os.DirEntry`` of every file below ``path``. Only one
+    directory listing per level is open at a time, so memory does not grow
+    with the number of files.
+    """
+    try:
+        entries = os.scandir(path)
+    except FileNotFoundError:
+        return
+    with entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from walk_files(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                yield entry
+
+
+def stored_files(directory):
+    """
+    Yields ``(name, size, mtime)`` of every stored file below ``directory``,
+    from a walk of local storage or the object listing of object storage.
+    """
+    list_files = getattr(default_storage, "list_files", None)
+    if list_files is not None:
+        yield from list_files(directory)
+        return
+
+    root = default_storage.path("")
+    for entry in walk_files(default_storage.path(directory)):
+        stat = entry.stat(follow_symlinks=False)
+        name = os.path.relpath(entry.path, root).replace(os.sep, "/")
+        yield name, stat.st_size, stat.st_mtime
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+def referenced_uploads(names):
+    """
+    Returns the subset of upload file ``names`` that images or binary
+    links point at. Lookups go through the owners, which are indexed.
+    """
+    usernames, user_ids = set(), set()
+    for name in names:
+        owner = upload_owner(name) or {}
+        if "user_id" in owner:
+            user_ids.add(owner["user_id"])
+        elif "user__username" in owner:
+            usernames.add(owner["user__username"])
+    owners = Q(user__username__in=usernames) | Q(user_id__in=user_ids)
+    images = Image.objects.filter(owners)
+    referenced = set(
+        images.filter(image__in=names).values_list("image", flat=True)
+    )
+    referenced.update(
+        images.filter(binary_image__in=names).values_list(
+            "binary_image", flat=True
+        )
+    )
+    referenced.update(
+        BinaryImageLink.objects.filter(
+            owners, binary_image__in=names
+        ).values_list("binary_image", flat=True)
+    )
+    return referenced
+
+
+def stored_thumbnails(names):
+    """
+    Returns the subset of thumbnail file ``names`` with a kvstore entry.
+    """
+    keys = {
+        add_prefix(ImageFile(name, default.storage).key): name
+        for name in names
+    }
+    stored = KVStoreModel.objects.filter(key__in=keys).values_list(
+        "key", flat=True
+    )
+    return {keys[key] for key in stored}
+
+
+def thumbnail_sizes(thumbnails):
+    """
+    Returns ``{name: size}`` of the ``thumbnails`` whose file exists, from
+    a lookup per file, so memory is bounded by the batch asked about.
+    """
+    sizes = {}
+    for thumbnail in thumbnails:
+        if thumbnail.exists():
+            sizes[thumbnail.name] = thumbnail.storage.size(thumbnail.name)
+    return sizes
+
+
+def source_key(list_key):
+    return list_key.replace("||thumbnails||", "||image||", 1)
+
+
+def thumbnail_list_key(key):
+    return key.replace("||image||", "||thumbnails||", 1)
+
+
+def image_key(key):
+    return add_prefix(del_prefix(key))
+
+
+def recorded_source_key(key):
+    return add_prefix(del_prefix(key), identity="source")
+
+
+class Command(BaseCommand):
+    """Delete orphaned media files and stale thumbnail kvstore entries"""
+
+    help = (
+        "Delete uploads no image or link references, thumbnails without "
+        "kvstore entry, thumbnails of deleted images and kvstore entries of "
+        "missing files. Streams the media tree and the kvstore in batches."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--min-age",
+            type=int,
+            default=3600,
+            help=(
+                "Seconds a file must be unmodified for before it is "
+                "collected, so uploads in flight are left alone."
+            ),
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report what would be deleted.",
+        )
+
+    def handle(self, *args, **options):
+        self.batch_size = options["batch_size"]
+        self.dry_run = options["dry_run"]
+        self.reclaimed = 0
+
+        # Thumbnails of deleted images go first, so the walk of the
+        # thumbnail directory does not have to find them one by one.
+        self.sweep_kvstore()
+
+        cutoff = time.time() - options["min_age"]
+        self.sweep_files(UPLOADS_DIR, referenced_uploads, cutoff)
+        self.sweep_files(
+            thumbnail_settings.THUMBNAIL_PREFIX.rstrip("/"),
+            stored_thumbnails,
+            cutoff,
+        )
+
+        verb = "Would reclaim" if self.dry_run else "Reclaimed"
+        self.stdout.write(
+            self.style.SUCCESS(f"{verb} {self.reclaimed} bytes.")
+        )
+
+    def sweep_files(self, directory, find_referenced, cutoff):
+        scanned = orphans = size = 0
+
+        for batch in batched(stored_files(directory), self.batch_size):
+            scanned += len(batch)
+            referenced = find_referenced([name for name, _, _ in batch])
+            for name, file_size, mtime in batch:
+                if name in referenced or mtime > cutoff:
+                    continue
+
+                orphans += 1
+                size += file_size
+                if not self.dry_run:
+                    default_storage.delete(name)
+
+        self.reclaimed += size
+        self.stdout.write(
+            f"{directory}/: {scanned} files scanned, {orphans} orphans, "
+            f"{size} bytes"
+        )
+
+    def sweep_kvstore(self):
+        """
+        Pages through the kvstore by key. Sources of deleted images are
+        dropped with their thumbnails, thumbnail lists without a source
+        with the thumbnails listed, and thumbnails whose file is gone.
+        """
+        prefix = thumbnail_settings.THUMBNAIL_KEY_PREFIX
+        rows = KVStoreModel.objects.filter(key__startswith=prefix).order_by(
+            "key"
+        )
+        scanned = stale = 0
+        last_key = ""
+
+        while True:
+            page = rows.filter(key__gt=last_key).values_list("key", "value")
+            batch = list(page[: self.batch_size])
+            if not batch:
+                break
+            last_key = batch[-1][0]
+            scanned += len(batch)
+
+            sources, lists, recorded, thumbnails = {}, [], [], []
+            for key, value in batch:
+                identity = key.split("||")[1]
+                if identity == "thumbnails":
+                    lists.append(key)
+                    continue
+                if identity == "source":
+                    recorded.append(key)
+                    continue
+                image_file = deserialize_image_file(value)
+                if image_file.name.startswith(
+                    thumbnail_settings.THUMBNAIL_PREFIX
+                ):
+                    thumbnails.append((key, image_file))
+                elif upload_owner(image_file.name) is not None:
+                    sources[image_file.name] = key
+
+            dropped = self.drop_sources(sources)
+            lists = [key for key in lists if source_key(key) not in dropped]
+            stale += len(dropped)
+            stale += self.drop_lists(lists)
+            stale += self.drop_missing_thumbnails(thumbnails)
+            stale += self.drop_recorded_sources(recorded)
+
+        self.stdout.write(f"kvstore: {scanned} entries scanned, {stale} stale")
+
+    def drop_sources(self, sources):
+        """
+        Drops the entries of ``{name: key}`` sources no image references
+        any more, with their thumbnails. Returns the keys dropped.
+        """
+        unreferenced = set(sources) - referenced_uploads(list(sources))
+        dropped = {sources[name] for name in unreferenced}
+        self.drop_thumbnail_lists([thumbnail_list_key(key) for key in dropped])
+        self.delete_keys(*dropped)
+        return dropped
+
+    def drop_lists(self, lists):
+        existing = set(
+            KVStoreModel.objects.filter(
+                key__in=[source_key(key) for key in lists]
+            ).values_list("key", flat=True)
+        )
+        orphaned = [key for key in lists if source_key(key) not in existing]
+        self.drop_thumbnail_lists(orphaned)
+        return len(orphaned)
+
+    def drop_thumbnail_lists(self, list_keys):
+        """
+        Deletes sources' thumbnail lists with the thumbnails on them.
+        """
+        if not list_keys:
+            return
+
+        thumbnail_keys = []
+        for value in KVStoreModel.objects.filter(
+            key__in=list_keys
+        ).values_list("value", flat=True):
+            thumbnail_keys += deserialize(value)
+        rows = [
+            (row.key, deserialize_image_file(row.value))
+            for row in KVStoreModel.objects.filter(
+                key__in=[add_prefix(key) for key in thumbnail_keys]
+            )
+        ]
+        sizes = thumbnail_sizes([thumbnail for _, thumbnail in rows])
+        for key, thumbnail in rows:
+            if thumbnail.name in sizes:
+                self.reclaimed += sizes[thumbnail.name]
+                if not self.dry_run:
+                    thumbnail.delete()
+            self.delete_keys(key, recorded_source_key(key))
+        self.delete_keys(*list_keys)
+
+    def drop_missing_thumbnails(self, thumbnails):
+        missing = [
+            key for key, thumbnail in thumbnails if not thumbnail.exists()
+        ]
+        self.delete_keys(
+            *missing, *[recorded_source_key(key) for key in missing]
+        )
+        return len(missing)
+
+    def drop_recorded_sources(self, keys):
+        """
+        Drops the recorded sources of thumbnails without kvstore entry.
+        """
+        existing = set(
+            KVStoreModel.objects.filter(
+                key__in=[image_key(key) for key in keys]
+            ).values_list("key", flat=True)
+        )
+        orphaned = [key for key in keys if image_key(key) not in existing]
+        self.delete_keys(*orphaned)
+        return len(orphaned)
+
+    def delete_keys(self, *keys):
+        if keys and not self.dry_run:
+            default.kvstore._delete_raw(*keys)
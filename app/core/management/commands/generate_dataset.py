@@ -0,0 +1,387 @@
+import csv
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from datetime import timedelta
+from io import StringIO
+from uuid import UUID, uuid4
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, models, transaction
+from django.utils import timezone
+
+from core.benchmarks import EXTENSIONS, TIERS, write_synthetic_image
+from core.models import (
+    BinaryImageLink,
+    Image,
+    Thumbnail,
+    Tier,
+    user_file_path,
+    user_upload_dir,
+)
+from core.tasks import run_parallel
+
+
+def parse_size(value):
+    width, height = map(int, value.split("x"))
+    return width, height
+
+
+def parse_weights(value, parse_key=str):
+    """
+    Parses a distribution like ``"Basic=6,Premium=3,Enterprise=1"`` into
+    ``{key: weight}``. A key without a weight counts as 1.
+    """
+    weights = {}
+    for item in value.split(","):
+        key, _, weight = item.partition("=")
+        try:
+            weights[parse_key(key.strip())] = float(weight or 1)
+        except ValueError:
+            raise CommandError(f"Invalid distribution entry {item!r}.")
+    if sum(weights.values()) <= 0:
+        raise CommandError(f"Distribution {value!r} has no weight.")
+    return weights
+
+
+def copy_rows(model, objs):
+    """
+    Loads ``objs`` with a single ``COPY ... FROM STDIN``, the fastest way
+    into PostgreSQL. Signals are not sent, like with ``bulk_create``.
+    """
+    fields = [
+        field
+        for field in model._meta.concrete_fields
+        if not isinstance(field, models.AutoField)
+    ]
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    for obj in objs:
+        row = []
+        for field in fields:
+            value = field.get_db_prep_save(
+                getattr(obj, field.attname), connection
+            )
+            row.append(r"\N" if value is None else value)
+        writer.writerow(row)
+    buffer.seek(0)
+
+    quote_name = connection.ops.quote_name
+    columns = ", ".join(quote_name(field.column) for field in fields)
+    with connection.cursor() as cursor:
+        cursor.copy_expert(
+            f"COPY {quote_name(model._meta.db_table)} ({columns}) "
+            r"FROM STDIN WITH (FORMAT csv, NULL '\N')",
+            buffer,
+        )
+
+
+class Command(BaseCommand):
+    """Generate a large synthetic dataset for scale testing"""
+
+    help = (
+        "Generate users, images with files on disk and binary links in "
+        "bulk, with configurable tier, image size and format distributions."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--images-per-user", type=int, default=10)
+        parser.add_argument(
+            "--links-per-image",
+            type=float,
+            default=0.5,
+            help="Mean binary links per image of tiers that can create them.",
+        )
+        parser.add_argument(
+            "--expired-ratio",
+            type=float,
+            default=0.5,
+            help="Share of links that have already expired.",
+        )
+        parser.add_argument(
+            "--tiers",
+            default="Basic=6,Premium=3,Enterprise=1",
+            help="Tier distribution of the users.",
+        )
+        parser.add_argument(
+            "--image-sizes",
+            default="800x600=6,1920x1080=3,4000x3000=1",
+            help="WIDTHxHEIGHT distribution of the images.",
+        )
+        parser.add_argument(
+            "--formats",
+            default="JPEG=8,PNG=2",
+            help=f"Distribution of {', '.join(EXTENSIONS)} images.",
+        )
+        parser.add_argument(
+            "--pool-size",
+            type=int,
+            default=200,
+            help=(
+                "Distinct images synthesized on the image worker pool. "
+                "Image files are hard links into this pool."
+            ),
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Users written per transaction.",
+        )
+        parser.add_argument(
+            "--prefix",
+            default="synthetic",
+            help="Usernames are PREFIX-RUN-N.",
+        )
+        parser.add_argument(
+            "--password",
+            help="Password of every user. Unusable by default.",
+        )
+        parser.add_argument(
+            "--seed", type=int, help="Seed for a reproducible dataset."
+        )
+        parser.add_argument(
+            "--delete",
+            action="store_true",
+            help="Delete every user named PREFIX-* and their files instead.",
+        )
+
+    def handle(self, *args, **options):
+        self.batch_size = options["batch_size"]
+        users = get_user_model().objects.filter(
+            username__startswith=f"{options['prefix']}-"
+        )
+        if options["delete"]:
+            self.delete(users)
+            return
+
+        try:
+            default_storage.path("")
+        except NotImplementedError:
+            raise CommandError(
+                "Image files are hard linked, which needs local media storage."
+            )
+
+        tiers = parse_weights(options["tiers"])
+        sizes = parse_weights(options["image_sizes"], parse_size)
+        formats = parse_weights(options["formats"], str.upper)
+        unknown = set(formats) - set(EXTENSIONS)
+        if unknown:
+            raise CommandError(f"Unsupported formats: {', '.join(unknown)}.")
+
+        self.random = random.Random(options["seed"])
+        self.tiers = {name: self.get_tier(name) for name in tiers}
+        self.tier_weights = tiers
+        self.password = make_password(options["password"])
+
+        # Hard links need the pool on the same filesystem as the media.
+        os.makedirs(settings.MEDIA_ROOT, exist_ok=True)
+        pool_dir = tempfile.mkdtemp(dir=settings.MEDIA_ROOT)
+        try:
+            self.pool = self.synthesize(
+                pool_dir, sizes, formats, options["pool_size"]
+            )
+
+            start = time.perf_counter()
+            counts = [0, 0, 0]
+            prefix = f"{options['prefix']}-{uuid4().hex[:8]}"
+            for first in range(0, options["users"], self.batch_size):
+                last = min(first + self.batch_size, options["users"])
+                usernames = [
+                    f"{prefix}-{index}" for index in range(first, last)
+                ]
+                with transaction.atomic():
+                    batch = self.create_batch(usernames, **options)
+                counts = [a + b for a, b in zip(counts, batch)]
+            elapsed = time.perf_counter() - start
+        finally:
+            shutil.rmtree(pool_dir)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Created {counts[0]} users, {counts[1]} images and "
+                f"{counts[2]} binary links in {elapsed:.1f}s "
+                f"({sum(counts) / elapsed:.0f} rows/s)."
+            )
+        )
+
+    def get_tier(self, name):
+        tier = Tier.objects.filter(name=name).first()
+        if tier is not None:
+            return tier
+        if name not in TIERS:
+            raise CommandError(f"Tier {name!r} does not exist.")
+
+        heights, can_create_link = TIERS[name]
+        tier = Tier.objects.create(name=name, can_create_link=can_create_link)
+        tier.thumbnails.set(
+            [
+                Thumbnail.objects.get_or_create(value=value)[0]
+                for value in heights
+            ]
+        )
+        return tier
+
+    def synthesize(self, pool_dir, sizes, formats, count):
+        """
+        Renders ``count`` distinct source images in parallel and returns
+        their ``(path, content_hash)``.
+        """
+        start = time.perf_counter()
+        specs = [
+            (pool_dir, *size, fmt)
+            for size, fmt in zip(
+                self.random.choices(
+                    list(sizes), weights=list(sizes.values()), k=count
+                ),
+                self.random.choices(
+                    list(formats), weights=list(formats.values()), k=count
+                ),
+            )
+        ]
+        pool = run_parallel(write_synthetic_image, specs)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f"Synthesized {count} source images in {elapsed:.1f}s "
+            f"({count / elapsed:.1f} images/s)"
+        )
+        return pool
+
+    def create_batch(self, usernames, **options):
+        """
+        Writes a user for each of ``usernames`` with their images and links.
+        Returns the number of rows of each.
+        """
+        User = get_user_model()
+        tier_names = self.random.choices(
+            list(self.tier_weights),
+            weights=list(self.tier_weights.values()),
+            k=len(usernames),
+        )
+        self.load(
+            User,
+            [
+                User(
+                    username=username,
+                    email=f"{username}@example.com",
+                    password=self.password,
+                    tier=self.tiers[tier_name],
+                )
+                for username, tier_name in zip(usernames, tier_names)
+            ],
+        )
+        users = list(
+            User.objects.filter(username__in=usernames).values_list(
+                "id", "username", "tier__can_create_link"
+            )
+        )
+
+        images = []
+        for user_id, username, _ in users:
+            images.extend(
+                self.user_images(user_id, username, options["images_per_user"])
+            )
+        self.load(Image, images)
+
+        can_create_link = {user_id for user_id, _, allowed in users if allowed}
+        link_images = Image.objects.filter(
+            user_id__in=can_create_link
+        ).values_list("id", "user_id")
+        links = self.links(
+            link_images, options["links_per_image"], options["expired_ratio"]
+        )
+        self.load(BinaryImageLink, links)
+        return len(usernames), len(images), len(links)
+
+    def user_images(self, user_id, username, count):
+        """
+        Hard links ``count`` pool images into the user's upload directory
+        under their content hash, where an upload would have been stored.
+        """
+        if count <= len(self.pool):
+            picks = self.random.sample(self.pool, count)
+        else:
+            picks = self.random.choices(self.pool, k=count)
+
+        owner = get_user_model()(pk=user_id, username=username)
+        images = []
+        for path, content_hash in picks:
+            ext = os.path.splitext(path)[1]
+            name = user_file_path(owner, f"{content_hash}{ext}")
+            target = default_storage.path(name)
+            if not os.path.exists(target):
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                try:
+                    os.link(path, target)
+                except OSError:
+                    shutil.copyfile(path, target)
+            images.append(
+                Image(user_id=user_id, image=name, content_hash=content_hash)
+            )
+        return images
+
+    def links(self, images, links_per_image, expired_ratio):
+        now = timezone.now()
+        whole, fraction = divmod(links_per_image, 1)
+        links = []
+        for image_id, user_id in images:
+            count = int(whole) + (self.random.random() < fraction)
+            for _ in range(count):
+                exist_seconds = self.random.randint(300, 30000)
+                if self.random.random() < expired_ratio:
+                    age = exist_seconds + self.random.randint(1, 86400)
+                else:
+                    age = self.random.randint(0, exist_seconds - 1)
+                date_created = now - timedelta(seconds=age)
+                links.append(
+                    BinaryImageLink(
+                        id=UUID(int=self.random.getrandbits(128), version=4),
+                        image_id=image_id,
+                        user_id=user_id,
+                        exist_seconds=exist_seconds,
+                        date_created=date_created,
+                        expires_at=date_created
+                        + timedelta(seconds=exist_seconds),
+                    )
+                )
+        return links
+
+    def load(self, model, objs):
+        if not objs:
+            return
+        if connection.vendor == "postgresql":
+            copy_rows(model, objs)
+        else:
+            model.objects.bulk_create(objs, batch_size=self.batch_size)
+
+    def delete(self, users):
+        User = get_user_model()
+        deleted = 0
+        while True:
+            batch = list(
+                users.values_list("pk", "username")[: self.batch_size]
+            )
+            if not batch:
+                break
+
+            pks = [pk for pk, _ in batch]
+            User.objects.filter(pk__in=pks).delete()
+            for pk, username in batch:
+                owner = User(pk=pk, username=username)
+                shutil.rmtree(
+                    default_storage.path(user_upload_dir(owner)),
+                    ignore_errors=True,
+                )
+            deleted += len(pks)
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Deleted {deleted} synthetic users.")
+        )
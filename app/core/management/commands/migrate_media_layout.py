@@ -0,0 +1,275 @@
+import json
+import os
+import time
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Case, Q, Value, When
+from django.utils import timezone
+
+from sorl.thumbnail import default
+
+from core.backfill import RateLimiter
+from core.binary_images import cache_binary_link
+from core.media import link_media
+from core.models import (
+    MEDIA_PATH_LAYOUTS,
+    BinaryImageLink,
+    Image,
+    user_file_path,
+)
+from core.thumbnails import (
+    THUMBNAIL_VARIANTS,
+    thumbnail_geometry,
+    thumbnail_options,
+)
+from core.tiers import load_tiers
+
+# Models in migration order, with their file fields and the subdirectory
+# of the user's uploads each field is stored in.
+PHASES = {
+    "images": (Image, {"image": "", "binary_image": "binary"}),
+    "links": (BinaryImageLink, {"binary_image": "binary"}),
+}
+
+
+def rewrite_names(model, field, names):
+    """
+    Points every ``field`` of ``model`` at ``{name: new_name}`` in a single
+    UPDATE, including rows outside the batch sharing a file.
+    """
+    model.objects.filter(**{f"{field}__in": list(names)}).update(
+        **{
+            field: Case(
+                *[
+                    When(**{field: name}, then=Value(new_name))
+                    for name, new_name in names.items()
+                ],
+                default=field,
+                output_field=model._meta.get_field(field),
+            )
+        }
+    )
+
+
+class Command(BaseCommand):
+    """Move uploads to another storage layout"""
+
+    help = (
+        "Move the files of images and binary links to the MEDIA_PATH_LAYOUT "
+        "directory layout and rewrite their paths in batches, with resumable "
+        "progress. Files are linked to their new name before rows point at "
+        "it and the old name is only removed afterwards, so media stays "
+        "available throughout."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--layout",
+            choices=MEDIA_PATH_LAYOUTS,
+            default=settings.MEDIA_PATH_LAYOUT,
+            help="Target layout. Defaults to MEDIA_PATH_LAYOUT.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Rows moved per transaction.",
+        )
+        parser.add_argument(
+            "--rate",
+            type=float,
+            default=0,
+            help="Maximum files moved per second. 0 is unlimited.",
+        )
+        parser.add_argument(
+            "--checkpoint",
+            help=(
+                "Progress file. An interrupted run started again with the "
+                "same file resumes where it stopped."
+            ),
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only count the files to move.",
+        )
+
+    def handle(self, *args, **options):
+        self.layout = options["layout"]
+        self.dry_run = options["dry_run"]
+        self.limiter = RateLimiter(options["rate"])
+        self.planned = set()
+        self.variants = [
+            (thumbnail_geometry(height), thumbnail_options(variant))
+            for height in sorted(
+                {h for tier in load_tiers().values() for h in tier.heights}
+            )
+            for variant in (None, *THUMBNAIL_VARIANTS)
+        ]
+
+        checkpoint = None if self.dry_run else options["checkpoint"]
+        phase, start_after = self.read_checkpoint(checkpoint)
+
+        start = time.perf_counter()
+        self.totals = {"rows": 0, "files": 0, "thumbnails": 0, "missing": 0}
+        phases = list(PHASES)
+        first = phases.index(phase)
+        for name in phases[first:]:
+            model, fields = PHASES[name]
+            for last_pk in self.migrate(
+                model, fields, start_after, options["batch_size"]
+            ):
+                self.write_checkpoint(checkpoint, name, last_pk)
+                self.report(time.perf_counter() - start)
+            start_after = None
+
+        if checkpoint and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+        verb = "Would move" if self.dry_run else "Moved"
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{verb} {self.totals['files']} files and "
+                f"{self.totals['thumbnails']} thumbnails to the "
+                f"{self.layout} layout."
+            )
+        )
+
+    def migrate(self, model, fields, start_after, batch_size):
+        """
+        Moves the files of ``model`` rows in pk order, starting after
+        ``start_after``. Yields the last pk of every batch done.
+        """
+        rows = model.objects.select_related("user").order_by("pk")
+        if model is BinaryImageLink:
+            # Only links rendered before they shared their image's file.
+            rows = rows.exclude(binary_image="")
+        if start_after is not None:
+            rows = rows.filter(pk__gt=start_after)
+
+        while True:
+            batch = list(rows[:batch_size])
+            if not batch:
+                return
+            last_pk = batch[-1].pk
+            rows = rows.filter(pk__gt=last_pk)
+            self.totals["rows"] += len(batch)
+
+            moves = {field: {} for field in fields}
+            for row in batch:
+                for field, subdir in fields.items():
+                    name = getattr(row, field).name
+                    if not name:
+                        continue
+                    new_name = user_file_path(
+                        row.user, os.path.basename(name), subdir, self.layout
+                    )
+                    if new_name != name and name not in self.planned:
+                        moves[field][name] = new_name
+
+            self.move(model, moves)
+            yield str(last_pk)
+
+    def move(self, model, moves):
+        """
+        Moves ``{field: {name: new_name}}`` files of ``model``: links them
+        to the new names, carries generated thumbnails over, points the
+        rows at the new names in one transaction, caches the URLs of
+        affected binary links again and then removes the old names with
+        their thumbnails.
+        """
+        count = sum(len(names) for names in moves.values())
+        self.totals["files"] += count
+        if self.dry_run:
+            # Rows are not rewritten, so later batches would count files
+            # shared with earlier rows again.
+            for names in moves.values():
+                self.planned.update(names)
+            return
+        if not count:
+            return
+        self.limiter.wait(count)
+
+        for names in moves.values():
+            for name, new_name in list(names.items()):
+                if not link_media(default_storage, name, new_name):
+                    self.totals["files"] -= 1
+                    self.totals["missing"] += 1
+                    self.stderr.write(f"Missing file {name}, not moved.")
+                    del names[name]
+        if model is Image:
+            self.totals["thumbnails"] += default.backend.link_thumbnails(
+                moves["image"], self.variants
+            )
+
+        with transaction.atomic():
+            for field, names in moves.items():
+                if names:
+                    rewrite_names(model, field, names)
+        # Uploads deduplicated against an old name commit before the
+        # rewrite gets the lock on the image they share it with, but are
+        # not rewritten by it. Nothing can share the old names any more.
+        for field, names in moves.items():
+            if names:
+                rewrite_names(model, field, names)
+        self.recache_binary_links(moves.get("binary_image", {}))
+
+        for names in moves.values():
+            for name in names:
+                # Drops the old name's kvstore entry and thumbnails too.
+                default.backend.delete(name)
+
+    def recache_binary_links(self, names):
+        """
+        Caches the URLs of the binary links of moved ``{name: new_name}``
+        binary images again, before the old names are removed.
+        """
+        if not names:
+            return
+
+        new_names = list(names.values())
+        links = BinaryImageLink.objects.filter(
+            Q(image__binary_image__in=new_names)
+            | Q(binary_image__in=new_names),
+            expires_at__gt=timezone.now(),
+        ).select_related("image")
+        for link in links:
+            cache_binary_link(link)
+
+    def read_checkpoint(self, path):
+        first = next(iter(PHASES))
+        if not path or not os.path.exists(path):
+            return first, None
+
+        with open(path) as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+        if checkpoint["layout"] != self.layout:
+            raise CommandError(
+                f"{path} belongs to a migration to the "
+                f"{checkpoint['layout']} layout."
+            )
+        self.stdout.write(
+            f"Resuming {checkpoint['phase']} after {checkpoint['last_pk']}"
+        )
+        return checkpoint["phase"], checkpoint["last_pk"]
+
+    def write_checkpoint(self, path, phase, last_pk):
+        if not path:
+            return
+
+        with open(f"{path}.tmp", "w") as checkpoint_file:
+            json.dump(
+                {"layout": self.layout, "phase": phase, "last_pk": last_pk},
+                checkpoint_file,
+            )
+        os.replace(f"{path}.tmp", path)
+
+    def report(self, elapsed):
+        rows, files = self.totals["rows"], self.totals["files"]
+        self.stdout.write(
+            f"{rows} rows checked, {files} files moved "
+            f"({files / elapsed:.1f}/s), {self.totals['missing']} missing"
+        )
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.models import BinaryImageLink
+
+
+class Command(BaseCommand):
+    """Delete expired binary image links and their files in batches"""
+
+    help = "Delete expired binary image links and their files in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        now = timezone.now()
+        expired = BinaryImageLink.objects.filter(expires_at__lte=now)
+        deleted = 0
+
+        while True:
+            pks = list(expired.values_list("pk", flat=True)[:batch_size])
+            if not pks:
+                break
+
+            # django_cleanup removes the files of the deleted rows.
+            BinaryImageLink.objects.filter(pk__in=pks).delete()
+            deleted += len(pks)
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Deleted {deleted} expired binary links.")
+        )
@@ -0,0 +1,134 @@
+import hashlib
+import mimetypes
+import os
+import posixpath
+import shutil
+
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import default_storage
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponse,
+    HttpResponseRedirect,
+)
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def normalize_media_name(name):
+    name = posixpath.normpath(name).lstrip("/")
+    if name.startswith("..") or name == ".":
+        raise Http404
+    return name
+
+
+def link_media(storage, name, new_name):
+    """
+    Makes the stored file ``name`` available as ``new_name`` too, as a hard
+    link on local storage so no bytes are copied, or a copy inside the
+    store on object storage. Returns False when ``name`` does not exist.
+    """
+    if storage.exists(new_name):
+        return True
+    if not storage.exists(name):
+        return False
+
+    try:
+        path, new_path = storage.path(name), storage.path(new_name)
+    except NotImplementedError:
+        storage.copy(name, new_name)
+        return True
+
+    os.makedirs(os.path.dirname(new_path), exist_ok=True)
+    try:
+        os.link(path, new_path)
+    except FileExistsError:
+        pass
+    except OSError:
+        shutil.copy2(path, new_path)
+    return True
+
+
+def media_url(field_file, expire=None):
+    """
+    URL of a stored file. Object storage presigns it for ``expire`` seconds
+    (its default expiry when None) and clients read from the store.
+    """
+    if getattr(field_file.storage, "querystring_auth", False):
+        return field_file.storage.url(field_file.name, expire=expire)
+    return field_file.url
+
+
+def media_etag(name, stat):
+    """
+    Strong validator for a stored file. Media names are never reused for
+    different content, so name, size and mtime identify the bytes.
+    """
+    key = f"{name}:{stat.st_size}:{stat.st_mtime_ns}"
+    return '"%s"' % hashlib.md5(key.encode()).hexdigest()
+
+
+def sendfile_response(name, path):
+    """
+    Hands the byte transfer of ``path`` to the front proxy. Without a
+    configured proxy the file is only streamed in DEBUG.
+    """
+    backend = settings.MEDIA_SENDFILE_BACKEND
+    content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+
+    if backend == "x-accel-redirect":
+        response = HttpResponse(content_type=content_type)
+        location = settings.MEDIA_ACCEL_REDIRECT_LOCATION
+        response["X-Accel-Redirect"] = quote(f"{location}{name}")
+    elif backend == "x-sendfile":
+        response = HttpResponse(content_type=content_type)
+        response["X-Sendfile"] = path
+    elif backend is None and settings.DEBUG:
+        response = FileResponse(open(path, "rb"), content_type=content_type)
+    else:
+        raise ImproperlyConfigured(
+            "MEDIA_SENDFILE_BACKEND must be 'x-accel-redirect' or "
+            "'x-sendfile' when DEBUG is off."
+        )
+    return response
+
+
+def serve_media(request, name, max_age, immutable=True):
+    """
+    Conditional, cacheable response for a stored media file. Files on
+    object storage are redirected to a presigned URL instead.
+    """
+    try:
+        path = default_storage.path(name)
+    except NotImplementedError:
+        expire = None if immutable else max_age
+        return HttpResponseRedirect(default_storage.url(name, expire=expire))
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        raise Http404
+
+    etag = media_etag(name, stat)
+    last_modified = int(stat.st_mtime)
+
+    not_modified = get_conditional_response(
+        request, etag=etag, last_modified=last_modified
+    )
+    if not_modified is not None:
+        response = not_modified
+    else:
+        response = sendfile_response(name, path)
+
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    cache_control = {"private": True, "max_age": max_age}
+    if immutable:
+        cache_control["immutable"] = True
+    patch_cache_control(response, **cache_control)
+    return response
@@ -0,0 +1,343 @@
+"""
+Per-view request metrics exported in the Prometheus text format.
+
+Every process aggregates into its own in-memory registry. When
+``METRICS_DIR`` is set, each process also dumps that registry into the
+directory at most every ``METRICS_FLUSH_INTERVAL`` seconds, and the
+``/metrics`` view sums all of the dumps, so any worker can answer a scrape.
+The dump of an exited process is folded into ``archive.json`` and removed,
+so the directory only holds live workers while counters keep growing.
+"""
+import atexit
+import fcntl
+import json
+import os
+import threading
+import time
+
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+IMAGE_BYTES_BUCKETS = (
+    16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864, 268435456
+)
+
+HISTOGRAMS = {
+    "http_request_duration_seconds": (
+        "Request latency by view.",
+        LATENCY_BUCKETS,
+    ),
+    "http_response_size_bytes": ("Response body size by view.", SIZE_BUCKETS),
+    "db_queries_per_request": ("SQL queries per request.", COUNT_BUCKETS),
+    "db_query_duration_seconds": (
+        "Time spent in SQL per request.",
+        LATENCY_BUCKETS,
+    ),
+    "cache_calls_per_request": ("Cache calls per request.", COUNT_BUCKETS),
+    "image_operation_duration_seconds": (
+        "Image decode, resize, encode and storage write time.",
+        LATENCY_BUCKETS,
+    ),
+    "image_pixel_buffer_estimated_bytes": (
+        "Decoded or resized image size estimated as width x height x bands.",
+        IMAGE_BYTES_BUCKETS,
+    ),
+    "image_operation_data_bytes": (
+        "Size of the encoded data or stored file.",
+        IMAGE_BYTES_BUCKETS,
+    ),
+}
+
+COUNTERS = {
+    "http_requests_total": "Requests by view, method and status.",
+    "cache_hits_total": "Cache keys found.",
+    "cache_misses_total": "Cache keys missing.",
+}
+
+# Only operations in flight under the middleware are counted.
+current_stats = ContextVar("current_stats", default=None)
+
+
+class RequestStats:
+    __slots__ = ("queries", "query_time", "cache_calls", "hits", "misses")
+
+    def __init__(self):
+        self.queries = 0
+        self.query_time = 0.0
+        self.cache_calls = 0
+        self.hits = 0
+        self.misses = 0
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Database execute wrapper counting queries of the current request.
+    """
+    stats = current_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.query_time += time.perf_counter() - start
+
+
+def record_cache_call(hits=0, misses=0):
+    stats = current_stats.get()
+    if stats is not None:
+        stats.cache_calls += 1
+        stats.hits += hits
+        stats.misses += misses
+
+
+@contextmanager
+def untracked():
+    """
+    Stops counting for the block, e.g. while a batched cache call is
+    implemented with single ones.
+    """
+    token = current_stats.set(None)
+    try:
+        yield
+    finally:
+        current_stats.reset(token)
+
+
+class Registry:
+    """
+    Thread-safe histograms and counters keyed by name and label values.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+
+    def observe(self, name, labels, value):
+        buckets = HISTOGRAMS[name][1]
+        key = (name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                # Non-cumulative bucket counts, the +Inf bucket, then sum.
+                histogram = self.histograms[key] = [0] * (len(buckets) + 2)
+            histogram[bisect_left(buckets, value)] += 1
+            histogram[-1] += value
+
+    def inc(self, name, labels, value=1):
+        key = (name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def load(self, dump):
+        """
+        Adds the values of another registry's ``dump`` to this one.
+        """
+        with self.lock:
+            for name, labels, values in dump["histograms"]:
+                key = (name, tuple(map(tuple, labels)))
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    self.histograms[key] = list(values)
+                else:
+                    self.histograms[key] = [
+                        a + b for a, b in zip(histogram, values)
+                    ]
+            for name, labels, value in dump["counters"]:
+                key = (name, tuple(map(tuple, labels)))
+                self.counters[key] = self.counters.get(key, 0) + value
+
+    def dump(self):
+        with self.lock:
+            return {
+                "histograms": [
+                    [name, list(labels), list(values)]
+                    for (name, labels), values in self.histograms.items()
+                ],
+                "counters": [
+                    [name, list(labels), value]
+                    for (name, labels), value in self.counters.items()
+                ],
+            }
+
+
+registry = Registry()
+_last_flush = 0.0
+# Sum of the dumps of exited processes.
+ARCHIVE = "archive.json"
+
+
+def observe_request(view, method, status_code, size, elapsed, stats):
+    labels = (("view", view),)
+    registry.observe("http_request_duration_seconds", labels, elapsed)
+    registry.observe("http_response_size_bytes", labels, size)
+    registry.observe("db_queries_per_request", labels, stats.queries)
+    registry.observe("db_query_duration_seconds", labels, stats.query_time)
+    registry.observe("cache_calls_per_request", labels, stats.cache_calls)
+    registry.inc(
+        "http_requests_total",
+        labels + (("method", method), ("status", str(status_code))),
+    )
+    if stats.hits:
+        registry.inc("cache_hits_total", labels, stats.hits)
+    if stats.misses:
+        registry.inc("cache_misses_total", labels, stats.misses)
+
+    maybe_flush()
+
+
+def maybe_flush():
+    if time.monotonic() - _last_flush >= settings.METRICS_FLUSH_INTERVAL:
+        flush()
+
+
+def dump_path(pid):
+    return os.path.join(settings.METRICS_DIR, f"{pid}.json")
+
+
+def read_dump(path):
+    with open(path) as dump:
+        return json.load(dump)
+
+
+def write_dump(path, dump):
+    """
+    Writes ``dump`` atomically, so a concurrent scrape never reads a
+    partial file.
+    """
+    with open(f"{path}.tmp", "w") as dump_file:
+        json.dump(dump, dump_file)
+    os.replace(f"{path}.tmp", path)
+
+
+@contextmanager
+def locked_dir():
+    """
+    Serializes scrapes with folding dumps into the archive, which would
+    otherwise be read both before and after they are folded.
+    """
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    with open(os.path.join(settings.METRICS_DIR, ".lock"), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+def flush():
+    """
+    Writes this process' registry to ``METRICS_DIR``.
+    """
+    global _last_flush
+
+    _last_flush = time.monotonic()
+    if not settings.METRICS_DIR:
+        return
+
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    write_dump(dump_path(os.getpid()), registry.dump())
+
+
+def mark_process_dead(pid):
+    """
+    Folds the dump of the exited worker ``pid`` into the archive and
+    removes it. Workers do this themselves on a clean exit; call it from
+    the server's child exit hook to cover killed workers too.
+    """
+    if not settings.METRICS_DIR:
+        return
+
+    path = dump_path(pid)
+    with locked_dir():
+        if not os.path.exists(path):
+            return
+        archive = Registry()
+        archive_path = os.path.join(settings.METRICS_DIR, ARCHIVE)
+        if os.path.exists(archive_path):
+            archive.load(read_dump(archive_path))
+        archive.load(read_dump(path))
+        write_dump(archive_path, archive.dump())
+        os.remove(path)
+
+
+@atexit.register
+def retire():
+    flush()
+    mark_process_dead(os.getpid())
+
+
+def collect():
+    """
+    Returns ``(histograms, counters)`` summed over every process.
+    """
+    total = Registry()
+    if settings.METRICS_DIR:
+        flush()
+        with locked_dir():
+            for name in os.listdir(settings.METRICS_DIR):
+                if name.endswith(".json"):
+                    path = os.path.join(settings.METRICS_DIR, name)
+                    total.load(read_dump(path))
+    else:
+        total.load(registry.dump())
+    return total.histograms, total.counters
+
+
+def escape_label(value):
+    return (
+        value.replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+    )
+
+
+def format_labels(labels):
+    pairs = ",".join(
+        f'{name}="{escape_label(value)}"' for name, value in labels
+    )
+    return "{" + pairs + "}"
+
+
+def format_number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def exposition():
+    """
+    Renders every metric in the Prometheus text format.
+    """
+    histograms, counters = collect()
+    lines = []
+
+    for name, (documentation, buckets) in HISTOGRAMS.items():
+        lines += [f"# HELP {name} {documentation}", f"# TYPE {name} histogram"]
+        for (metric, labels), values in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip((*buckets, "+Inf"), values):
+                cumulative += count
+                le = (("le", format_number(bound)),)
+                lines.append(
+                    f"{name}_bucket{format_labels(labels + le)} {cumulative}"
+                )
+            lines.append(
+                f"{name}_sum{format_labels(labels)} "
+                f"{format_number(values[-1])}"
+            )
+            lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+
+    for name, documentation in COUNTERS.items():
+        lines += [f"# HELP {name} {documentation}", f"# TYPE {name} counter"]
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f"{name}{format_labels(labels)} {value}")
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,59 @@
+import asyncio
+import time
+
+from django.utils.deprecation import MiddlewareMixin
+
+from .metrics import RequestStats, current_stats, observe_request
+
+METRICS_NAMESPACE = "core"
+
+
+class MetricsMiddleware(MiddlewareMixin):
+    """
+    Records latency, SQL, cache and response size metrics for every view in
+    ``core.urls``. Place it first so it measures the whole stack.
+    """
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+
+        stats = RequestStats()
+        token = current_stats.set(stats)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_stats.reset(token)
+        self.observe(request, response, stats, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = current_stats.set(stats)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_stats.reset(token)
+        self.observe(request, response, stats, time.perf_counter() - start)
+        return response
+
+    def observe(self, request, response, stats, elapsed):
+        match = getattr(request, "resolver_match", None)
+        if match is None or match.namespace != METRICS_NAMESPACE:
+            return
+
+        if response.streaming:
+            size = int(response.get("Content-Length", 0))
+        else:
+            size = len(response.content)
+
+        observe_request(
+            match.view_name,
+            request.method,
+            response.status_code,
+            size,
+            elapsed,
+            stats,
+        )
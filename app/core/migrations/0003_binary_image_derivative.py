@@ -0,0 +1,39 @@
+# Generated by Django 4.0.10 on 2026-10-18 03:17
+
+import core.models
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0002_alter_binaryimagelink_date_created"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="binaryimagelink",
+            name="image",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                to="core.image",
+            ),
+        ),
+        migrations.AddField(
+            model_name="image",
+            name="binary_image",
+            field=models.ImageField(
+                blank=True, upload_to=core.models.user_binary_images_file_path
+            ),
+        ),
+        migrations.AlterField(
+            model_name="binaryimagelink",
+            name="binary_image",
+            field=models.ImageField(
+                blank=True, upload_to=core.models.user_binary_images_file_path
+            ),
+        ),
+    ]
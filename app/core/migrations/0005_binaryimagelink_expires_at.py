@@ -0,0 +1,40 @@
+from datetime import timedelta
+
+from django.db import migrations, models
+
+
+def set_expires_at(apps, schema_editor):
+    BinaryImageLink = apps.get_model("core", "BinaryImageLink")
+    links = BinaryImageLink.objects.filter(expires_at__isnull=True)
+
+    batch = []
+    for link in links.only("date_created", "exist_seconds").iterator():
+        link.expires_at = link.date_created + timedelta(
+            seconds=link.exist_seconds
+        )
+        batch.append(link)
+        if len(batch) == 1000:
+            BinaryImageLink.objects.bulk_update(batch, ["expires_at"])
+            batch = []
+    BinaryImageLink.objects.bulk_update(batch, ["expires_at"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0004_image_content_hash"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="binaryimagelink",
+            name="expires_at",
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.RunPython(set_expires_at, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="binaryimagelink",
+            name="expires_at",
+            field=models.DateTimeField(db_index=True, editable=False),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.0.10 on 2026-10-18 03:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0005_binaryimagelink_expires_at"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="image",
+            index=models.Index(
+                fields=["user", "id"], name="core_image_user_id_7bf19c_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.0.10 on 2026-10-18 04:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0006_image_user_id_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ThumbnailSync",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("tier_ids", models.JSONField(null=True)),
+                ("user_ids", models.JSONField(null=True)),
+                ("create", models.JSONField(default=list)),
+                ("drop", models.JSONField(default=list)),
+                (
+                    "phase",
+                    models.CharField(
+                        choices=[("create", "create"), ("drop", "drop")],
+                        default="create",
+                        max_length=6,
+                    ),
+                ),
+                ("last_pk", models.BigIntegerField(default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
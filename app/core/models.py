@@ -1,28 +1,96 @@
+import hashlib
 import os
 
+from datetime import timedelta
 from uuid import uuid4
 
+from django.conf import settings
 from django.contrib.auth.base_user import AbstractBaseUser
 from django.contrib.auth.models import PermissionsMixin, UserManager
 from django.contrib.auth.validators import ASCIIUsernameValidator
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
 
+from django_cleanup import cleanup
 from sorl.thumbnail import ImageField
 
 
+def file_content_hash(file):
+    content_hash = getattr(file, "content_hash", None)
+    if content_hash:
+        return content_hash
+
+    hasher = hashlib.sha256()
+    file.seek(0)
+    for chunk in file.chunks():
+        hasher.update(chunk)
+    file.seek(0)
+    return hasher.hexdigest()
+
+
+MEDIA_PATH_LAYOUTS = ("hashed", "username")
+
+
+def user_upload_dir(user, layout=None):
+    """
+    Directory of ``user``'s uploads in ``layout`` (``MEDIA_PATH_LAYOUT`` by
+    default). The hashed layout fans users out over two levels of hex
+    prefixes of a hash of their id, which unlike usernames never changes.
+    """
+    layout = layout or settings.MEDIA_PATH_LAYOUT
+    if layout == "username":
+        return os.path.join("uploads", user.username)
+
+    digest = hashlib.md5(str(user.pk).encode()).hexdigest()
+    return os.path.join("uploads", digest[:2], digest[2:4], str(user.pk))
+
+
+def user_file_path(user, filename, subdir="", layout=None):
+    """
+    Name of ``filename`` in ``user``'s upload directory. The hashed layout
+    adds a level named after the start of the file name, which is a hash
+    or uuid, so one user's files are spread over 256 directories too.
+    """
+    layout = layout or settings.MEDIA_PATH_LAYOUT
+    directory = os.path.join(user_upload_dir(user, layout), subdir)
+    if layout == "username":
+        return os.path.join(directory, filename)
+    return os.path.join(directory, filename[:2], filename)
+
+
+def upload_owner(name):
+    """
+    Returns the ``Image`` lookup of the owner of an upload file name in
+    either layout, ``{"user__username": ...}`` or ``{"user_id": ...}``, or
+    ``None`` for names outside the upload directory.
+    """
+    parts = name.split("/")
+    if parts[0] != "uploads":
+        return None
+    # uploads/<username>/<file> or uploads/<username>/binary/<file>
+    if len(parts) in (3, 4):
+        return {"user__username": parts[1]}
+    # uploads/<aa>/<bb>/<id>/<cc>/<file>, with binary/ before <cc>
+    if len(parts) in (6, 7) and parts[3].isdigit():
+        return {"user_id": int(parts[3])}
+    return None
+
+
 def user_images_file_path(instance, filename):
     ext = os.path.splitext(filename)[1]
-    filename = f"{uuid4()}{ext}"
+    if instance.content_hash:
+        filename = f"{instance.content_hash}{ext.lower()}"
+    else:
+        filename = f"{uuid4()}{ext}"
 
-    return os.path.join("uploads", instance.user.username, filename)
+    return user_file_path(instance.user, filename)
 
 
 def user_binary_images_file_path(instance, filename):
     ext = os.path.splitext(filename)[1]
     filename = f"{uuid4()}{ext}"
 
-    return os.path.join("uploads", instance.user.username, "binary", filename)
+    return user_file_path(instance.user, filename, "binary")
 
 
 class User(AbstractBaseUser, PermissionsMixin):
@@ -70,12 +138,94 @@ class Tier(models.Model):
 
 class BinaryImageLink(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid4, editable=False)
-    binary_image = models.ImageField(upload_to=user_binary_images_file_path)
+    image = models.ForeignKey(
+        "Image", on_delete=models.CASCADE, null=True, blank=True
+    )
+    binary_image = models.ImageField(
+        upload_to=user_binary_images_file_path, blank=True
+    )
     exist_seconds = models.SmallIntegerField()
     date_created = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField(db_index=True, editable=False)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
 
+    def save(self, *args, **kwargs):
+        self.expires_at = self.date_created + timedelta(
+            seconds=self.exist_seconds
+        )
+        super().save(*args, **kwargs)
 
+    @property
+    def rendered_image(self):
+        """
+        Grayscale file served by the link. Links to an image share the
+        image's derivative, which stays empty until it has been rendered.
+        """
+        if self.image_id is not None:
+            return self.image.binary_image
+        return self.binary_image
+
+
+@cleanup.ignore
 class Image(models.Model):
     image = ImageField(upload_to=user_images_file_path)
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
+    binary_image = models.ImageField(
+        upload_to=user_binary_images_file_path, blank=True
+    )
     user = models.ForeignKey("User", on_delete=models.CASCADE)
+
+    class Meta:
+        indexes = [models.Index(fields=("user", "id"))]
+
+    def deduplicate(self, batch_names=None):
+        """
+        Hashes a new upload and, when the same content is already stored
+        for the user, points ``image`` at the stored file instead of
+        writing it again. Files are only removed once no image references
+        them (see ``core.signals``).
+
+        The image sharing the file is locked until the transaction ends,
+        so deleting it waits for this image to be saved and then sees it
+        referencing the file. Must run in the transaction saving the image.
+
+        ``batch_names`` collects the names of files about to be written by
+        a ``bulk_create``, so duplicates within one batch are shared too.
+        """
+        if not self.image or self.image._committed:
+            return
+
+        self.content_hash = file_content_hash(self.image.file)
+        name = self.image.field.generate_filename(self, self.image.name)
+        shared = Image.objects.select_for_update().filter(image=name).exists()
+        if shared or (batch_names is not None and name in batch_names):
+            self.image.name = name
+            self.image._committed = True
+        elif batch_names is not None:
+            batch_names.add(name)
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get("using")):
+            self.deduplicate()
+            super().save(*args, **kwargs)
+
+
+class ThumbnailSync(models.Model):
+    """
+    Progress of a background sync of thumbnails with a change of the heights
+    available to the images of tiers and/or users (see ``core.backfill``).
+    """
+
+    PHASES = ("create", "drop")
+
+    tier_ids = models.JSONField(null=True)
+    user_ids = models.JSONField(null=True)
+    create = models.JSONField(default=list)
+    drop = models.JSONField(default=list)
+    phase = models.CharField(
+        max_length=6,
+        choices=[(phase, phase) for phase in PHASES],
+        default="create",
+    )
+    last_pk = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
@@ -0,0 +1,12 @@
+from rest_framework.pagination import CursorPagination
+
+
+class ImageCursorPagination(CursorPagination):
+    """
+    Keyset pagination over image ids, so every page costs the same no
+    matter how deep the client scrolls.
+    """
+
+    ordering = "id"
+    page_size_query_param = "limit"
+    max_page_size = 100
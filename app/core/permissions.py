@@ -1,5 +1,7 @@
 from rest_framework.permissions import BasePermission, IsAuthenticated  # noqa
 
+from .tiers import get_tier
+
 
 class DoesUserHaveTier(BasePermission):
     """
@@ -9,7 +11,7 @@ class DoesUserHaveTier(BasePermission):
     message = "User does not have tier."
 
     def has_permission(self, request, view):
-        return request.user.tier
+        return get_tier(getattr(request.user, "tier_id", None)) is not None
 
 
 class CanUserCreateLink(BasePermission):
@@ -20,4 +22,4 @@ class CanUserCreateLink(BasePermission):
     message = "User does not have permissions to create link."
 
     def has_permission(self, request, view):
-        return request.user.tier.can_create_link
+        return get_tier(request.user.tier_id).can_create_link
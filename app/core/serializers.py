@@ -1,3 +1,5 @@
+from PIL import Image as pillow_image
+
 from rest_framework import serializers
 
 from django.utils.translation import gettext_lazy as _
@@ -5,7 +7,18 @@ from django.urls import reverse
 
 import core.models
 
-from sorl.thumbnail import get_thumbnail
+from sorl.thumbnail import default
+
+from .tiers import get_tier
+from .uploadhandlers import IMAGE_FORMATS, sniff_image
+from .thumbnails import (
+    queue_thumbnails,
+    resolve_thumbnails,
+    thumbnail_geometry,
+    thumbnail_options,
+)
+
+THUMBNAIL_PENDING = "pending"
 
 
 def image_ext_validator(image):
@@ -17,6 +30,22 @@ def image_ext_validator(image):
         raise serializers.ValidationError(msg)
 
 
+def image_format_validator(image):
+    image_format = getattr(image, "image_format", None)
+
+    if image_format is None:
+        try:
+            image_format = sniff_image(image)[0]
+        except (pillow_image.UnidentifiedImageError, OSError):
+            pass
+        finally:
+            image.seek(0)
+
+    if image_format not in IMAGE_FORMATS:
+        msg = _("Upload a valid JPEG or PNG image.")
+        raise serializers.ValidationError(msg)
+
+
 class DynamicFieldsModelSerializer(serializers.ModelSerializer):
     def __init__(self, *args, **kwargs):
         fields = kwargs.pop("fields", None)
@@ -29,27 +58,61 @@ class DynamicFieldsModelSerializer(serializers.ModelSerializer):
                 self.fields.pop(field_name)
 
 
+class ImagesListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        images = list(data)
+        heights = self.context.get("thumbnail_heights")
+
+        if (
+            heights is not None
+            and "thumbnails" in self.child.fields
+            and "thumbnails" not in self.context
+        ):
+            self.context["thumbnails"] = resolve_thumbnails(
+                images, heights, self.context.get("thumbnail_variant")
+            )
+
+        return super().to_representation(images)
+
+
 class ImagesSerializer(DynamicFieldsModelSerializer):
     thumbnails = serializers.SerializerMethodField()
     binary_image_link = serializers.SerializerMethodField()
     image = serializers.ImageField(
-        validators=(image_ext_validator,), required=True
+        validators=(image_ext_validator, image_format_validator),
+        required=True,
     )
 
     class Meta:
         model = core.models.Image
-        exclude = ("user", "id")
+        exclude = ("user", "id", "content_hash", "binary_image")
+        list_serializer_class = ImagesListSerializer
 
     def get_thumbnails(self, obj):
         request = self.context.get("request")
+        heights = self.context.get("thumbnail_heights")
+        options = thumbnail_options(self.context.get("thumbnail_variant"))
         thumbnailed_photos = []
 
-        for thumbnail in obj.user.tier.thumbnails.all():
-            height = f"x{thumbnail.value}"
-            url = request.build_absolute_uri(
-                get_thumbnail(obj.image, height, crop="center", quality=99).url
-            )
-            thumbnailed_photos.append({thumbnail.value: url})
+        if heights is None:
+            heights = get_tier(obj.user.tier_id).heights
+
+        resolved = self.context.get("thumbnails", {})
+
+        for height in heights:
+            if (obj.pk, height) in resolved:
+                cached = resolved[(obj.pk, height)]
+            else:
+                cached = default.backend.get_cached_thumbnail(
+                    obj.image, thumbnail_geometry(height), **options
+                )
+                if cached is None:
+                    queue_thumbnails([obj.pk])
+            if cached is None:
+                url = THUMBNAIL_PENDING
+            else:
+                url = request.build_absolute_uri(cached.url)
+            thumbnailed_photos.append({height: url})
 
         return thumbnailed_photos
 
@@ -0,0 +1,167 @@
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models import DEFERRED
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_init,
+    post_save,
+    pre_delete,
+)
+from django.dispatch import receiver
+
+from sorl.thumbnail import delete as delete_thumbnails
+
+from .authentication import user_cache_key
+from .backfill import schedule_thumbnail_sync
+from .binary_images import binary_link_cache_key
+from .metrics import record_query
+from .models import Image, BinaryImageLink, Thumbnail, Tier, User
+from .tiers import bump_tiers_version, get_tier
+
+
+def delete_image_file(file, field_name, using):
+    # Uploads deduplicated before the deletion committed share the file.
+    lookup = {field_name: file.name}
+    if Image.objects.using(using).filter(**lookup).exists():
+        return
+
+    if field_name == "image":
+        delete_thumbnails(file)
+    else:
+        file.delete(save=False)
+
+
+@receiver(post_delete, sender=Image)
+def delete_unreferenced_image_files(sender, instance, using, **kwargs):
+    """
+    Identical uploads share files, so a file is only deleted together with
+    the last image referencing it.
+    """
+    for field_name in ("image", "binary_image"):
+        file = getattr(instance, field_name)
+        if not file.name:
+            continue
+
+        if instance.content_hash:
+            lookup = {
+                "content_hash": instance.content_hash,
+                field_name: file.name,
+            }
+            if Image.objects.using(using).filter(**lookup).exists():
+                continue
+
+        transaction.on_commit(
+            partial(delete_image_file, file, field_name, using), using
+        )
+
+
+@receiver(post_delete, sender=BinaryImageLink)
+def delete_binary_link_cache(sender, instance, **kwargs):
+    cache.delete(binary_link_cache_key(instance.id))
+
+
+@receiver(post_save, sender=Tier)
+@receiver(post_delete, sender=Tier)
+@receiver(post_save, sender=Thumbnail)
+@receiver(post_delete, sender=Thumbnail)
+@receiver(m2m_changed, sender=Tier.thumbnails.through)
+def invalidate_tiers(sender, **kwargs):
+    """
+    Tier configurations are cached in every process; reload them here and
+    everywhere else once the change is committed. Reloading any earlier
+    would read uncommitted rows and keep them if the change rolls back.
+    """
+    if kwargs.get("action", "post_").startswith("post_"):
+        transaction.on_commit(bump_tiers_version, kwargs.get("using"))
+
+
+@receiver(m2m_changed, sender=Tier.thumbnails.through)
+def sync_tier_heights(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Generates or deletes the thumbnails of heights added to or removed
+    from tiers, from either side of the relation.
+    """
+    if not settings.THUMBNAIL_SYNC_ON_TIER_CHANGE:
+        return
+
+    if action == "pre_clear":
+        # Clears do not list the removed rows, remember them beforehand.
+        related = instance.tier_set if reverse else instance.thumbnails
+        instance._cleared_pks = set(related.values_list("pk", flat=True))
+        return
+    if action == "post_clear":
+        pk_set = instance.__dict__.pop("_cleared_pks", set())
+    elif action not in ("post_add", "post_remove"):
+        return
+
+    if reverse:
+        tier_ids, heights = list(pk_set), [instance.value]
+    else:
+        tier_ids = [instance.pk]
+        heights = Thumbnail.objects.filter(pk__in=pk_set).values_list(
+            "value", flat=True
+        )
+
+    if action == "post_add":
+        schedule_thumbnail_sync(tier_ids=tier_ids, create=heights)
+    else:
+        schedule_thumbnail_sync(tier_ids=tier_ids, drop=heights)
+
+
+@receiver(pre_delete, sender=Thumbnail)
+def remember_thumbnail_tiers(sender, instance, **kwargs):
+    # Deleting a height removes it from its tiers without m2m_changed.
+    if settings.THUMBNAIL_SYNC_ON_TIER_CHANGE:
+        instance._tier_ids = list(
+            instance.tier_set.values_list("pk", flat=True)
+        )
+
+
+@receiver(post_delete, sender=Thumbnail)
+def sync_deleted_height(sender, instance, **kwargs):
+    tier_ids = instance.__dict__.pop("_tier_ids", None)
+    if tier_ids:
+        schedule_thumbnail_sync(tier_ids=tier_ids, drop=[instance.value])
+
+
+@receiver(post_init, sender=User)
+def remember_tier(sender, instance, **kwargs):
+    instance._original_tier_id = instance.__dict__.get("tier_id", DEFERRED)
+
+
+@receiver(post_save, sender=User)
+def sync_user_heights(sender, instance, created, **kwargs):
+    """
+    Generates or deletes thumbnails of a user who changed tiers, for the
+    heights only one of the tiers has.
+    """
+    original_tier_id = instance._original_tier_id
+    instance._original_tier_id = instance.tier_id
+    if created or original_tier_id in (DEFERRED, instance.tier_id):
+        return
+
+    def heights(tier_id):
+        tier = get_tier(tier_id)
+        return set(() if tier is None else tier.heights)
+
+    old, new = heights(original_tier_id), heights(instance.tier_id)
+    schedule_thumbnail_sync(
+        user_ids=[instance.pk], create=new - old, drop=old - new
+    )
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def delete_user_cache(sender, instance, **kwargs):
+    cache.delete(user_cache_key(instance.pk))
+
+
+@receiver(connection_created)
+def install_query_recorder(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
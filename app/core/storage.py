@@ -0,0 +1,114 @@
+"""
+Media storage on an S3 compatible object store (AWS S3, MinIO, ...).
+Uploads are concurrent multipart transfers and URLs are presigned, so
+clients read media straight from the bucket instead of through Django.
+"""
+import threading
+
+from boto3.s3.transfer import TransferConfig
+from django.conf import settings
+from storages.backends.s3 import S3Storage
+from storages.utils import clean_name
+
+
+class MediaStorage(S3Storage):
+    """
+    ``S3Storage`` configured from the ``AWS_*`` and ``MEDIA_*`` settings.
+    """
+
+    # Every instance configured from the settings alone shares its boto3
+    # clients: sorl creates a storage for each thumbnail it deserializes,
+    # and creating a client takes far longer than presigning a URL.
+    _shared_connections = threading.local()
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.shares_connections = not options
+        if self.shares_connections:
+            self._connections = self._shared_connections
+
+    def get_default_settings(self):
+        defaults = super().get_default_settings()
+        defaults["transfer_config"] = TransferConfig(
+            multipart_threshold=settings.MEDIA_MULTIPART_THRESHOLD,
+            multipart_chunksize=settings.MEDIA_MULTIPART_CHUNK_SIZE,
+            max_concurrency=settings.MEDIA_UPLOAD_CONCURRENCY,
+        )
+        defaults["public_endpoint_url"] = settings.MEDIA_PUBLIC_ENDPOINT_URL
+        return defaults
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        if self.shares_connections:
+            self._connections = self._shared_connections
+
+    @property
+    def signing_client(self):
+        """
+        Client presigning URLs for ``public_endpoint_url``, the address
+        clients reach the store at when it differs from ours.
+        """
+        if not self.public_endpoint_url:
+            return self.connection.meta.client
+
+        client = getattr(self._connections, "signing_client", None)
+        if client is None:
+            client = self._create_session().client(
+                "s3",
+                region_name=self.region_name,
+                use_ssl=self.use_ssl,
+                endpoint_url=self.public_endpoint_url,
+                config=self.client_config,
+                verify=self.verify,
+            )
+            self._connections.signing_client = client
+        return client
+
+    def url(self, name, parameters=None, expire=None, http_method=None):
+        if not self.querystring_auth or self.custom_domain:
+            return super().url(name, parameters, expire, http_method)
+
+        params = dict(parameters or {})
+        params["Bucket"] = self.bucket_name
+        params["Key"] = self._normalize_name(clean_name(name))
+        return self.signing_client.generate_presigned_url(
+            "get_object",
+            Params=params,
+            ExpiresIn=self.querystring_expire if expire is None else expire,
+            HttpMethod=http_method,
+        )
+
+    def copy(self, name, new_name):
+        """
+        Copies ``name`` to ``new_name`` inside the store, as a concurrent
+        multipart copy for large files.
+        """
+        self.bucket.copy(
+            {
+                "Bucket": self.bucket_name,
+                "Key": self._normalize_name(clean_name(name)),
+            },
+            self._normalize_name(clean_name(new_name)),
+            Config=self.transfer_config,
+        )
+
+    def list_files(self, directory):
+        """
+        Yields ``(name, size, mtime)`` of every file below ``directory``, a
+        page of the object listing at a time.
+        """
+        prefix = self._normalize_name(clean_name(directory)).rstrip("/")
+        start = len(self.location)
+        paginator = self.connection.meta.client.get_paginator(
+            "list_objects_v2"
+        )
+        for page in paginator.paginate(
+            Bucket=self.bucket_name, Prefix=f"{prefix}/"
+        ):
+            for entry in page.get("Contents", ()):
+                key = entry["Key"]
+                yield (
+                    key[start:].lstrip("/"),
+                    entry["Size"],
+                    entry["LastModified"].timestamp(),
+                )
@@ -0,0 +1,96 @@
+import logging
+import multiprocessing
+
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def init_worker():
+    """Set up Django inside a freshly spawned worker process."""
+    django.setup()
+
+
+def run_task(func, *args, **kwargs):
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+def create_executor(max_workers):
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_worker,
+    )
+
+
+def get_executor():
+    global _executor
+
+    if _executor is None:
+        _executor = create_executor(settings.IMAGE_TASK_WORKERS)
+    return _executor
+
+
+def log_task_failure(future):
+    exc = future.exception()
+    if exc is not None:
+        logger.error("Background image task failed", exc_info=exc)
+
+
+def enqueue(func, *args, **kwargs):
+    """
+    Run ``func`` on the image worker pool once the current transaction
+    commits. ``func`` must be importable at module level.
+    """
+    if settings.IMAGE_TASKS_ALWAYS_EAGER:
+        return func(*args, **kwargs)
+
+    def submit():
+        future = get_executor().submit(run_task, func, *args, **kwargs)
+        future.add_done_callback(log_task_failure)
+
+    transaction.on_commit(submit)
+
+
+def enqueue_batches(func, *args, **kwargs):
+    """
+    ``enqueue`` for a task that does its work a batch at a time and records
+    its own progress. ``func`` is enqueued again, behind the tasks queued
+    in the meantime, for as long as it returns True.
+    """
+    if settings.IMAGE_TASKS_ALWAYS_EAGER:
+        while func(*args, **kwargs):
+            pass
+        return
+
+    def submit():
+        future = get_executor().submit(run_task, func, *args, **kwargs)
+        future.add_done_callback(resubmit)
+
+    def resubmit(future):
+        log_task_failure(future)
+        if future.exception() is None and future.result():
+            submit()
+
+    transaction.on_commit(submit)
+
+
+def run_parallel(func, items):
+    """
+    Map ``func`` over ``items`` on the image worker pool and return the
+    results in order. ``func`` must not touch the database.
+    """
+    if settings.IMAGE_TASKS_ALWAYS_EAGER:
+        return [func(item) for item in items]
+    return list(get_executor().map(func, items))
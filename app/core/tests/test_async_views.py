@@ -0,0 +1,143 @@
+import json
+import os
+import shutil
+
+from asgiref.sync import sync_to_async
+
+from rest_framework.test import APIRequestFactory
+
+from django.core.cache import cache
+from django.test import AsyncRequestFactory, TestCase, override_settings
+
+from core import async_views, views
+from core.authentication import create_token
+from core.binary_images import render_binary_image
+from .test_images_api import sample_uploaded_image
+from .test_models import (
+    sample_binary_image_link,
+    sample_thumbnail,
+    sample_tier,
+    sample_user,
+)
+
+
+@override_settings(
+    CACHES={
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache"
+        }
+    }
+)
+class AsyncViewsTests(TestCase):
+    def setUp(self):
+        tier = sample_tier(name="Enterprise", can_create_link=True)
+        tier.thumbnails.set(
+            [sample_thumbnail(value=value) for value in (100, 300)]
+        )
+        self.user = sample_user(
+            email="testuser@email.com",
+            username="user",
+            password="testpassword",
+            tier=tier,
+        )
+        self.images = [sample_uploaded_image(self.user) for _ in range(3)]
+        self.headers = {
+            "HTTP_AUTHORIZATION": f"Bearer {create_token(self.user)}"
+        }
+
+    def tearDown(self):
+        cache.clear()
+        paths = ("/vol/web/media/uploads/user", "/vol/web/media/cache")
+        for path in paths:
+            if os.path.exists(path):
+                shutil.rmtree(path)
+
+    def sync_get(self, view, path, **kwargs):
+        request = APIRequestFactory().get(path, **self.headers)
+        response = view(request, **kwargs)
+        response.render()
+        return response
+
+    async def async_get(self, view, path, **kwargs):
+        headers = {
+            name[5:].lower().replace("_", "-"): value
+            for name, value in self.headers.items()
+        }
+        request = AsyncRequestFactory().get(path, **headers)
+        return await view(request, **kwargs)
+
+    async def test_image_list_matches_sync_view(self):
+        path = "/api/images/?limit=2&offset=1"
+        expected = await sync_to_async(self.sync_get)(
+            views.ImageListViewSet.as_view({"get": "list"}), path
+        )
+
+        response = await self.async_get(async_views.image_list, path)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            json.loads(response.content), json.loads(expected.content)
+        )
+        self.assertIn("Accept", response["Vary"])
+
+    async def test_image_list_with_cursor(self):
+        response = await self.async_get(
+            async_views.image_list, "/api/images/?cursor=&limit=2"
+        )
+
+        data = json.loads(response.content)
+        self.assertEqual(len(data["results"]), 2)
+        self.assertIsNotNone(data["next"])
+
+    async def test_image_list_with_invalid_token(self):
+        self.headers["HTTP_AUTHORIZATION"] = "Bearer invalid"
+
+        response = await self.async_get(
+            async_views.image_list, "/api/images/"
+        )
+
+        self.assertEqual(response.status_code, 403)
+
+    async def test_image_list_without_token_uses_sync_view(self):
+        del self.headers["HTTP_AUTHORIZATION"]
+
+        response = await self.async_get(
+            async_views.image_list, "/api/images/"
+        )
+
+        self.assertEqual(response.status_code, 403)
+
+    def sample_link(self, exist_seconds=300):
+        render_binary_image(self.images[0].pk)
+        return sample_binary_image_link(
+            user=self.user, image=self.images[0], exist_seconds=exist_seconds
+        )
+
+    async def test_retrieve_binary_link(self):
+        link = await sync_to_async(self.sample_link)()
+        path = f"/api/images/{link.id}/"
+        expected = await sync_to_async(self.sync_get)(
+            views.RetrieveBinaryLinkView.as_view(), path, binary_pk=link.id
+        )
+        await cache.aclear()
+
+        for _ in range(2):
+            response = await self.async_get(
+                async_views.retrieve_binary_link, path, binary_pk=link.id
+            )
+
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                json.loads(response.content), json.loads(expected.content)
+            )
+
+    async def test_retrieve_expired_binary_link(self):
+        link = await sync_to_async(self.sample_link)(exist_seconds=0)
+
+        response = await self.async_get(
+            async_views.retrieve_binary_link,
+            f"/api/images/{link.id}/",
+            binary_pk=link.id,
+        )
+
+        self.assertEqual(response.status_code, 400)
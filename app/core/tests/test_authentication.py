@@ -0,0 +1,107 @@
+from unittest.mock import patch
+
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from django.core.cache import cache
+from django.test import override_settings
+from django.urls import reverse
+
+from core.authentication import create_token
+from .test_models import sample_user, sample_tier
+
+IMAGES_LIST_URL = reverse("core:images-list")
+TOKEN_URL = reverse("core:token")
+REVOKE_TOKEN_URL = reverse("core:revoke-token")
+
+
+@override_settings(
+    CACHES={
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache"
+        }
+    }
+)
+class SignedTokenAuthenticationTests(APITestCase):
+    def setUp(self):
+        self.user = sample_user(
+            email="testuser@email.com",
+            username="user",
+            password="testpassword",
+            tier=sample_tier(name="Basic"),
+        )
+
+    def tearDown(self):
+        cache.clear()
+
+    def authorize(self, token):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+
+    def test_obtain_token(self):
+        payload = {"username": "user", "password": "testpassword"}
+
+        res = self.client.post(TOKEN_URL, payload)
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+        self.authorize(res.data["token"])
+        res = self.client.get(IMAGES_LIST_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_obtain_token_with_wrong_password(self):
+        payload = {"username": "user", "password": "wrong"}
+
+        res = self.client.post(TOKEN_URL, payload)
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertNotIn("token", res.data)
+
+    def test_authenticated_request_without_queries(self):
+        self.authorize(create_token(self.user))
+        self.client.get(IMAGES_LIST_URL)
+
+        with self.assertNumQueries(1):
+            res = self.client.get(IMAGES_LIST_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_tampered_token(self):
+        token = create_token(self.user)
+        self.authorize(token[:-1] + ("A" if token[-1] != "A" else "B"))
+
+        res = self.client.get(IMAGES_LIST_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_expired_token(self):
+        token = create_token(self.user)
+        self.authorize(token)
+
+        with patch("time.time", return_value=2**40):
+            res = self.client.get(IMAGES_LIST_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_revoke_token(self):
+        self.authorize(create_token(self.user))
+
+        res = self.client.post(REVOKE_TOKEN_URL)
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+
+        res = self.client.get(IMAGES_LIST_URL)
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_user_change_evicts_cached_user(self):
+        self.authorize(create_token(self.user))
+        self.client.get(IMAGES_LIST_URL)
+
+        self.user.is_active = False
+        self.user.save()
+        res = self.client.get(IMAGES_LIST_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_revoke_token_without_token(self):
+        res = self.client.post(REVOKE_TOKEN_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(res["WWW-Authenticate"], "Bearer")
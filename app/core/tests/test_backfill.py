@@ -0,0 +1,317 @@
+import json
+import os
+import shutil
+import tempfile
+
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+
+from sorl.thumbnail import default
+from sorl.thumbnail.images import ImageFile
+
+from core.backfill import (
+    RateLimiter,
+    drop_thumbnails,
+    missing_thumbnails,
+    sync_thumbnails,
+)
+from core.models import Image, ThumbnailSync
+from core.thumbnails import thumbnail_geometry, thumbnail_options
+from .test_models import (
+    sample_image,
+    sample_image_file,
+    sample_thumbnail,
+    sample_tier,
+    sample_user,
+)
+
+
+class BackfillThumbnailsTests(TestCase):
+    def setUp(self):
+        self.tier = sample_tier(name="Basic")
+        self.tier.thumbnails.add(sample_thumbnail(value=20))
+        self.user = sample_user(
+            username="user", password="testpassword", tier=self.tier
+        )
+        self.images = [
+            sample_image(user=self.user, image=sample_image_file((40, width)))
+            for width in (30, 31, 32)
+        ]
+
+    def tearDown(self):
+        paths = ("/vol/web/media/uploads/user", "/vol/web/media/cache")
+        for path in paths:
+            if os.path.exists(path):
+                shutil.rmtree(path)
+
+    def backfill(self, **options):
+        out = StringIO()
+        options = {"batch_size": 2, **options}
+        call_command("backfill_thumbnails", stdout=out, **options)
+        return out.getvalue()
+
+    def missing(self, height):
+        images = Image.objects.all()
+        for image in images:
+            image.tier_id = self.tier.pk
+        return missing_thumbnails(images, {self.tier.pk: [height]})
+
+    def thumbnails(self, image, height):
+        return [
+            default.backend.get_cached_thumbnail(
+                image.image,
+                thumbnail_geometry(height),
+                **thumbnail_options(variant),
+            )
+            for variant in (None, "image/webp")
+        ]
+
+    def is_generated(self, image, height):
+        return all(self.thumbnails(image, height))
+
+    def test_backfill(self):
+        output = self.backfill(dry_run=True)
+        self.assertIn("Found 6 missing thumbnails for 3 images.", output)
+        self.assertEqual(len(self.missing(20)), 6)
+
+        output = self.backfill()
+        self.assertIn("Generated 6 missing thumbnails for 3 images.", output)
+        self.assertEqual(self.missing(20), [])
+
+        output = self.backfill()
+        self.assertIn("Generated 0 missing thumbnails for 3 images.", output)
+
+    def test_identical_uploads_are_generated_once(self):
+        sample_image(user=self.user, image=sample_image_file((40, 30)))
+
+        output = self.backfill(dry_run=True, batch_size=10)
+
+        self.assertIn("Found 6 missing thumbnails for 4 images.", output)
+
+    def test_only_given_tiers_and_heights(self):
+        self.tier.thumbnails.add(sample_thumbnail(value=40))
+        sample_tier(name="Premium")
+
+        output = self.backfill(tiers=["Premium"])
+        self.assertIn("Generated 0 missing thumbnails for 0 images.", output)
+
+        self.backfill(tiers=["Basic"], heights=[40])
+        self.assertEqual(self.missing(40), [])
+        self.assertEqual(len(self.missing(20)), 6)
+
+        with self.assertRaises(CommandError):
+            self.backfill(tiers=["Unknown"])
+
+    def test_resume_from_checkpoint(self):
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint = os.path.join(directory, "backfill.json")
+            with open(checkpoint, "w") as checkpoint_file:
+                json.dump(
+                    {
+                        "scope": {"tiers": None, "heights": None},
+                        "last_pk": self.images[1].pk,
+                    },
+                    checkpoint_file,
+                )
+
+            output = self.backfill(checkpoint=checkpoint)
+
+            self.assertIn(f"Resuming after image {self.images[1].pk}", output)
+            self.assertIn("Generated 2 missing thumbnails", output)
+            self.assertFalse(os.path.exists(checkpoint))
+
+    def test_checkpoint_of_other_run(self):
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint = os.path.join(directory, "backfill.json")
+            with open(checkpoint, "w") as checkpoint_file:
+                json.dump(
+                    {"scope": {"tiers": None, "heights": [40]}, "last_pk": 1},
+                    checkpoint_file,
+                )
+
+            with self.assertRaises(CommandError):
+                self.backfill(checkpoint=checkpoint)
+
+    def test_added_heights_not_backfilled_by_default(self):
+        self.tier.thumbnails.add(sample_thumbnail(value=40))
+
+        self.assertFalse(self.is_generated(self.images[0], 40))
+
+    @override_settings(THUMBNAIL_SYNC_ON_TIER_CHANGE=True)
+    def test_added_heights_backfilled(self):
+        self.tier.thumbnails.add(sample_thumbnail(value=40))
+        sample_thumbnail(value=60).tier_set.add(self.tier)
+
+        for image in self.images:
+            self.assertTrue(self.is_generated(image, 40))
+            self.assertTrue(self.is_generated(image, 60))
+            self.assertFalse(self.is_generated(image, 20))
+
+    @patch("core.backfill.time.sleep")
+    def test_rate_limiter(self, patched_sleep):
+        limiter = RateLimiter(10)
+
+        limiter.wait(5)
+        patched_sleep.assert_not_called()
+        limiter.wait(5)
+
+        self.assertAlmostEqual(patched_sleep.call_args[0][0], 0.5, places=1)
+
+
+@override_settings(THUMBNAIL_SYNC_ON_TIER_CHANGE=True)
+class ThumbnailSyncTests(TestCase):
+    def setUp(self):
+        self.heights = {
+            value: sample_thumbnail(value=value) for value in (20, 40, 60)
+        }
+        self.tier = sample_tier(name="Basic")
+        self.tier.thumbnails.add(self.heights[20], self.heights[40])
+        self.user = sample_user(
+            username="user", password="testpassword", tier=self.tier
+        )
+        self.image = sample_image(
+            user=self.user, image=sample_image_file((40, 30))
+        )
+        call_command("backfill_thumbnails", stdout=StringIO())
+        self.files = {
+            height: [
+                thumbnail.storage.path(thumbnail.name)
+                for thumbnail in self.thumbnails(height)
+            ]
+            for height in (20, 40)
+        }
+
+    def tearDown(self):
+        paths = ("/vol/web/media/uploads/user", "/vol/web/media/cache")
+        for path in paths:
+            if os.path.exists(path):
+                shutil.rmtree(path)
+
+    def thumbnails(self, height):
+        return [
+            default.backend.get_cached_thumbnail(
+                self.image.image,
+                thumbnail_geometry(height),
+                **thumbnail_options(variant),
+            )
+            for variant in (None, "image/webp")
+        ]
+
+    def assertGenerated(self, height):
+        self.assertTrue(all(self.thumbnails(height)))
+
+    def assertDropped(self, height):
+        self.assertEqual(self.thumbnails(height), [None, None])
+        for path in self.files.get(height, ()):
+            self.assertFalse(os.path.exists(path))
+
+    def test_removed_height(self):
+        self.tier.thumbnails.remove(self.heights[20])
+
+        self.assertDropped(20)
+        self.assertGenerated(40)
+        source = default.kvstore.get(ImageFile(self.image.image))
+        listed = default.kvstore._get(source.key, identity="thumbnails")
+        self.assertEqual(
+            set(listed),
+            {thumbnail.key for thumbnail in self.thumbnails(40)},
+        )
+
+    def test_removed_from_height_side(self):
+        self.heights[40].tier_set.remove(self.tier)
+
+        self.assertGenerated(20)
+        self.assertDropped(40)
+
+    def test_cleared_heights(self):
+        self.tier.thumbnails.clear()
+
+        self.assertDropped(20)
+        self.assertDropped(40)
+
+    def test_deleted_height(self):
+        self.heights[20].delete()
+
+        self.assertDropped(20)
+        self.assertGenerated(40)
+
+    def test_user_changes_tier(self):
+        premium = sample_tier(name="Premium")
+        premium.thumbnails.add(self.heights[40], self.heights[60])
+
+        self.user.tier = premium
+        self.user.save()
+
+        self.assertDropped(20)
+        self.assertGenerated(40)
+        self.assertGenerated(60)
+
+        self.user.tier = None
+        self.user.save()
+
+        self.assertDropped(40)
+        self.assertDropped(60)
+
+    def sync_in_batches(self):
+        self.second = sample_image(
+            user=self.user, image=sample_image_file((40, 31))
+        )
+        with patch("core.backfill.enqueue_batches") as patched_enqueue:
+            self.tier.thumbnails.add(self.heights[60])
+        task, sync_pk = patched_enqueue.call_args.args
+        self.assertIs(task, sync_thumbnails)
+
+        self.assertTrue(sync_thumbnails(sync_pk))
+        return ThumbnailSync.objects.get(pk=sync_pk)
+
+    def second_thumbnail(self, height):
+        return default.backend.get_cached_thumbnail(
+            self.second.image,
+            thumbnail_geometry(height),
+            **thumbnail_options(),
+        )
+
+    @override_settings(THUMBNAIL_SYNC_BATCH_SIZE=1)
+    def test_sync_runs_a_batch_per_task(self):
+        sync = self.sync_in_batches()
+
+        self.assertEqual((sync.phase, sync.last_pk), ("create", self.image.pk))
+        self.assertGenerated(60)
+        self.assertIsNone(self.second_thumbnail(60))
+
+        while sync_thumbnails(sync.pk):
+            pass
+
+        self.assertIsNotNone(self.second_thumbnail(60))
+        self.assertFalse(ThumbnailSync.objects.exists())
+
+    @override_settings(THUMBNAIL_SYNC_BATCH_SIZE=1)
+    def test_resume_syncs(self):
+        self.sync_in_batches()
+
+        out = StringIO()
+        call_command("backfill_thumbnails", resume_syncs=True, stdout=out)
+
+        self.assertIn("Finished 1 syncs.", out.getvalue())
+        self.assertIsNotNone(self.second_thumbnail(60))
+        self.assertFalse(ThumbnailSync.objects.exists())
+
+    @patch("core.backfill.sync_thumbnails")
+    def test_nothing_to_sync(self, patched_sync):
+        self.user.email = "user@example.com"
+        self.user.save()
+        get_user_model().objects.only("pk").get().save()
+        self.tier.thumbnails.add(self.heights[20])
+
+        patched_sync.assert_not_called()
+        self.assertFalse(ThumbnailSync.objects.exists())
+
+    def test_heights_the_tier_has_are_kept(self):
+        for _ in drop_thumbnails([20], tier_ids=[self.tier.pk]):
+            pass
+
+        self.assertGenerated(20)
@@ -1,10 +1,58 @@
+import glob
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from datetime import timedelta
+from io import StringIO
+from unittest import skipIf, skipUnless
 from unittest.mock import patch
 
+from PIL import Image as pillow_image
+
 from psycopg2 import OperationalError as psycopg2OperationalError
 
-from django.core.management import call_command
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import InMemoryUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
 from django.db.utils import OperationalError
-from django.test import SimpleTestCase
+from django.test import (
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.utils import timezone
+
+from sorl.thumbnail import default
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+from core.binary_images import (
+    binary_link_cache_key,
+    cache_binary_link,
+    render_binary_image,
+)
+from core.management.commands.generate_dataset import copy_rows
+from core.management.commands.migrate_media_layout import rewrite_names
+from core.models import (
+    BinaryImageLink,
+    Image,
+    Thumbnail,
+    Tier,
+    user_upload_dir,
+)
+from core.thumbnails import generate_thumbnails, thumbnail_options
+from .test_models import (
+    sample_binary_image_link,
+    sample_image_file,
+    sample_tier,
+    sample_user,
+)
 
 
 @patch("core.management.commands.wait_for_db.Command.check")
@@ -27,3 +75,635 @@ class ComamndTests(SimpleTestCase):
 
         self.assertEqual(patched_check.call_count, 6)
         patched_check.assert_called_with(databases=["default"])
+
+
+class ReapBinaryLinksCommandTests(TestCase):
+    def setUp(self):
+        self.user = sample_user(username="user", password="testpassword")
+
+    def tearDown(self):
+        path = "/vol/web/media/uploads/user"
+        if os.path.exists(path):
+            shutil.rmtree(path)
+
+    def sample_link(self, age_seconds):
+        with tempfile.NamedTemporaryFile(suffix=".png") as image_file:
+            img = pillow_image.new("RGB", (1, 1))
+            img.save(image_file, "png")
+            image_file.seek(0)
+
+            image = InMemoryUploadedFile(
+                image_file,
+                "image",
+                "image.png",
+                "png",
+                image_file.tell(),
+                None,
+            )
+
+            return sample_binary_image_link(
+                user=self.user,
+                exist_seconds=300,
+                binary_image=image,
+                date_created=timezone.now() - timedelta(seconds=age_seconds),
+            )
+
+    def test_expires_at_is_indexed_expiry(self):
+        link = self.sample_link(age_seconds=0)
+
+        self.assertEqual(
+            link.expires_at, link.date_created + timedelta(seconds=300)
+        )
+        self.assertTrue(
+            BinaryImageLink._meta.get_field("expires_at").db_index
+        )
+
+    def test_reap_binary_links(self):
+        expired = [self.sample_link(age_seconds=301) for _ in range(3)]
+        alive = self.sample_link(age_seconds=0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("reap_binary_links", batch_size=2, stdout=StringIO())
+
+        self.assertEqual(list(BinaryImageLink.objects.all()), [alive])
+        self.assertTrue(os.path.exists(alive.binary_image.path))
+        for link in expired:
+            self.assertFalse(os.path.exists(link.binary_image.path))
+
+
+class BenchmarkThumbnailEnginesCommandTests(SimpleTestCase):
+    def test_benchmark_thumbnail_engines(self):
+        out = StringIO()
+
+        call_command(
+            "benchmark_thumbnail_engines",
+            width=64,
+            height=48,
+            heights=[10],
+            iterations=1,
+            stdout=out,
+        )
+
+        output = out.getvalue()
+        self.assertIn("Source: 64x48 JPEG", output)
+        self.assertIn("core.thumbnail_engine.Engine", output)
+        self.assertIn("sorl.thumbnail.engines.pil_engine.Engine", output)
+
+
+class BenchmarkAsyncViewsCommandTests(TransactionTestCase):
+    def tearDown(self):
+        shutil.rmtree("/vol/web/media/cache", ignore_errors=True)
+        for path in glob.glob("/vol/web/media/uploads/benchmark-*"):
+            shutil.rmtree(path)
+
+    def test_benchmark_async_views(self):
+        out = StringIO()
+
+        call_command(
+            "benchmark_async_views",
+            requests=4,
+            concurrency=2,
+            images=2,
+            stdout=out,
+        )
+
+        output = out.getvalue()
+        for line in ("get-binary-link  wsgi", "get-binary-link  asgi"):
+            self.assertIn(line, output)
+        for line in ("images-list      wsgi", "images-list      asgi"):
+            self.assertIn(line, output)
+        self.assertFalse(Image.objects.exists())
+
+    def test_invalid_counts(self):
+        for option in ("requests", "concurrency", "images"):
+            with self.assertRaisesMessage(CommandError, f"--{option}"):
+                call_command(
+                    "benchmark_async_views", stdout=StringIO(), **{option: 0}
+                )
+        self.assertFalse(get_user_model().objects.exists())
+
+
+class BenchmarkCommandTests(TransactionTestCase):
+    def tearDown(self):
+        shutil.rmtree("/vol/web/media/cache", ignore_errors=True)
+
+    def run_benchmark(self, concurrency):
+        with tempfile.NamedTemporaryFile(suffix=".json") as output:
+            call_command(
+                "benchmark",
+                users_per_tier=1,
+                images_per_user=1,
+                image_size="64x48",
+                requests=4,
+                concurrency=concurrency,
+                output=output.name,
+                stdout=StringIO(),
+            )
+            return json.load(output)
+
+    def test_benchmark(self):
+        report = self.run_benchmark(concurrency=1)
+
+        self.assertEqual(
+            set(report["endpoints"]),
+            {
+                "images-list",
+                "images-image-upload",
+                "create-link",
+                "get-binary-link",
+            },
+        )
+        for summary in report["endpoints"].values():
+            self.assertEqual(summary["requests"], 4)
+            self.assertEqual(summary["errors"], 0)
+            self.assertLessEqual(summary["p50"], summary["p99"])
+            self.assertIsNotNone(summary["queries_per_request"])
+
+        self.assertFalse(Image.objects.exists())
+        self.assertFalse(Tier.objects.exists())
+        self.assertEqual(glob.glob("/vol/web/media/uploads/benchmark-*"), [])
+
+    @override_settings(MEDIA_PATH_LAYOUT="hashed")
+    def test_benchmark_removes_hashed_uploads(self):
+        def uploads():
+            return set(glob.glob("/vol/web/media/uploads/**", recursive=True))
+
+        before = uploads()
+
+        self.run_benchmark(concurrency=1)
+
+        created = uploads() - before
+        for path in created:
+            self.addCleanup(shutil.rmtree, path, ignore_errors=True)
+        # Only the emptied fan-out levels uploads/<aa>/<bb> may remain.
+        depth = "/vol/web/media/uploads/aa/bb".count("/")
+        self.assertEqual(
+            {path for path in created if path.count("/") > depth}, set()
+        )
+
+    @skipIf(
+        connection.vendor == "sqlite",
+        "Concurrent uploads hit SQLite's database-wide write lock.",
+    )
+    def test_benchmark_concurrent_clients(self):
+        report = self.run_benchmark(concurrency=2)
+
+        for summary in report["endpoints"].values():
+            self.assertEqual(summary["requests"], 4)
+            self.assertEqual(summary["errors"], 0)
+
+
+class GenerateDatasetCommandTests(TestCase):
+    def tearDown(self):
+        for path in glob.glob("/vol/web/media/uploads/synthetic-*"):
+            shutil.rmtree(path)
+
+    def generate(self, **options):
+        options = {
+            "users": 6,
+            "images_per_user": 2,
+            "links_per_image": 1,
+            "tiers": "Basic=1,Enterprise=1",
+            "image_sizes": "32x24",
+            "formats": "jpeg,PNG",
+            "pool_size": 3,
+            "seed": 1,
+            "batch_size": 4,
+            **options,
+        }
+        call_command("generate_dataset", stdout=StringIO(), **options)
+
+    def test_generate_dataset(self):
+        self.generate(expired_ratio=1)
+
+        users = get_user_model().objects.filter(
+            username__startswith="synthetic-"
+        )
+        self.assertEqual(users.count(), 6)
+        self.assertEqual(
+            set(Tier.objects.values_list("name", flat=True)),
+            {"Basic", "Enterprise"},
+        )
+
+        images = Image.objects.select_related("user__tier")
+        self.assertEqual(images.count(), 12)
+        for image in images:
+            self.assertEqual(
+                image.image.name,
+                f"uploads/{image.user.username}/{image.content_hash}"
+                f"{os.path.splitext(image.image.name)[1]}",
+            )
+            self.assertTrue(os.path.exists(image.image.path))
+        self.assertEqual(
+            glob.glob("/vol/web/media/tmp*"),
+            [],
+        )
+
+        links = BinaryImageLink.objects.select_related("user__tier")
+        self.assertEqual(
+            links.count(),
+            images.filter(user__tier__can_create_link=True).count(),
+        )
+        for link in links:
+            self.assertTrue(link.user.tier.can_create_link)
+            self.assertEqual(link.image.user_id, link.user_id)
+            self.assertLessEqual(link.expires_at, timezone.now())
+
+        call_command("reap_binary_links", stdout=StringIO())
+        self.assertFalse(BinaryImageLink.objects.exists())
+
+    def test_delete(self):
+        self.generate()
+
+        call_command("generate_dataset", delete=True, stdout=StringIO())
+
+        self.assertFalse(get_user_model().objects.exists())
+        self.assertFalse(Image.objects.exists())
+        self.assertEqual(glob.glob("/vol/web/media/uploads/synthetic-*"), [])
+
+    def test_invalid_distribution(self):
+        with self.assertRaises(CommandError):
+            self.generate(image_sizes="large")
+        with self.assertRaises(CommandError):
+            self.generate(formats="GIF")
+        with self.assertRaises(CommandError):
+            self.generate(tiers="Unknown")
+
+
+@skipUnless(connection.vendor == "postgresql", "COPY is PostgreSQL only.")
+class CopyRowsTests(TestCase):
+    def test_copy_rows(self):
+        tier = sample_tier(name="Basic")
+        User = get_user_model()
+        copy_rows(
+            User,
+            [
+                User(
+                    username="staff",
+                    email="staff@email.com",
+                    is_staff=True,
+                    tier=tier,
+                ),
+                User(username="plain", email="plain@email.com"),
+            ],
+        )
+        staff = User.objects.get(username="staff")
+        plain = User.objects.get(username="plain")
+        self.assertEqual(
+            (staff.is_staff, staff.is_active, staff.tier_id),
+            (True, True, tier.pk),
+        )
+        self.assertEqual(
+            (plain.is_staff, plain.tier_id, plain.last_login),
+            (False, None, None),
+        )
+
+        image = Image(
+            user=staff, image="uploads/staff/a.png", content_hash="a" * 64
+        )
+        copy_rows(Image, [image])
+        image = Image.objects.get(user=staff)
+        self.assertEqual(image.binary_image.name, "")
+
+        created = timezone.now().replace(microsecond=123456)
+        links = [
+            BinaryImageLink(
+                user=staff,
+                image=image,
+                exist_seconds=300,
+                date_created=created,
+                expires_at=created + timedelta(seconds=300),
+            ),
+            BinaryImageLink(
+                user=staff,
+                binary_image="uploads/staff/binary/b.png",
+                exist_seconds=60,
+                date_created=created,
+                expires_at=created + timedelta(seconds=60),
+            ),
+        ]
+        copy_rows(BinaryImageLink, links)
+
+        for link in links:
+            copied = BinaryImageLink.objects.get(pk=link.id)
+            self.assertEqual(copied.image_id, link.image_id)
+            self.assertEqual(copied.binary_image.name, link.binary_image.name)
+            self.assertEqual(copied.date_created, created)
+            self.assertEqual(copied.expires_at, link.expires_at)
+
+
+class GCMediaCommandTests(TestCase):
+    def setUp(self):
+        tier = sample_tier(name="Basic")
+        tier.thumbnails.add(Thumbnail.objects.create(value=20))
+        self.user = sample_user(
+            username="user", password="testpassword", tier=tier
+        )
+        self.image = self.sample_image((40, 30))
+        render_binary_image(self.image.pk)
+        self.image.refresh_from_db()
+        self.deleted = self.sample_image((40, 31))
+        Image.objects.filter(pk=self.deleted.pk)._raw_delete("default")
+
+        self.orphan = self.write_file("uploads/user/binary/orphan.png")
+        self.orphan_thumbnail = self.write_file("cache/00/00/orphan.jpg")
+        self.fresh_orphan = self.write_file("uploads/user/fresh.png", age=0)
+        self.age(self.deleted.image.path)
+
+    def tearDown(self):
+        for path in ("/vol/web/media/uploads/user", "/vol/web/media/cache"):
+            shutil.rmtree(path, ignore_errors=True)
+
+    def sample_image(self, size):
+        image = Image.objects.create(
+            user=self.user, image=sample_image_file(size)
+        )
+        generate_thumbnails(image.pk)
+        return image
+
+    def age(self, path, seconds=86400):
+        mtime = time.time() - seconds
+        os.utime(path, (mtime, mtime))
+
+    def write_file(self, name, age=86400):
+        path = os.path.join("/vol/web/media", name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as media_file:
+            media_file.write(b"x" * 100)
+        if age:
+            self.age(path, age)
+        return path
+
+    def thumbnails(self, image):
+        return [
+            default.backend.get_cached_thumbnail(
+                image.image, "x20", **thumbnail_options(variant)
+            )
+            for variant in (None, "image/webp")
+        ]
+
+    def gc(self, **options):
+        out = StringIO()
+        call_command("gc_media", batch_size=2, stdout=out, **options)
+        return out.getvalue()
+
+    def test_dry_run(self):
+        thumbnails = self.thumbnails(self.deleted)
+
+        output = self.gc(dry_run=True)
+
+        self.assertIn("Would reclaim", output)
+        for path in (self.orphan, self.orphan_thumbnail, self.fresh_orphan):
+            self.assertTrue(os.path.exists(path))
+        self.assertTrue(os.path.exists(self.deleted.image.path))
+        for thumbnail in thumbnails:
+            self.assertTrue(thumbnail.exists())
+
+    def test_gc_media(self):
+        kept = [self.image.image.path, self.image.binary_image.path]
+        kept += [
+            thumbnail.storage.path(thumbnail.name)
+            for thumbnail in self.thumbnails(self.image)
+        ]
+        dropped = [
+            thumbnail.storage.path(thumbnail.name)
+            for thumbnail in self.thumbnails(self.deleted)
+        ]
+        dropped += [
+            self.orphan,
+            self.orphan_thumbnail,
+            self.deleted.image.path,
+        ]
+        sizes = sum(os.path.getsize(path) for path in dropped)
+
+        output = self.gc()
+
+        self.assertIn(f"Reclaimed {sizes} bytes.", output)
+        for path in kept + [self.fresh_orphan]:
+            self.assertTrue(os.path.exists(path), path)
+        for path in dropped:
+            self.assertFalse(os.path.exists(path), path)
+        self.assertEqual(self.thumbnails(self.deleted), [None, None])
+        self.assertTrue(all(self.thumbnails(self.image)))
+        recorded_sources = KVStoreModel.objects.filter(
+            key__contains="||source||"
+        )
+        self.assertEqual(
+            set(recorded_sources.values_list("value", flat=True)),
+            {json.dumps(self.image.image.name)},
+        )
+
+        output = self.gc()
+        self.assertIn("Reclaimed 0 bytes.", output)
+
+    def test_stale_thumbnail_entries(self):
+        thumbnail = self.thumbnails(self.image)[0]
+        thumbnail.delete()
+
+        self.gc()
+
+        self.assertEqual(self.thumbnails(self.image)[0], None)
+        self.assertIsNotNone(self.thumbnails(self.image)[1])
+
+
+class MigrateMediaLayoutCommandTests(TestCase):
+    def setUp(self):
+        tier = sample_tier(name="Basic")
+        tier.thumbnails.add(Thumbnail.objects.create(value=20))
+        self.user = sample_user(
+            username="user", password="testpassword", tier=tier
+        )
+        self.image = Image.objects.create(
+            user=self.user, image=sample_image_file((40, 30))
+        )
+        self.duplicate = Image.objects.create(
+            user=self.user, image=sample_image_file((40, 30))
+        )
+        generate_thumbnails(self.image.pk)
+        render_binary_image(self.image.pk)
+        self.link = sample_binary_image_link(
+            user=self.user,
+            image=self.image,
+            exist_seconds=300,
+            binary_image=sample_image_file(),
+        )
+        self.image.refresh_from_db()
+        self.names = self.file_names()
+        self.thumbnail_paths = self.thumbnail_files()
+
+    def tearDown(self):
+        # uploads/<aa>/, the first fan-out level of the user's files.
+        fan_out = user_upload_dir(self.user, "hashed").split("/")[:2]
+        paths = [
+            "/vol/web/media/uploads/user",
+            "/vol/web/media/cache",
+            default_storage.path("/".join(fan_out)),
+        ]
+        for path in paths:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def file_names(self):
+        image = Image.objects.get(pk=self.image.pk)
+        return {
+            "image": image.image.name,
+            "duplicate": Image.objects.get(pk=self.duplicate.pk).image.name,
+            "binary_image": image.binary_image.name,
+            "link": BinaryImageLink.objects.get(
+                pk=self.link.pk
+            ).binary_image.name,
+        }
+
+    def thumbnail_files(self):
+        thumbnails = [
+            default.backend.get_cached_thumbnail(
+                Image.objects.get(pk=self.image.pk).image,
+                "x20",
+                **thumbnail_options(variant),
+            )
+            for variant in (None, "image/webp")
+        ]
+        return [
+            None
+            if thumbnail is None
+            else thumbnail.storage.path(thumbnail.name)
+            for thumbnail in thumbnails
+        ]
+
+    def migrate(self, **options):
+        out = StringIO()
+        options = {"batch_size": 1, "layout": "hashed", **options}
+        call_command("migrate_media_layout", stdout=out, **options)
+        return out.getvalue()
+
+    def test_migrate(self):
+        output = self.migrate()
+
+        self.assertIn("Moved 3 files and 2 thumbnails", output)
+        names = self.file_names()
+        directory = user_upload_dir(self.user, "hashed")
+        for key, name in names.items():
+            self.assertTrue(name.startswith(f"{directory}/"), name)
+            self.assertTrue(default_storage.exists(name), name)
+            self.assertFalse(default_storage.exists(self.names[key]), name)
+        self.assertEqual(names["image"], names["duplicate"])
+        self.assertIn("/binary/", names["binary_image"])
+
+        # Thumbnails are carried over instead of generated again.
+        for path, new_path in zip(
+            self.thumbnail_paths, self.thumbnail_files()
+        ):
+            self.assertFalse(os.path.exists(path))
+            self.assertTrue(os.path.exists(new_path))
+
+        self.assertIn("Moved 0 files", self.migrate())
+
+    @override_settings(
+        CACHES={
+            "default": {
+                "BACKEND": "django.core.cache.backends.locmem.LocMemCache"
+            }
+        }
+    )
+    def test_binary_link_urls_cached_again(self):
+        shared = sample_binary_image_link(
+            user=self.user, image=self.image, exist_seconds=300
+        )
+        for link in (self.link, shared):
+            cache_binary_link(link)
+
+        self.migrate()
+
+        for link in (self.link, shared):
+            name = BinaryImageLink.objects.get(pk=link.pk).rendered_image.name
+            directory = user_upload_dir(self.user, "hashed")
+            self.assertTrue(name.startswith(f"{directory}/"), name)
+            url = cache.get(binary_link_cache_key(link.id))
+            self.assertTrue(url.endswith(name), url)
+        cache.clear()
+
+    def test_upload_deduplicated_during_rewrite(self):
+        uploads, referenced = [], []
+
+        def rewrite_during_upload(model, field, names):
+            rewrite_names(model, field, names)
+            if field == "image" and not uploads:
+                # Committed before the rewrite locked the image it shares
+                # the file with, so the rewrite does not see it.
+                uploads.append(
+                    Image.objects.create(
+                        user=self.user,
+                        image=self.names["image"],
+                        content_hash=self.image.content_hash,
+                    )
+                )
+
+        def delete_unreferenced(name):
+            if Image.objects.filter(image=name).exists():
+                referenced.append(name)
+            delete(name)
+
+        delete = default.backend.delete
+        with patch(
+            "core.management.commands.migrate_media_layout.rewrite_names",
+            side_effect=rewrite_during_upload,
+        ), patch.object(
+            default.backend, "delete", side_effect=delete_unreferenced
+        ):
+            self.migrate()
+
+        self.assertEqual(referenced, [])
+        upload = Image.objects.get(pk=uploads[0].pk)
+        self.assertEqual(upload.image.name, self.file_names()["image"])
+        self.assertTrue(default_storage.exists(upload.image.name))
+
+    def test_migrated_files_are_kept_by_gc(self):
+        self.migrate()
+
+        out = StringIO()
+        call_command("gc_media", min_age=0, stdout=out)
+
+        self.assertIn("Reclaimed 0 bytes.", out.getvalue())
+
+    def test_round_trip(self):
+        self.migrate()
+        self.migrate(layout="username")
+
+        self.assertEqual(self.file_names(), self.names)
+        self.assertTrue(all(map(os.path.exists, self.thumbnail_files())))
+
+    def test_dry_run(self):
+        output = self.migrate(dry_run=True)
+
+        self.assertIn("Would move 3 files", output)
+        self.assertEqual(self.file_names(), self.names)
+
+    def test_resume_from_checkpoint(self):
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint = os.path.join(directory, "migrate.json")
+            with open(checkpoint, "w") as checkpoint_file:
+                json.dump(
+                    {
+                        "layout": "hashed",
+                        "phase": "links",
+                        "last_pk": None,
+                    },
+                    checkpoint_file,
+                )
+
+            output = self.migrate(checkpoint=checkpoint)
+
+            self.assertIn("Moved 1 files", output)
+            self.assertFalse(os.path.exists(checkpoint))
+        self.assertEqual(self.file_names()["image"], self.names["image"])
+
+    def test_checkpoint_of_other_layout(self):
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint = os.path.join(directory, "migrate.json")
+            with open(checkpoint, "w") as checkpoint_file:
+                json.dump(
+                    {"layout": "username", "phase": "images", "last_pk": "1"},
+                    checkpoint_file,
+                )
+
+            with self.assertRaises(CommandError):
+                self.migrate(checkpoint=checkpoint)
@@ -2,6 +2,8 @@ import os
 import shutil
 import tempfile
 from datetime import timedelta
+from io import BytesIO
+from unittest.mock import patch
 
 from PIL import Image as pillow_image
 
@@ -10,12 +12,46 @@ from rest_framework.test import APITestCase
 
 from django.urls import reverse
 from django.core.files.uploadedfile import InMemoryUploadedFile
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DatabaseError, connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 
 from core.models import Image, BinaryImageLink
+from core.uploadhandlers import ImageUploadHandler
+from core.binary_images import binary_link_cache_key, render_binary_image
+from core.serializers import THUMBNAIL_PENDING
+from core.thumbnails import (
+    cache_misses,
+    generate_thumbnails,
+    thumbnails_queued_key,
+)
 from .test_models import sample_user, sample_tier, sample_thumbnail
 
 IMAGES_LIST_URL = reverse("core:images-list")
 IMAGE_UPLOAD_URL = reverse("core:images-image-upload")
+BATCH_UPLOAD_URL = reverse("core:images-batch-upload")
+
+
+def sample_uploaded_image(user):
+    with tempfile.NamedTemporaryFile(suffix=".png") as image_file:
+        img = pillow_image.new("RGB", (200, 200))
+        img.save(image_file, "png")
+        image_file.seek(0)
+
+        img = InMemoryUploadedFile(
+            image_file,
+            "image",
+            "image.png",
+            "png",
+            image_file.tell(),
+            None,
+        )
+        image = Image.objects.create(user=user, image=img)
+
+    generate_thumbnails(image.pk)
+    return image
 
 
 def create_binary_link_url(image_pk):
@@ -198,6 +234,96 @@ class ImagesAPITests(APITestCase):
         self.assertIn("image", res.data.get('results')[0])
         self.assertIn("binary_image_link", res.data.get('results')[0])
 
+    def test_upload_image_generates_thumbnails(self):
+        self.user.tier = self.premium_tier
+        self.user.save()
+        self.client.force_authenticate(user=self.user)
+
+        with tempfile.NamedTemporaryFile(suffix=".png") as image_file:
+            img = pillow_image.new("RGB", (200, 200))
+            img.save(image_file, "png")
+            image_file.seek(0)
+            payload = {"image": image_file}
+            self.client.post(IMAGE_UPLOAD_URL, payload, format="multipart")
+
+        res = self.client.get(IMAGES_LIST_URL)
+
+        for data in res.data.get("results")[0].get("thumbnails"):
+            for url in data.values():
+                self.assertNotEqual(url, THUMBNAIL_PENDING)
+                self.assertIn("/cache/", url)
+
+    def test_list_negotiates_webp_thumbnails(self):
+        self.user.tier = self.premium_tier
+        self.user.save()
+        self.client.force_authenticate(user=self.user)
+        sample_uploaded_image(self.user)
+
+        legacy = self.client.get(IMAGES_LIST_URL)
+        webp = self.client.get(
+            IMAGES_LIST_URL, HTTP_ACCEPT="image/avif,image/webp,*/*;q=0.8"
+        )
+        weighted = self.client.get(
+            IMAGES_LIST_URL, HTTP_ACCEPT="Image/WebP; Q=0.5, */*"
+        )
+        responses = [(legacy, ".jpg"), (webp, ".webp"), (weighted, ".webp")]
+        for accept in (
+            "image/webp;q=0, */*",
+            "image/webp; q=0.0, */*",
+            "image/webp;q=0.000;level=1, */*",
+            "image/webp;q=high, */*",
+        ):
+            refused = self.client.get(IMAGES_LIST_URL, HTTP_ACCEPT=accept)
+            responses.append((refused, ".jpg"))
+
+        for res, ext in responses:
+            self.assertIn("Accept", res["Vary"])
+            for data in res.data.get("results")[0].get("thumbnails"):
+                for url in data.values():
+                    self.assertTrue(url.endswith(ext), url)
+
+    def test_upload_identical_images_share_files(self):
+        self.user.tier = self.premium_tier
+        self.user.save()
+        self.client.force_authenticate(user=self.user)
+
+        with tempfile.NamedTemporaryFile(suffix=".png") as image_file:
+            img = pillow_image.new("RGB", (200, 200))
+            img.save(image_file, "png")
+            for _ in range(2):
+                image_file.seek(0)
+                payload = {"image": image_file}
+                self.client.post(
+                    IMAGE_UPLOAD_URL, payload, format="multipart"
+                )
+
+        image1, image2 = self.user.image_set.all()
+        self.assertEqual(image1.image.name, image2.image.name)
+
+        res = self.client.get(IMAGES_LIST_URL, {"limit": 2})
+        results = res.data.get("results")
+        self.assertEqual(results[0], results[1])
+
+    @patch("core.thumbnails.enqueue")
+    def test_list_reports_pending_thumbnails(self, patched_enqueue):
+        self.user.tier = self.premium_tier
+        self.user.save()
+        self.client.force_authenticate(user=self.user)
+
+        with tempfile.NamedTemporaryFile(suffix=".png") as image_file:
+            img = pillow_image.new("RGB", (200, 200))
+            img.save(image_file, "png")
+            image_file.seek(0)
+            payload = {"image": image_file}
+            self.client.post(IMAGE_UPLOAD_URL, payload, format="multipart")
+
+        self.assertEqual(patched_enqueue.call_count, 1)
+
+        res = self.client.get(IMAGES_LIST_URL)
+
+        for data in res.data.get("results")[0].get("thumbnails"):
+            self.assertEqual(list(data.values()), [THUMBNAIL_PENDING])
+
     def test_pagination(self):
         self.user.tier = self.basic_tier
         self.user.save()
@@ -238,6 +364,184 @@ class ImagesAPITests(APITestCase):
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertEqual(self.user.image_set.count(), 0)
 
+    def test_upload_image_with_fake_content(self):
+        self.user.tier = self.basic_tier
+        self.user.save()
+        self.client.force_authenticate(user=self.user)
+
+        with tempfile.NamedTemporaryFile(suffix=".png") as image_file:
+            image_file.write(b"not an image" * 100)
+            image_file.seek(0)
+            payload = {"image": image_file}
+            res = self.client.post(
+                IMAGE_UPLOAD_URL, payload, format="multipart"
+            )
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.user.image_set.count(), 0)
+
+    @override_settings(IMAGE_UPLOAD_MAX_BYTES=1024)
+    def test_upload_image_too_large(self):
+        self.user.tier = self.basic_tier
+        self.user.save()
+        self.client.force_authenticate(user=self.user)
+
+        with tempfile.NamedTemporaryFile(suffix=".png") as image_file:
+            img = pillow_image.effect_noise((200, 200), 100)
+            img.save(image_file, "png")
+            image_file.seek(0)
+            payload = {"image": image_file}
+            res = self.client.post(
+                IMAGE_UPLOAD_URL, payload, format="multipart"
+            )
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.user.image_set.count(), 0)
+
+    @override_settings(IMAGE_UPLOAD_MAX_PIXELS=100 * 100)
+    def test_upload_image_with_too_large_dimensions(self):
+        self.user.tier = self.basic_tier
+        self.user.save()
+        self.client.force_authenticate(user=self.user)
+
+        with tempfile.NamedTemporaryFile(suffix=".png") as image_file:
+            img = pillow_image.new("RGB", (200, 200))
+            img.save(image_file, "png")
+            image_file.seek(0)
+            payload = {"image": image_file}
+            res = self.client.post(
+                IMAGE_UPLOAD_URL, payload, format="multipart"
+            )
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.user.image_set.count(), 0)
+
+    def test_batch_upload_images(self):
+        self.user.tier = self.basic_tier
+        self.user.save()
+        self.client.force_authenticate(user=self.user)
+
+        files = []
+        for size in ((200, 200), (100, 100), (200, 200)):
+            image_file = tempfile.NamedTemporaryFile(suffix=".png")
+            pillow_image.new("RGB", size).save(image_file, "png")
+            image_file.seek(0)
+            files.append(image_file)
+
+        res = self.client.post(
+            BATCH_UPLOAD_URL, {"images": files}, format="multipart"
+        )
+        for image_file in files:
+            image_file.close()
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(res.data["results"]), 3)
+        images = self.user.image_set.order_by("id")
+        self.assertEqual(
+            [result["id"] for result in res.data["results"]],
+            [image.id for image in images],
+        )
+        self.assertEqual(images[0].image.name, images[2].image.name)
+        self.assertNotEqual(images[0].image.name, images[1].image.name)
+
+        res = self.client.get(IMAGES_LIST_URL, {"limit": 3})
+        for result in res.data.get("results"):
+            for data in result["thumbnails"]:
+                self.assertNotIn(THUMBNAIL_PENDING, data.values())
+
+    def test_batch_upload_reports_bad_files(self):
+        self.user.tier = self.basic_tier
+        self.user.save()
+        self.client.force_authenticate(user=self.user)
+
+        good = tempfile.NamedTemporaryFile(suffix=".png")
+        pillow_image.new("RGB", (200, 200)).save(good, "png")
+        good.seek(0)
+
+        truncated = tempfile.NamedTemporaryFile(suffix=".png")
+        buffer = BytesIO()
+        pillow_image.effect_noise((200, 200), 100).save(buffer, "png")
+        truncated.write(buffer.getvalue()[:2000])
+        truncated.seek(0)
+
+        fake = tempfile.NamedTemporaryFile(suffix=".jpg")
+        fake.write(b"not an image" * 100)
+        fake.seek(0)
+
+        res = self.client.post(
+            BATCH_UPLOAD_URL,
+            {"images": [good, truncated, fake]},
+            format="multipart",
+        )
+        for image_file in (good, truncated, fake):
+            image_file.close()
+
+        self.assertEqual(res.status_code, status.HTTP_207_MULTI_STATUS)
+        statuses = sorted(result["status"] for result in res.data["results"])
+        self.assertEqual(statuses, [201, 400, 400])
+        self.assertEqual(self.user.image_set.count(), 1)
+
+    def batch_upload(self, sizes):
+        self.user.tier = self.basic_tier
+        self.user.save()
+        self.client.force_authenticate(user=self.user)
+
+        files = []
+        for size in sizes:
+            image_file = tempfile.NamedTemporaryFile(suffix=".png")
+            pillow_image.new("RGB", size).save(image_file, "png")
+            image_file.seek(0)
+            files.append(image_file)
+        try:
+            return self.client.post(
+                BATCH_UPLOAD_URL, {"images": files}, format="multipart"
+            )
+        finally:
+            for image_file in files:
+                image_file.close()
+
+    @override_settings(IMAGE_BATCH_UPLOAD_MAX_FILES=2)
+    def test_batch_upload_too_many_files(self):
+        with patch(
+            "core.uploadhandlers.ImageUploadHandler.file_complete",
+            autospec=True,
+            side_effect=ImageUploadHandler.file_complete,
+        ) as patched_file_complete:
+            res = self.batch_upload([(100, 100), (200, 200), (300, 300)])
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(patched_file_complete.call_count, 2)
+        self.assertFalse(self.user.image_set.exists())
+
+    def test_batch_upload_removes_written_files_on_error(self):
+        existing = sample_uploaded_image(self.user)
+        bulk_create = Image.objects.bulk_create
+
+        def failing_bulk_create(images):
+            bulk_create(images)
+            raise DatabaseError("Connection lost.")
+
+        with patch.object(
+            Image.objects, "bulk_create", side_effect=failing_bulk_create
+        ):
+            with self.assertRaises(DatabaseError):
+                self.batch_upload([(200, 200), (100, 100)])
+
+        self.assertEqual(list(self.user.image_set.all()), [existing])
+        directory = os.path.dirname(existing.image.path)
+        self.assertEqual(
+            os.listdir(directory), [os.path.basename(existing.image.path)]
+        )
+
+    def test_batch_upload_without_files(self):
+        self.user.tier = self.basic_tier
+        self.user.save()
+        self.client.force_authenticate(user=self.user)
+
+        res = self.client.post(BATCH_UPLOAD_URL, {}, format="multipart")
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_create_binary_link_unauthorized(self):
         with tempfile.NamedTemporaryFile(suffix=".png") as image_file:
             img = pillow_image.new("RGB", (1, 1))
@@ -348,6 +652,60 @@ class ImagesAPITests(APITestCase):
         self.assertEqual(res.status_code, status.HTTP_201_CREATED)
         self.assertEqual(self.user.binaryimagelink_set.count(), 1)
 
+    def test_create_binary_links_share_grayscale_derivative(self):
+        self.user.tier = self.enterprise_tier
+        self.user.save()
+        self.client.force_authenticate(user=self.user)
+        image = sample_uploaded_image(self.user)
+
+        url = create_binary_link_url(image.pk)
+        payload = {"exist_seconds": 300}
+
+        with patch(
+            "core.views.render_binary_image", wraps=render_binary_image
+        ) as patched_render:
+            res1 = self.client.post(url, payload)
+            res2 = self.client.post(url, payload)
+
+        self.assertEqual(res1.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(res2.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(patched_render.call_count, 1)
+
+        image.refresh_from_db()
+        with pillow_image.open(image.binary_image) as binary_img:
+            self.assertEqual(binary_img.mode, "L")
+
+        links = self.user.binaryimagelink_set.all()
+        self.assertEqual(len(links), 2)
+        for link in links:
+            self.assertEqual(link.rendered_image, image.binary_image)
+
+    @patch("core.views.enqueue")
+    def test_create_binary_link_while_rendering(self, patched_enqueue):
+        self.user.tier = self.enterprise_tier
+        self.user.save()
+        self.client.force_authenticate(user=self.user)
+        image = sample_uploaded_image(self.user)
+
+        url = create_binary_link_url(image.pk)
+        res = self.client.post(url, {"exist_seconds": 300})
+
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        patched_enqueue.assert_called_once_with(
+            render_binary_image, image.pk
+        )
+
+        link = self.user.binaryimagelink_set.get()
+        res = self.client.get(get_binary_link_url(link.id))
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+
+        render_binary_image(image.pk)
+
+        res = self.client.get(get_binary_link_url(link.id))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        image.refresh_from_db()
+        self.assertTrue(res.data["image"].endswith(image.binary_image.url))
+
     def test_create_binary_link_with_lower_than_300_sec(self):
         self.user.tier = self.enterprise_tier
         self.user.save()
@@ -461,3 +819,302 @@ class ImagesAPITests(APITestCase):
         res = self.client.get(url)
 
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(
+    CACHES={
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache"
+        }
+    }
+)
+class ImagesListQueryCountTests(APITestCase):
+    def setUp(self):
+        thumbnails = [sample_thumbnail(value=value) for value in (100, 300)]
+
+        self.tier = sample_tier(name="Enterprise", can_create_link=True)
+        self.tier.thumbnails.set(thumbnails)
+
+        self.user = sample_user(
+            email="testuser@email.com",
+            username="user",
+            password="testpassword",
+            tier=self.tier,
+        )
+        self.client.force_authenticate(user=self.user)
+
+        for _ in range(5):
+            sample_uploaded_image(self.user)
+
+    def tearDown(self):
+        caches["default"].clear()
+        paths = ("/vol/web/media/uploads/user", "/vol/web/media/cache")
+        for path in paths:
+            if os.path.exists(path):
+                shutil.rmtree(path)
+
+    def count_list_queries(self, limit):
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(IMAGES_LIST_URL, {"limit": limit})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data.get("results")), limit)
+        return len(queries)
+
+    def test_list_query_count_does_not_depend_on_page_size(self):
+        self.assertEqual(
+            self.count_list_queries(1), self.count_list_queries(5)
+        )
+
+    def test_list_query_count_does_not_depend_on_tier_size(self):
+        queries = self.count_list_queries(5)
+        self.tier.thumbnails.add(sample_thumbnail(value=500))
+        for image in self.user.image_set.all():
+            generate_thumbnails(image.pk)
+
+        self.assertEqual(self.count_list_queries(5), queries)
+
+    def test_list_does_not_query_tiers(self):
+        self.count_list_queries(5)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(IMAGES_LIST_URL, {"limit": 5})
+
+        for query in queries:
+            self.assertNotIn("core_tier", query["sql"])
+
+    @override_settings(
+        CACHES={
+            "default": {
+                "BACKEND": "django.core.cache.backends.dummy.DummyCache"
+            }
+        }
+    )
+    def test_list_batches_thumbnail_kvstore_lookups(self):
+        self.assertEqual(
+            self.count_list_queries(1), self.count_list_queries(5)
+        )
+
+    def test_list_batches_thumbnail_cache_lookups(self):
+        with patch.object(
+            caches["default"], "get_many", wraps=caches["default"].get_many
+        ) as patched_get_many:
+            self.count_list_queries(5)
+
+        self.assertEqual(patched_get_many.call_count, 1)
+        self.assertEqual(len(patched_get_many.call_args.args[0]), 10)
+
+    def test_cursor_pagination(self):
+        ids = list(self.user.image_set.values_list("id", flat=True))
+        seen = []
+        url, params = IMAGES_LIST_URL, {"cursor": "", "limit": 2}
+
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                res = self.client.get(url, params)
+
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertNotIn("count", res.data)
+            for query in queries:
+                self.assertNotIn("COUNT(", query["sql"])
+                self.assertNotIn("OFFSET", query["sql"])
+
+            seen.extend(res.data.get("results"))
+            url, params = res.data.get("next"), None
+
+        self.assertEqual(len(seen), len(ids))
+
+    def test_cursor_pagination_query_count_does_not_depend_on_depth(self):
+        first = self.client.get(IMAGES_LIST_URL, {"cursor": "", "limit": 1})
+        next_url = first.data.get("next")
+        for _ in range(3):
+            next_url = self.client.get(next_url).data.get("next")
+
+        with CaptureQueriesContext(connection) as first_page:
+            self.client.get(IMAGES_LIST_URL, {"cursor": "", "limit": 1})
+        with CaptureQueriesContext(connection) as deep_page:
+            self.client.get(next_url)
+
+        self.assertEqual(len(first_page), len(deep_page))
+
+    def test_list_picks_fields_for_tier(self):
+        expected = {
+            "Basic": {"thumbnails"},
+            "Premium": {"image", "thumbnails"},
+            "Enterprise": {"image", "thumbnails", "binary_image_link"},
+        }
+        for name, fields in expected.items():
+            self.tier.name = name
+            with self.captureOnCommitCallbacks(execute=True):
+                self.tier.save()
+
+            res = self.client.get(IMAGES_LIST_URL)
+
+            self.assertEqual(set(res.data.get("results")[0]), fields)
+
+
+@override_settings(
+    CACHES={
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache"
+        }
+    }
+)
+class BinaryLinkCacheTests(APITestCase):
+    def setUp(self):
+        tier = sample_tier(name="Enterprise", can_create_link=True)
+        self.user = sample_user(
+            email="testuser@email.com",
+            username="user",
+            password="testpassword",
+            tier=tier,
+        )
+        self.client.force_authenticate(user=self.user)
+        self.image = sample_uploaded_image(self.user)
+
+    def tearDown(self):
+        caches["default"].clear()
+        paths = ("/vol/web/media/uploads/user", "/vol/web/media/cache")
+        for path in paths:
+            if os.path.exists(path):
+                shutil.rmtree(path)
+
+    def create_link(self, exist_seconds=300):
+        url = create_binary_link_url(self.image.pk)
+        self.client.post(url, {"exist_seconds": exist_seconds})
+        return self.user.binaryimagelink_set.latest("date_created")
+
+    def test_get_binary_link_from_cache(self):
+        link = self.create_link()
+
+        with self.assertNumQueries(0):
+            res = self.client.get(get_binary_link_url(link.id))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.image.refresh_from_db()
+        url = self.image.binary_image.url
+        self.assertTrue(res.data["image"].endswith(url))
+
+    def test_binary_link_cached_for_its_lifetime(self):
+        with patch.object(caches["default"], "set") as patched_set:
+            link = self.create_link(exist_seconds=600)
+
+        key, url, timeout = patched_set.call_args.args
+        self.assertEqual(key, binary_link_cache_key(link.id))
+        self.assertIn(timeout, (599, 600))
+
+    def test_get_binary_link_after_cache_miss(self):
+        link = self.create_link()
+        caches["default"].clear()
+
+        res = self.client.get(get_binary_link_url(link.id))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        with self.assertNumQueries(0):
+            self.client.get(get_binary_link_url(link.id))
+
+    def test_deleted_binary_link_evicted(self):
+        link = self.create_link()
+        url = get_binary_link_url(link.id)
+        link.delete()
+
+        res = self.client.get(url)
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(
+    CACHES={
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache"
+        }
+    }
+)
+class ThumbnailCacheTests(APITestCase):
+    def setUp(self):
+        tier = sample_tier(name="Basic")
+        tier.thumbnails.add(sample_thumbnail(value=100))
+        self.user = sample_user(
+            email="testuser@email.com",
+            username="user",
+            password="testpassword",
+            tier=tier,
+        )
+        self.client.force_authenticate(user=self.user)
+
+        with patch("core.thumbnails.enqueue"):
+            with tempfile.NamedTemporaryFile(suffix=".png") as image_file:
+                pillow_image.new("RGB", (200, 200)).save(image_file, "png")
+                image_file.seek(0)
+                self.client.post(
+                    IMAGE_UPLOAD_URL, {"image": image_file}, format="multipart"
+                )
+        self.image = self.user.image_set.get()
+
+    def tearDown(self):
+        caches["default"].clear()
+        paths = ("/vol/web/media/uploads/user", "/vol/web/media/cache")
+        for path in paths:
+            if os.path.exists(path):
+                shutil.rmtree(path)
+
+    def list_thumbnails(self):
+        res = self.client.get(IMAGES_LIST_URL)
+        return res.data.get("results")[0].get("thumbnails")
+
+    def test_list_after_thumbnails_are_generated(self):
+        self.assertEqual(self.list_thumbnails(), [{100: THUMBNAIL_PENDING}])
+
+        generate_thumbnails(self.image.pk)
+
+        self.assertNotEqual(self.list_thumbnails(), [{100: THUMBNAIL_PENDING}])
+
+    def test_thumbnail_generated_during_list_is_not_hidden(self):
+        def generate_then_cache_misses(cache, keys):
+            # The worker stores the thumbnail after the list read the
+            # database but before it cached the miss.
+            patched_cache_misses.side_effect = cache_misses
+            generate_thumbnails(self.image.pk)
+            cache_misses(cache, keys)
+
+        with patch(
+            "core.thumbnails.cache_misses",
+            side_effect=generate_then_cache_misses,
+        ) as patched_cache_misses:
+            self.assertEqual(
+                self.list_thumbnails(), [{100: THUMBNAIL_PENDING}]
+            )
+
+        self.assertNotEqual(self.list_thumbnails(), [{100: THUMBNAIL_PENDING}])
+
+    @patch("core.thumbnails.cache_misses")
+    def test_misses_are_cached_briefly(self, patched_cache_misses):
+        self.list_thumbnails()
+
+        patched_cache_misses.assert_called_once()
+        cache, keys = patched_cache_misses.call_args.args
+        with patch.object(cache, "add") as patched_add:
+            cache_misses(cache, keys)
+
+        timeout = patched_add.call_args.args[2]
+        self.assertEqual(timeout, settings.THUMBNAIL_MISS_CACHE_TIMEOUT)
+
+    @patch("core.thumbnails.enqueue")
+    def test_list_queues_lost_thumbnail_tasks(self, patched_enqueue):
+        self.list_thumbnails()
+        patched_enqueue.assert_not_called()
+
+        # The upload's task is older than THUMBNAIL_TASK_TIMEOUT.
+        caches["default"].delete(thumbnails_queued_key(self.image.pk))
+        self.list_thumbnails()
+        self.list_thumbnails()
+
+        patched_enqueue.assert_called_once_with(
+            generate_thumbnails, self.image.pk
+        )
+
+    def test_list_generates_lost_thumbnails(self):
+        caches["default"].delete(thumbnails_queued_key(self.image.pk))
+
+        self.assertEqual(self.list_thumbnails(), [{100: THUMBNAIL_PENDING}])
+        self.assertNotEqual(self.list_thumbnails(), [{100: THUMBNAIL_PENDING}])
@@ -0,0 +1,231 @@
+import os
+import shutil
+
+from datetime import timedelta
+
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from django.core.files.storage import default_storage
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from sorl.thumbnail import default
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+from core.binary_images import render_binary_image
+from core.models import user_upload_dir
+from core.serializers import THUMBNAIL_PENDING
+from core.thumbnails import thumbnail_geometry, thumbnail_options
+from .test_images_api import sample_uploaded_image
+from .test_models import (
+    sample_binary_image_link,
+    sample_thumbnail,
+    sample_tier,
+    sample_user,
+)
+
+IMAGES_LIST_URL = reverse("core:images-list")
+
+
+def media_url(name):
+    return reverse("media", args=[name])
+
+
+@override_settings(MEDIA_SENDFILE_BACKEND="x-accel-redirect")
+class ServeMediaTests(APITestCase):
+    def setUp(self):
+        self.premium_tier = sample_tier(name="Premium")
+        self.premium_tier.thumbnails.add(sample_thumbnail(value=100))
+        self.basic_tier = sample_tier(name="Basic")
+
+        self.user = sample_user(
+            email="testuser@email.com",
+            username="user",
+            password="testpassword",
+            tier=self.premium_tier,
+        )
+        self.image = sample_uploaded_image(self.user)
+
+    def tearDown(self):
+        paths = ("/vol/web/media/uploads/user", "/vol/web/media/cache")
+        for path in paths:
+            if os.path.exists(path):
+                shutil.rmtree(path)
+
+    def thumbnail(self):
+        return default.backend.get_cached_thumbnail(
+            self.image.image, thumbnail_geometry(100), **thumbnail_options()
+        )
+
+    def test_serve_original(self):
+        self.client.force_authenticate(user=self.user)
+
+        res = self.client.get(media_url(self.image.image.name))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            res["X-Accel-Redirect"],
+            f"/protected-media/{self.image.image.name}",
+        )
+        self.assertEqual(res["Content-Type"], "image/png")
+        self.assertIn("immutable", res["Cache-Control"])
+        self.assertTrue(res["ETag"].startswith('"'))
+        self.assertIn("Last-Modified", res)
+        self.assertFalse(res.content)
+
+    @override_settings(MEDIA_SENDFILE_BACKEND="x-sendfile")
+    def test_serve_original_with_x_sendfile(self):
+        self.client.force_authenticate(user=self.user)
+
+        res = self.client.get(media_url(self.image.image.name))
+
+        self.assertEqual(res["X-Sendfile"], self.image.image.path)
+
+    def test_serve_original_not_modified(self):
+        self.client.force_authenticate(user=self.user)
+        url = media_url(self.image.image.name)
+        etag = self.client.get(url)["ETag"]
+
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(res["ETag"], etag)
+        self.assertNotIn("X-Accel-Redirect", res)
+
+    def test_serve_original_unauthorized(self):
+        res = self.client.get(media_url(self.image.image.name))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_serve_original_of_other_user(self):
+        other = sample_user(
+            email="other@email.com",
+            username="other",
+            password="testpassword",
+            tier=self.premium_tier,
+        )
+        self.client.force_authenticate(user=other)
+
+        res = self.client.get(media_url(self.image.image.name))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_serve_original_with_basic_tier(self):
+        self.user.tier = self.basic_tier
+        self.user.save()
+        self.client.force_authenticate(user=self.user)
+
+        res = self.client.get(media_url(self.image.image.name))
+
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_serve_thumbnail(self):
+        self.client.force_authenticate(user=self.user)
+        thumbnails = self.client.get(IMAGES_LIST_URL).data["results"][0]
+        url = thumbnails["thumbnails"][0][100]
+        self.assertNotEqual(url, THUMBNAIL_PENDING)
+
+        res = self.client.get(url)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIn("X-Accel-Redirect", res)
+
+    def test_serve_thumbnail_of_other_user(self):
+        other = sample_user(
+            email="other@email.com",
+            username="other",
+            password="testpassword",
+            tier=self.premium_tier,
+        )
+        self.client.force_authenticate(user=other)
+
+        res = self.client.get(media_url(self.thumbnail().name))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_serve_thumbnail_outside_tier(self):
+        thumbnail = default.backend.get_thumbnail(
+            self.image.image, thumbnail_geometry(300), **thumbnail_options()
+        )
+        self.client.force_authenticate(user=self.user)
+
+        res = self.client.get(media_url(thumbnail.name))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_serve_unknown_thumbnail(self):
+        self.client.force_authenticate(user=self.user)
+
+        res = self.client.get(media_url("cache/00/00/unknown.jpg"))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_serve_thumbnail_without_recorded_source(self):
+        thumbnail = self.thumbnail()
+        source_key = add_prefix(thumbnail.key, identity="source")
+        KVStoreModel.objects.filter(key=source_key).delete()
+        self.client.force_authenticate(user=self.user)
+
+        res = self.client.get(media_url(thumbnail.name))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertTrue(KVStoreModel.objects.filter(key=source_key).exists())
+
+    def test_serve_binary_image_while_link_is_valid(self):
+        render_binary_image(self.image.pk)
+        self.image.refresh_from_db()
+        sample_binary_image_link(
+            user=self.user, image=self.image, exist_seconds=300
+        )
+
+        res = self.client.get(media_url(self.image.binary_image.name))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotIn("immutable", res["Cache-Control"])
+
+    def test_serve_binary_image_after_link_expired(self):
+        render_binary_image(self.image.pk)
+        self.image.refresh_from_db()
+        sample_binary_image_link(
+            user=self.user,
+            image=self.image,
+            exist_seconds=300,
+            date_created=timezone.now() - timedelta(seconds=301),
+        )
+
+        res = self.client.get(media_url(self.image.binary_image.name))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(MEDIA_PATH_LAYOUT="hashed")
+    def test_serve_hashed_layout(self):
+        image = sample_uploaded_image(self.user)
+        render_binary_image(image.pk)
+        image.refresh_from_db()
+        sample_binary_image_link(
+            user=self.user, image=image, exist_seconds=300
+        )
+        self.client.force_authenticate(user=self.user)
+
+        try:
+            for name in (image.image.name, image.binary_image.name):
+                self.assertTrue(name.startswith("uploads/"), name)
+                self.assertNotIn("/user/", name)
+                res = self.client.get(media_url(name))
+                self.assertEqual(res.status_code, status.HTTP_200_OK)
+        finally:
+            # uploads/<aa>/, the first fan-out level of the user's files.
+            fan_out = user_upload_dir(self.user).split("/")[:2]
+            shutil.rmtree(
+                default_storage.path("/".join(fan_out)), ignore_errors=True
+            )
+
+    def test_serve_media_outside_media_root(self):
+        self.client.force_authenticate(user=self.user)
+
+        res = self.client.get("/static/media/../../etc/passwd")
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
@@ -0,0 +1,184 @@
+import json
+import os
+import re
+import shutil
+import tempfile
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from core import metrics
+from core.authentication import create_token
+from .test_models import sample_tier, sample_user
+
+IMAGES_LIST_URL = reverse("core:images-list")
+METRICS_URL = reverse("metrics")
+
+
+def sample_value(text, name, **labels):
+    """
+    Returns the value of the sample ``name`` with ``labels`` in a scrape.
+    """
+    for line in text.splitlines():
+        match = re.fullmatch(r"(\w+)\{(.*)\} (\S+)", line)
+        if match is None or match.group(1) != name:
+            continue
+        found = dict(re.findall(r'(\w+)="([^"]*)"', match.group(2)))
+        if found == labels:
+            return float(match.group(3))
+    return None
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "core.cache.LocMemCache"}},
+    METRICS_TOKEN="secret",
+)
+class MetricsTests(TestCase):
+    def setUp(self):
+        metrics.registry = metrics.Registry()
+        self.user = sample_user(
+            email="testuser@email.com",
+            username="user",
+            password="testpassword",
+            tier=sample_tier(name="Basic"),
+        )
+        token = create_token(self.user)
+        self.headers = {"HTTP_AUTHORIZATION": f"Bearer {token}"}
+
+    def tearDown(self):
+        cache.clear()
+
+    def scrape(self):
+        res = self.client.get(METRICS_URL, HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res["Content-Type"].startswith("text/plain"))
+        return res.content.decode()
+
+    def test_request_metrics(self):
+        for _ in range(2):
+            self.client.get(IMAGES_LIST_URL, **self.headers)
+
+        text = self.scrape()
+        view = "core:images-list"
+
+        self.assertEqual(
+            sample_value(
+                text,
+                "http_requests_total",
+                view=view,
+                method="GET",
+                status="200",
+            ),
+            2,
+        )
+        self.assertEqual(
+            sample_value(
+                text, "http_request_duration_seconds_count", view=view
+            ),
+            2,
+        )
+        self.assertEqual(
+            sample_value(
+                text,
+                "http_request_duration_seconds_bucket",
+                view=view,
+                le="+Inf",
+            ),
+            2,
+        )
+        self.assertGreater(
+            sample_value(text, "db_queries_per_request_sum", view=view), 0
+        )
+        self.assertGreater(
+            sample_value(text, "http_response_size_bytes_sum", view=view), 0
+        )
+        # The first request misses the cached user, the second hits it.
+        self.assertGreaterEqual(
+            sample_value(text, "cache_hits_total", view=view), 1
+        )
+        self.assertGreaterEqual(
+            sample_value(text, "cache_misses_total", view=view), 1
+        )
+
+    def test_only_core_views_are_recorded(self):
+        self.scrape()
+
+        self.assertNotIn('view="metrics"', self.scrape())
+
+    def test_cache_calls_outside_requests_are_ignored(self):
+        cache.get("key")
+
+        self.assertNotIn("cache_misses_total{", self.scrape())
+
+    def test_metrics_token(self):
+        res = self.client.get(METRICS_URL)
+        self.assertEqual(res.status_code, 404)
+
+        res = self.client.get(METRICS_URL, HTTP_AUTHORIZATION="Bearer wrong")
+        self.assertEqual(res.status_code, 404)
+
+        res = self.client.get(METRICS_URL, HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(res.status_code, 200)
+
+    @override_settings(METRICS_TOKEN=None)
+    def test_metrics_without_token_only_in_debug(self):
+        res = self.client.get(METRICS_URL)
+        self.assertEqual(res.status_code, 404)
+
+        with override_settings(DEBUG=True):
+            res = self.client.get(METRICS_URL)
+        self.assertEqual(res.status_code, 200)
+
+    def test_metrics_aggregated_across_processes(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        with override_settings(METRICS_DIR=directory):
+            self.client.get(IMAGES_LIST_URL, **self.headers)
+            other = metrics.Registry()
+            labels = (
+                ("view", "core:images-list"),
+                ("method", "GET"),
+                ("status", "200"),
+            )
+            other.inc("http_requests_total", labels, 3)
+            with open(os.path.join(directory, "0.json"), "w") as dump:
+                json.dump(other.dump(), dump)
+
+            text = self.scrape()
+
+        self.assertEqual(
+            sample_value(
+                text,
+                "http_requests_total",
+                view="core:images-list",
+                method="GET",
+                status="200",
+            ),
+            4,
+        )
+
+    def test_dead_process_folded_into_archive(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        labels = (("view", "core:images-list"),)
+
+        with override_settings(METRICS_DIR=directory):
+            for count in (2, 3):
+                other = metrics.Registry()
+                other.inc("cache_hits_total", labels, count)
+                with open(os.path.join(directory, "1.json"), "w") as dump:
+                    json.dump(other.dump(), dump)
+                metrics.mark_process_dead(1)
+            metrics.mark_process_dead(2)
+
+            text = self.scrape()
+
+        self.assertEqual(
+            {name for name in os.listdir(directory) if name != ".lock"},
+            {"archive.json", f"{os.getpid()}.json"},
+        )
+        self.assertEqual(
+            sample_value(text, "cache_hits_total", view="core:images-list"), 5
+        )
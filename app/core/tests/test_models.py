@@ -1,17 +1,23 @@
 import os
 import tempfile
+import threading
 import shutil
+import time
+
+from io import BytesIO
 
 from PIL import Image as pillow_image
 
+from unittest import skipUnless
 from unittest.mock import patch
 
-from django.test import TestCase
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 from django.core.files.uploadedfile import InMemoryUploadedFile
 
-from core import models
+from core import models, tiers
 
 
 def sample_user(**params):
@@ -23,6 +29,9 @@ def sample_thumbnail(**params):
 
 
 def sample_tier(**params):
+    # Tier changes reload the cached configurations on commit, which never
+    # comes in a TestCase, so drop those of earlier tests here.
+    tiers.clear_tiers()
     return models.Tier.objects.create(**params)
 
 
@@ -34,6 +43,22 @@ def sample_image(**params):
     return models.Image.objects.create(**params)
 
 
+def sample_image_file(size=(1, 1)):
+    with tempfile.NamedTemporaryFile(suffix=".png") as image_file:
+        img = pillow_image.new("RGB", size)
+        img.save(image_file, "png")
+        image_file.seek(0)
+
+        return InMemoryUploadedFile(
+            BytesIO(image_file.read()),
+            "image",
+            "image.png",
+            "png",
+            image_file.tell(),
+            None,
+        )
+
+
 class ModelTests(TestCase):
     def tearDown(self):
         path = "/vol/web/media/uploads/user"
@@ -167,3 +192,122 @@ class ModelTests(TestCase):
         self.assertTrue(image.image)
         self.assertTrue(os.path.exists(image.image.path))
         self.assertTrue(image.user, user)
+
+    def test_user_images_file_path_with_content_hash(self):
+        user = sample_user(username="user", password="testpassword")
+        image = models.Image(user=user, content_hash="abc123")
+        file_path = models.user_images_file_path(image, "test.JPG")
+
+        self.assertEqual(file_path, f"uploads/{user.username}/abc123.jpg")
+
+    @override_settings(MEDIA_PATH_LAYOUT="hashed")
+    def test_hashed_file_paths(self):
+        user = sample_user(username="user", password="testpassword")
+        image = models.Image(user=user, content_hash="abc123")
+        binary = models.BinaryImageLink(user=user)
+        directory = models.user_upload_dir(user)
+
+        with patch("core.models.uuid4", return_value="testing-uuid"):
+            binary_path = models.user_binary_images_file_path(binary, "a.png")
+
+        self.assertRegex(
+            directory, rf"^uploads/[0-9a-f]{{2}}/[0-9a-f]{{2}}/{user.pk}$"
+        )
+        self.assertEqual(
+            models.user_images_file_path(image, "test.JPG"),
+            f"{directory}/ab/abc123.jpg",
+        )
+        self.assertEqual(
+            binary_path, f"{directory}/binary/te/testing-uuid.png"
+        )
+        self.assertEqual(
+            models.user_upload_dir(user, "username"), "uploads/user"
+        )
+
+    def test_upload_owner(self):
+        self.assertEqual(
+            models.upload_owner("uploads/user/binary/a.png"),
+            {"user__username": "user"},
+        )
+        self.assertEqual(
+            models.upload_owner("uploads/ab/cd/7/binary/a1/a1.png"),
+            {"user_id": 7},
+        )
+        self.assertIsNone(models.upload_owner("cache/ab/cd/a.jpg"))
+
+    def test_identical_images_share_file(self):
+        user = sample_user(username="user", password="testpassword")
+        image1 = sample_image(user=user, image=sample_image_file())
+        image2 = sample_image(user=user, image=sample_image_file())
+        other = sample_image(user=user, image=sample_image_file((2, 2)))
+
+        self.assertEqual(len(image1.content_hash), 64)
+        self.assertEqual(image1.image.name, image2.image.name)
+        self.assertNotEqual(image1.image.name, other.image.name)
+        directory = os.path.dirname(image1.image.path)
+        self.assertEqual(len(os.listdir(directory)), 2)
+
+    def test_shared_file_deleted_with_last_image(self):
+        user = sample_user(username="user", password="testpassword")
+        image1 = sample_image(user=user, image=sample_image_file())
+        image2 = sample_image(user=user, image=sample_image_file())
+        path = image1.image.path
+
+        with self.captureOnCommitCallbacks(execute=True):
+            image1.delete()
+        self.assertTrue(os.path.exists(path))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            image2.delete()
+        self.assertFalse(os.path.exists(path))
+
+    def test_shared_file_kept_for_upload_during_deletion(self):
+        user = sample_user(username="user", password="testpassword")
+        image1 = sample_image(user=user, image=sample_image_file())
+        path = image1.image.path
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            image1.delete()
+            # An upload deduplicated against image1 before it was deleted.
+            sample_image(
+                user=user,
+                image=image1.image.name,
+                content_hash=image1.content_hash,
+            )
+        for callback in callbacks:
+            callback()
+
+        self.assertTrue(os.path.exists(path))
+
+
+@skipUnless(
+    connection.vendor == "postgresql",
+    "SQLite does not lock rows for select_for_update.",
+)
+class DeduplicationConcurrencyTests(TransactionTestCase):
+    def tearDown(self):
+        path = "/vol/web/media/uploads/user"
+        if os.path.exists(path):
+            shutil.rmtree(path)
+
+    def test_upload_waits_for_deletion_of_shared_file(self):
+        user = sample_user(username="user", password="testpassword")
+        image1 = sample_image(user=user, image=sample_image_file())
+        deleted = threading.Event()
+
+        def delete():
+            try:
+                with transaction.atomic():
+                    models.Image.objects.get(pk=image1.pk).delete()
+                    deleted.set()
+                    time.sleep(0.5)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=delete)
+        thread.start()
+        deleted.wait()
+        image2 = sample_image(user=user, image=sample_image_file())
+        thread.join()
+
+        self.assertTrue(os.path.exists(image2.image.path))
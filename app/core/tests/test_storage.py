@@ -0,0 +1,185 @@
+import os
+import pickle
+import shutil
+
+from datetime import datetime, timezone as dt_timezone
+from unittest.mock import PropertyMock, patch
+
+from botocore.stub import Stubber
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from django.core.files.base import ContentFile
+from django.test import SimpleTestCase
+from django.urls import reverse
+
+from core.binary_images import render_binary_image
+from core.storage import MediaStorage
+from .test_images_api import sample_uploaded_image
+from .test_models import (
+    sample_binary_image_link,
+    sample_thumbnail,
+    sample_tier,
+    sample_user,
+)
+
+PRESIGNED_PREFIX = "http://localhost:9000/media/"
+OBJECT_STORAGE = "core.storage.MediaStorage"
+
+
+class MediaStorageTests(SimpleTestCase):
+    def test_multipart_transfer_config(self):
+        config = MediaStorage().transfer_config
+
+        self.assertEqual(config.multipart_threshold, 8 * 1024 * 1024)
+        self.assertEqual(config.multipart_chunksize, 8 * 1024 * 1024)
+        self.assertEqual(config.max_concurrency, 8)
+        self.assertTrue(config.use_threads)
+
+    def test_presigned_url(self):
+        url = MediaStorage().url("uploads/user/a.png", expire=60)
+
+        self.assertTrue(
+            url.startswith(f"{PRESIGNED_PREFIX}uploads/user/a.png?")
+        )
+        self.assertIn("X-Amz-Expires=60", url)
+        self.assertIn("X-Amz-Signature=", url)
+
+    def test_instances_share_clients(self):
+        storage = MediaStorage()
+        copy = pickle.loads(pickle.dumps(storage))
+
+        self.assertIs(MediaStorage().connection, storage.connection)
+        self.assertIs(copy.connection, storage.connection)
+        self.assertIsNot(
+            MediaStorage(location="other").connection, storage.connection
+        )
+
+    @patch.object(MediaStorage, "bucket", new_callable=PropertyMock)
+    def test_save_uses_multipart_transfer(self, patched_bucket):
+        storage = MediaStorage()
+
+        storage.save("uploads/user/a.png", ContentFile(b"data"))
+
+        patched_bucket.return_value.Object.assert_called_with(
+            "uploads/user/a.png"
+        )
+        upload = patched_bucket.return_value.Object.return_value
+        self.assertIs(
+            upload.upload_fileobj.call_args.kwargs["Config"],
+            storage.transfer_config,
+        )
+
+    @patch.object(MediaStorage, "bucket", new_callable=PropertyMock)
+    def test_copy_inside_the_store(self, patched_bucket):
+        storage = MediaStorage()
+
+        storage.copy("uploads/user/a.png", "uploads/ab/cd/1/a1/a.png")
+
+        patched_bucket.return_value.copy.assert_called_once_with(
+            {"Bucket": "media", "Key": "uploads/user/a.png"},
+            "uploads/ab/cd/1/a1/a.png",
+            Config=storage.transfer_config,
+        )
+
+    def test_list_files(self):
+        storage = MediaStorage()
+        modified = datetime(2022, 10, 1, tzinfo=dt_timezone.utc)
+        with Stubber(storage.connection.meta.client) as stubber:
+            stubber.add_response(
+                "list_objects_v2",
+                {
+                    "Contents": [
+                        {
+                            "Key": "uploads/user/a.png",
+                            "Size": 10,
+                            "LastModified": modified,
+                        },
+                        {
+                            "Key": "uploads/user/b.png",
+                            "Size": 20,
+                            "LastModified": modified,
+                        },
+                    ],
+                    "IsTruncated": False,
+                },
+                {"Bucket": "media", "Prefix": "uploads/"},
+            )
+
+            files = list(storage.list_files("uploads"))
+
+        self.assertEqual(
+            files,
+            [
+                ("uploads/user/a.png", 10, modified.timestamp()),
+                ("uploads/user/b.png", 20, modified.timestamp()),
+            ],
+        )
+
+
+class ObjectStorageMediaTests(APITestCase):
+    """
+    Files are written to local storage before switching to object storage,
+    which is never contacted: URLs are presigned offline.
+    """
+
+    def setUp(self):
+        tier = sample_tier(name="Premium", can_create_link=True)
+        tier.thumbnails.add(sample_thumbnail(value=100))
+        self.user = sample_user(
+            email="testuser@email.com",
+            username="user",
+            password="testpassword",
+            tier=tier,
+        )
+        self.image = sample_uploaded_image(self.user)
+        self.client.force_authenticate(user=self.user)
+
+    def tearDown(self):
+        paths = ("/vol/web/media/uploads/user", "/vol/web/media/cache")
+        for path in paths:
+            if os.path.exists(path):
+                shutil.rmtree(path)
+
+    def test_image_list_is_presigned(self):
+        with self.settings(DEFAULT_FILE_STORAGE=OBJECT_STORAGE):
+            res = self.client.get(reverse("core:images-list"))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        url = res.data["results"][0]["image"]
+        self.assertTrue(
+            url.startswith(PRESIGNED_PREFIX + self.image.image.name)
+        )
+        self.assertIn("X-Amz-Expires=3600", url)
+
+    def test_binary_link_is_presigned_for_its_lifetime(self):
+        render_binary_image(self.image.pk)
+        self.image.refresh_from_db()
+        link = sample_binary_image_link(
+            user=self.user, image=self.image, exist_seconds=300
+        )
+
+        with self.settings(DEFAULT_FILE_STORAGE=OBJECT_STORAGE):
+            res = self.client.get(
+                reverse("core:get-binary-link", args=[link.id])
+            )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        url = res.data["image"]
+        self.assertTrue(
+            url.startswith(PRESIGNED_PREFIX + self.image.binary_image.name)
+        )
+        self.assertRegex(url, r"X-Amz-Expires=(299|300)&")
+
+    def test_media_view_redirects_to_presigned_url(self):
+        with self.settings(DEFAULT_FILE_STORAGE=OBJECT_STORAGE):
+            res = self.client.get(
+                reverse("media", args=[self.image.image.name])
+            )
+
+        self.assertEqual(res.status_code, status.HTTP_302_FOUND)
+        self.assertTrue(
+            res["Location"].startswith(
+                PRESIGNED_PREFIX + self.image.image.name
+            )
+        )
@@ -0,0 +1,169 @@
+import json
+
+from io import BytesIO
+
+from PIL import Image as pillow_image
+
+from django.test import SimpleTestCase, override_settings
+
+from sorl.thumbnail import default
+from sorl.thumbnail.engines.pil_engine import Engine as PILEngine
+from sorl.thumbnail.parsers import parse_geometry
+
+from core import metrics
+from core.instrumentation import size_class
+from core.thumbnail_engine import Engine
+
+
+def sample_pillow_image(fmt, size=(800, 600)):
+    buffer = BytesIO()
+    pillow_image.new("RGB", size, "red").save(buffer, fmt)
+    buffer.seek(0)
+    return pillow_image.open(buffer)
+
+
+class EngineTests(SimpleTestCase):
+    def setUp(self):
+        self.engine = Engine()
+        self.options = dict(default.backend.default_options, crop="center")
+
+    def create(self, image, geometry_string, engine=None):
+        engine = engine or self.engine
+        ratio = engine.get_image_ratio(image, self.options)
+        geometry = parse_geometry(geometry_string, ratio)
+        return engine.create(image, geometry, self.options)
+
+    def test_jpeg_is_decoded_at_reduced_scale(self):
+        image = sample_pillow_image("JPEG")
+
+        thumbnail = self.create(image, "x100")
+
+        self.assertEqual(thumbnail.size, (133, 100))
+        self.assertEqual(image.size, (200, 150))
+
+    def test_draft_never_goes_below_requested_size(self):
+        image = sample_pillow_image("JPEG")
+
+        thumbnail = self.create(image, "x400")
+
+        self.assertEqual(thumbnail.size, (533, 400))
+        self.assertEqual(image.size, (800, 600))
+
+    def test_png_matches_pil_engine(self):
+        image = sample_pillow_image("PNG")
+
+        thumbnail = self.create(image, "x100")
+        expected = self.create(
+            sample_pillow_image("PNG"), "x100", engine=PILEngine()
+        )
+
+        self.assertEqual(thumbnail.size, expected.size)
+        self.assertEqual(image.size, (800, 600))
+
+
+class MemoryThumbnail:
+    def __init__(self):
+        self.data = None
+
+    def write(self, data):
+        self.data = data
+
+
+class InstrumentationTests(SimpleTestCase):
+    def setUp(self):
+        metrics.registry = metrics.Registry()
+        self.engine = Engine()
+        self.options = dict(
+            default.backend.default_options,
+            crop="center",
+            image_tags={
+                "format": "JPEG",
+                "width": 800,
+                "height": 600,
+                "geometry": "x100",
+            },
+        )
+
+    def create_and_write(self):
+        image = sample_pillow_image("JPEG")
+        ratio = self.engine.get_image_ratio(image, self.options)
+        geometry = parse_geometry("x100", ratio)
+        thumbnail = self.engine.create(image, geometry, self.options)
+        stored = MemoryThumbnail()
+        self.engine.write(thumbnail, self.options, stored)
+        return stored
+
+    def test_every_operation_is_measured(self):
+        stored = self.create_and_write()
+
+        histograms = metrics.registry.histograms
+        for operation in ("decode", "resize", "encode", "storage_write"):
+            labels = (
+                ("operation", operation),
+                ("format", "JPEG"),
+                ("source", "<1MP"),
+                ("geometry", "x100"),
+            )
+            duration = histograms[
+                ("image_operation_duration_seconds", labels)
+            ]
+            self.assertEqual(sum(duration[:-1]), 1)
+            metric = (
+                "image_pixel_buffer_estimated_bytes"
+                if operation in ("decode", "resize")
+                else "image_operation_data_bytes"
+            )
+            self.assertIn((metric, labels), histograms)
+
+        # The draft decodes the JPEG at a quarter of its size.
+        decoded = histograms[
+            (
+                "image_pixel_buffer_estimated_bytes",
+                (
+                    ("operation", "decode"),
+                    ("format", "JPEG"),
+                    ("source", "<1MP"),
+                    ("geometry", "x100"),
+                ),
+            )
+        ]
+        self.assertEqual(decoded[-1], 200 * 150 * 3)
+        written = histograms[
+            (
+                "image_operation_data_bytes",
+                (
+                    ("operation", "storage_write"),
+                    ("format", "JPEG"),
+                    ("source", "<1MP"),
+                    ("geometry", "x100"),
+                ),
+            )
+        ]
+        self.assertEqual(written[-1], len(stored.data))
+
+    def test_no_logs_by_default(self):
+        with self.assertNoLogs("core.instrumentation"):
+            self.create_and_write()
+
+    @override_settings(IMAGE_OPERATION_LOGS=True)
+    def test_structured_logs(self):
+        with self.assertLogs("core.instrumentation") as logs:
+            self.create_and_write()
+
+        records = [json.loads(record.getMessage()) for record in logs.records]
+        self.assertEqual(
+            [record["operation"] for record in records],
+            ["decode", "resize", "encode", "storage_write"],
+        )
+        self.assertEqual(
+            {key: records[0][key] for key in ("width", "height", "geometry")},
+            {"width": 800, "height": 600, "geometry": "x100"},
+        )
+        self.assertEqual(records[1]["buffer_estimate_bytes"], 133 * 100 * 3)
+        self.assertIsNone(records[1]["data_bytes"])
+        self.assertGreater(records[3]["data_bytes"], 0)
+
+    def test_size_class(self):
+        self.assertEqual(size_class(800, 600), "<1MP")
+        self.assertEqual(size_class(4000, 3000), "12-24MP")
+        self.assertEqual(size_class(8000, 6000), ">24MP")
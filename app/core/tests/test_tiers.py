@@ -0,0 +1,111 @@
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.db import DatabaseError, transaction
+from django.test import TestCase, override_settings
+
+from core import tiers
+from .test_models import sample_thumbnail, sample_tier
+
+
+@override_settings(
+    CACHES={
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache"
+        }
+    }
+)
+class TierConfigTests(TestCase):
+    def setUp(self):
+        self.thumbnail1 = sample_thumbnail(value=300)
+        self.thumbnail2 = sample_thumbnail(value=100)
+        self.tier = sample_tier(name="Premium", can_create_link=True)
+        self.tier.thumbnails.set((self.thumbnail1, self.thumbnail2))
+
+    def tearDown(self):
+        cache.clear()
+        tiers.clear_tiers()
+
+    def test_get_tier(self):
+        tier = tiers.get_tier(self.tier.id)
+
+        self.assertEqual(
+            tier,
+            tiers.TierConfig(self.tier.id, "Premium", (100, 300), True),
+        )
+        self.assertIsNone(tiers.get_tier(None))
+        self.assertIsNone(tiers.get_tier(self.tier.id + 1))
+
+    def test_get_tier_is_cached(self):
+        tiers.get_tier(self.tier.id)
+
+        with self.assertNumQueries(0):
+            tiers.get_tier(self.tier.id)
+
+    def test_tier_change_invalidates(self):
+        tiers.get_tier(self.tier.id)
+
+        self.tier.can_create_link = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tier.save()
+        self.assertFalse(tiers.get_tier(self.tier.id).can_create_link)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tier.thumbnails.remove(self.thumbnail1)
+        self.assertEqual(tiers.get_tier(self.tier.id).heights, (100,))
+
+        self.thumbnail2.value = 200
+        with self.captureOnCommitCallbacks(execute=True):
+            self.thumbnail2.save()
+        self.assertEqual(tiers.get_tier(self.tier.id).heights, (200,))
+
+    def test_rolled_back_change_is_not_cached(self):
+        tiers.get_tier(self.tier.id)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            with self.assertRaises(DatabaseError):
+                with transaction.atomic():
+                    self.tier.can_create_link = False
+                    self.tier.save()
+                    # Still the committed configuration.
+                    self.assertTrue(
+                        tiers.get_tier(self.tier.id).can_create_link
+                    )
+                    raise DatabaseError
+
+        self.assertEqual(callbacks, [])
+        self.assertTrue(tiers.get_tier(self.tier.id).can_create_link)
+
+    def test_tier_change_bumps_version_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tier.save()
+        version = cache.get(tiers.TIERS_VERSION_KEY)
+
+        self.assertIsNotNone(version)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tier.thumbnails.remove(self.thumbnail1)
+        self.assertNotEqual(cache.get(tiers.TIERS_VERSION_KEY), version)
+
+    @patch("core.tiers.time.monotonic")
+    def test_version_change_reloads(self, patched_monotonic):
+        patched_monotonic.return_value = 1000.0
+        tiers.get_tier(self.tier.id)
+
+        # Another process commits a change.
+        cache.set(tiers.TIERS_VERSION_KEY, "other")
+
+        with self.assertNumQueries(0):
+            tiers.get_tier(self.tier.id)
+
+        patched_monotonic.return_value += 1
+        with self.assertNumQueries(2):
+            tiers.get_tier(self.tier.id)
+
+    @patch("core.tiers.cache")
+    def test_version_read_once_per_interval(self, patched_cache):
+        patched_cache.get.return_value = None
+        with patch("core.tiers.time.monotonic", return_value=1000.0):
+            for _ in range(3):
+                tiers.get_tier(self.tier.id)
+
+        patched_cache.get.assert_called_once_with(tiers.TIERS_VERSION_KEY)
@@ -0,0 +1,80 @@
+from io import BytesIO
+
+from PIL import Image as pillow_image
+
+from django.core.files.uploadhandler import SkipFile, StopUpload
+from django.test import SimpleTestCase, RequestFactory, override_settings
+
+from core.uploadhandlers import ImageUploadHandler
+
+
+def image_bytes(size=(200, 200), fmt="png"):
+    buffer = BytesIO()
+    pillow_image.new("RGB", size).save(buffer, fmt)
+    return buffer.getvalue()
+
+
+class ImageUploadHandlerTests(SimpleTestCase):
+    def setUp(self):
+        self.request = RequestFactory().post("/")
+        self.handler = ImageUploadHandler(self.request)
+
+    def upload(self, data, chunk_size=64):
+        self.handler.new_file("image", "image.png", "image/png", None)
+        for start in range(0, len(data), chunk_size):
+            self.handler.receive_data_chunk(
+                data[start:start + chunk_size], start
+            )
+        return self.handler.file_complete(len(data))
+
+    def test_sniffs_format_and_size(self):
+        uploaded = self.upload(image_bytes(size=(30, 20), fmt="jpeg"))
+
+        self.assertEqual(uploaded.image_format, "JPEG")
+        self.assertEqual(uploaded.image_size, (30, 20))
+        self.assertEqual(self.request.rejected_uploads, [])
+        uploaded.close()
+
+    def test_header_sniffed_from_first_chunks(self):
+        data = image_bytes()
+        self.handler.new_file("image", "image.png", "image/png", None)
+        self.handler.receive_data_chunk(data[:64], 0)
+
+        self.assertEqual(self.handler.image_format, "PNG")
+        self.handler.file.close()
+
+    @override_settings(IMAGE_HEADER_MAX_BYTES=128)
+    def test_rejects_garbage_before_body_is_received(self):
+        data = b"x" * 1024
+        self.handler.new_file("image", "image.png", "image/png", None)
+
+        with self.assertRaises(SkipFile):
+            for start in range(0, len(data), 64):
+                self.handler.receive_data_chunk(
+                    data[start:start + 64], start
+                )
+
+        self.assertLess(self.handler.received, len(data))
+        self.assertEqual(len(self.request.rejected_uploads), 1)
+
+    @override_settings(IMAGE_UPLOAD_MAX_BYTES=100)
+    def test_rejects_oversized_file(self):
+        with self.assertRaises(SkipFile):
+            self.upload(image_bytes())
+
+        self.assertEqual(self.handler.received, 128)
+
+    def test_rejects_unsupported_format(self):
+        self.assertIsNone(self.upload(image_bytes(fmt="gif")))
+        self.assertEqual(len(self.request.rejected_uploads), 1)
+
+    @override_settings(IMAGE_BATCH_UPLOAD_MAX_FILES=1)
+    def test_stops_after_max_files(self):
+        self.upload(image_bytes()).close()
+        self.assertFalse(self.request.too_many_uploads)
+
+        with self.assertRaises(StopUpload):
+            self.handler.new_file("image", "image.png", "image/png", None)
+
+        self.assertTrue(self.request.too_many_uploads)
+        self.handler.file.close()
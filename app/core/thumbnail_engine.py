@@ -0,0 +1,77 @@
+from math import ceil
+
+from sorl.thumbnail.conf import settings
+from sorl.thumbnail.engines.pil_engine import ANTIALIAS
+from sorl.thumbnail.engines.pil_engine import Engine as PILEngine
+
+from .instrumentation import image_tags, measure, pixel_buffer_estimate
+
+
+class Engine(PILEngine):
+    """
+    PIL engine that decodes only as much of the source as the requested
+    geometry needs: JPEGs are DCT-scaled with ``draft()`` while decoding
+    and every resize first reduces by an integer factor (``reducing_gap``).
+
+    Decoding, resizing, encoding and the storage write are measured
+    separately, see ``core.instrumentation``.
+    """
+
+    reducing_gap = 3.0
+
+    def create(self, image, geometry, options):
+        tags = options.get("image_tags") or image_tags(image)
+        self.draft(image, geometry, options)
+
+        with measure("decode", tags) as measurement:
+            image.load()
+            measurement.buffer_estimate = pixel_buffer_estimate(image)
+
+        with measure("resize", tags) as measurement:
+            thumbnail = super().create(image, geometry, options)
+            measurement.buffer_estimate = pixel_buffer_estimate(thumbnail)
+        return thumbnail
+
+    def write(self, image, options, thumbnail):
+        tags = options.get("image_tags") or image_tags(image)
+
+        with measure("encode", tags) as measurement:
+            raw_data = self._get_raw_data(
+                image,
+                options["format"],
+                options["quality"],
+                image_info=options.get("image_info", {}),
+                progressive=options.get(
+                    "progressive", settings.THUMBNAIL_PROGRESSIVE
+                ),
+            )
+            measurement.data_bytes = len(raw_data)
+
+        with measure("storage_write", tags) as measurement:
+            thumbnail.write(raw_data)
+            measurement.data_bytes = len(raw_data)
+
+    def draft(self, image, geometry, options):
+        if image.format != "JPEG" or options.get("cropbox"):
+            return
+
+        x_image, y_image = map(float, self.get_image_size(image))
+        if self.flip_dimensions(image):
+            x_image, y_image = y_image, x_image
+        factor = self._calculate_scaling_factor(
+            x_image, y_image, geometry, options
+        )
+
+        if factor < 1:
+            # draft() never goes below the requested size.
+            x_image, y_image = self.get_image_size(image)
+            image.draft(
+                image.mode, (ceil(x_image * factor), ceil(y_image * factor))
+            )
+
+    def _scale(self, image, width, height):
+        return image.resize(
+            (width, height),
+            resample=ANTIALIAS,
+            reducing_gap=self.reducing_gap,
+        )
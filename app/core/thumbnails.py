@@ -0,0 +1,411 @@
+from asgiref.sync import sync_to_async
+
+from django.core.cache import cache
+
+from sorl.thumbnail import default
+from sorl.thumbnail.base import ThumbnailBackend as BaseThumbnailBackend
+from sorl.thumbnail.conf import settings, defaults as default_settings
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix, del_prefix
+from sorl.thumbnail.kvstores.cached_db_kvstore import (
+    EMPTY_VALUE,
+    KVStore as CachedDBKVStore,
+)
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+import core.models
+
+from .instrumentation import image_tags
+from .media import link_media
+from .tasks import enqueue
+from .tiers import get_tier
+
+THUMBNAIL_OPTIONS = {"crop": "center", "quality": 99}
+
+# Modern formats generated alongside the legacy JPEG, by media type.
+THUMBNAIL_VARIANTS = {
+    "image/webp": {"format": "WEBP", "quality": 80},
+}
+
+
+def thumbnail_geometry(height):
+    return f"x{height}"
+
+
+def thumbnail_options(variant=None):
+    options = dict(THUMBNAIL_OPTIONS)
+    options.update(THUMBNAIL_VARIANTS.get(variant, {}))
+    return options
+
+
+def media_range_quality(params):
+    """
+    Returns the ``q`` weight among a media range's parameters, 1 when it
+    has none. A malformed weight refuses the range.
+    """
+    for param in params:
+        name, _, value = param.partition("=")
+        if name.strip().lower() == "q":
+            try:
+                return float(value.strip())
+            except ValueError:
+                return 0.0
+    return 1.0
+
+
+def negotiate_variant(request):
+    """
+    Returns the first variant media type the request's ``Accept`` header
+    lists with a weight above 0, or None for the legacy format.
+    """
+    accepted = set()
+    for media_range in request.META.get("HTTP_ACCEPT", "").split(","):
+        media_type, *params = media_range.split(";")
+        if media_range_quality(params) > 0:
+            accepted.add(media_type.strip().lower())
+    for variant in THUMBNAIL_VARIANTS:
+        if variant in accepted:
+            return variant
+    return None
+
+
+def cache_misses(cache, keys):
+    """
+    Remembers kvstore keys missing from the database for
+    ``THUMBNAIL_MISS_CACHE_TIMEOUT`` seconds only. Keys stored meanwhile,
+    such as a thumbnail generated while it was looked up, are kept.
+    """
+    for key in keys:
+        cache.add(key, EMPTY_VALUE, settings.THUMBNAIL_MISS_CACHE_TIMEOUT)
+
+
+class KVStore(CachedDBKVStore):
+    """
+    Cached db kvstore that does not remember missing keys for as long as
+    stored ones, so thumbnails generated after a lookup show up. It also
+    records the source of every thumbnail, under the ``source`` identity.
+    """
+
+    def set(self, image_file, source=None):
+        super().set(image_file, source)
+        if source is not None:
+            self._set(image_file.key, source.name, identity="source")
+
+    def get_source_name(self, thumbnail):
+        """
+        Returns the name of the source ``thumbnail`` was generated from, or
+        None when ``thumbnail`` is not stored.
+        """
+        name = self._get(thumbnail.key, identity="source")
+        if name is not None or self.get(thumbnail) is None:
+            return name
+
+        # Thumbnails stored before sources were recorded are only on their
+        # source's thumbnail list. Look the list up once and record it.
+        row = KVStoreModel.objects.filter(
+            key__startswith=add_prefix("", identity="thumbnails"),
+            value__contains=f'"{thumbnail.key}"',
+        ).first()
+        source = None if row is None else self._get(del_prefix(row.key))
+        if source is None:
+            return None
+        self._set(thumbnail.key, source.name, identity="source")
+        return source.name
+
+    def _delete(self, key, identity="image"):
+        keys = [add_prefix(key, identity)]
+        if identity == "image":
+            keys.append(add_prefix(key, identity="source"))
+        self._delete_raw(*keys)
+
+    def _get_raw(self, key):
+        value = self.cache.get(key)
+        if value is None:
+            try:
+                value = KVStoreModel.objects.get(key=key).value
+            except KVStoreModel.DoesNotExist:
+                cache_misses(self.cache, [key])
+                return None
+            self.cache.set(key, value, settings.THUMBNAIL_CACHE_TIMEOUT)
+        if value == EMPTY_VALUE:
+            return None
+        return value
+
+
+class ThumbnailBackend(BaseThumbnailBackend):
+    """
+    sorl backend that can look a thumbnail up without generating it.
+    """
+
+    def get_thumbnail_file(self, file_, geometry_string, **options):
+        """
+        Returns the ``ImageFile`` the thumbnail would be stored as, with
+        options normalized exactly like ``get_thumbnail`` does.
+        """
+        source = ImageFile(file_)
+
+        if settings.THUMBNAIL_PRESERVE_FORMAT:
+            options.setdefault("format", self._get_format(source))
+
+        for key, value in self.default_options.items():
+            options.setdefault(key, value)
+
+        for key, attr in self.extra_options:
+            value = getattr(settings, attr)
+            if value != getattr(default_settings, attr):
+                options.setdefault(key, value)
+
+        name = self._get_thumbnail_filename(source, geometry_string, options)
+        return ImageFile(name, default.storage)
+
+    def _create_thumbnail(
+        self, source_image, geometry_string, options, thumbnail
+    ):
+        # The engine only sees the parsed geometry and a source it may
+        # draft, so describe the source for the instrumentation up front.
+        options = dict(
+            options, image_tags=image_tags(source_image, geometry_string)
+        )
+        super()._create_thumbnail(
+            source_image, geometry_string, options, thumbnail
+        )
+
+    def get_cached_thumbnail(self, file_, geometry_string, **options):
+        """
+        Returns the thumbnail if it has already been generated, else None.
+        """
+        thumbnail = self.get_thumbnail_file(file_, geometry_string, **options)
+        return default.kvstore.get(thumbnail)
+
+    def get_cached_thumbnails(self, lookups):
+        """
+        Batched ``get_cached_thumbnail`` for ``(file_, geometry_string,
+        options)`` triples. Returns a list in the same order.
+
+        With the cached db kvstore all keys are fetched with a single
+        ``get_many`` (MGET on Redis) and only the cache misses fall back to
+        a single database query.
+        """
+        kvstore = default.kvstore
+        if not isinstance(kvstore, CachedDBKVStore):
+            return [
+                kvstore.get(thumbnail)
+                for thumbnail in self.get_thumbnail_files(lookups)
+            ]
+
+        keys = self.get_thumbnail_keys(lookups)
+        values = kvstore.cache.get_many(keys)
+        values.update(self.load_thumbnail_values(set(keys) - set(values)))
+        return self.deserialize_thumbnails(keys, values)
+
+    async def aget_cached_thumbnails(self, lookups):
+        """
+        ``get_cached_thumbnails`` for async views. Cache reads are awaited
+        and only the database fallback runs in a worker thread.
+        """
+        kvstore = default.kvstore
+        if not isinstance(kvstore, CachedDBKVStore):
+            return await sync_to_async(self.get_cached_thumbnails)(lookups)
+
+        keys = self.get_thumbnail_keys(lookups)
+        values = await kvstore.cache.aget_many(keys)
+        missing = set(keys) - set(values)
+        if missing:
+            values.update(
+                await sync_to_async(self.load_thumbnail_values)(missing)
+            )
+        return self.deserialize_thumbnails(keys, values)
+
+    def get_thumbnail_files(self, lookups):
+        return [
+            self.get_thumbnail_file(file_, geometry_string, **options)
+            for file_, geometry_string, options in lookups
+        ]
+
+    def get_thumbnail_keys(self, lookups):
+        return [
+            add_prefix(thumbnail.key)
+            for thumbnail in self.get_thumbnail_files(lookups)
+        ]
+
+    def load_thumbnail_values(self, keys):
+        """
+        Reads kvstore keys missing from the cache with one query and caches
+        them. Misses are only cached briefly, see ``cache_misses``.
+        """
+        if not keys:
+            return {}
+
+        stored = dict(
+            KVStoreModel.objects.filter(key__in=keys).values_list(
+                "key", "value"
+            )
+        )
+        cache = default.kvstore.cache
+        cache.set_many(stored, settings.THUMBNAIL_CACHE_TIMEOUT)
+        cache_misses(cache, set(keys) - set(stored))
+        return {key: stored.get(key, EMPTY_VALUE) for key in keys}
+
+    def delete_thumbnails(self, thumbnails):
+        """
+        Deletes some thumbnails of their sources, given as ``(file_,
+        thumbnail)`` pairs: the files, their kvstore entries and their keys
+        in the sources' thumbnail lists. ``delete`` can only remove all of
+        them.
+        """
+        kvstore = default.kvstore
+        dropped = {}
+        for file_, thumbnail in thumbnails:
+            kvstore.delete(thumbnail, delete_thumbnails=False)
+            thumbnail.delete()
+            source = ImageFile(file_)
+            dropped.setdefault(source.key, set()).add(thumbnail.key)
+
+        for key, thumbnail_keys in dropped.items():
+            listed = kvstore._get(key, identity="thumbnails") or []
+            remaining = [
+                thumbnail_key
+                for thumbnail_key in listed
+                if thumbnail_key not in thumbnail_keys
+            ]
+            if remaining:
+                kvstore._set(key, remaining, identity="thumbnails")
+            else:
+                kvstore._delete(key, identity="thumbnails")
+
+    def link_thumbnails(self, sources, variants):
+        """
+        Carries the thumbnails of moved sources, given as ``{name:
+        new_name}``, over to the new names for every ``(geometry_string,
+        options)`` of ``variants``. Thumbnail files are linked rather than
+        generated again. Returns how many thumbnails were carried over.
+        """
+        kvstore = default.kvstore
+        items = [
+            (name, new_name, geometry_string, options)
+            for name, new_name in sources.items()
+            for geometry_string, options in variants
+        ]
+        thumbnails = self.get_cached_thumbnails(
+            [(name, geometry, options) for name, _, geometry, options in items]
+        )
+
+        moved, linked = {}, 0
+        for (name, new_name, geometry_string, options), thumbnail in zip(
+            items, thumbnails
+        ):
+            if thumbnail is None:
+                continue
+            if new_name not in moved:
+                source = kvstore.get(ImageFile(name))
+                if source is None:
+                    continue
+                moved[new_name] = ImageFile(new_name)
+                moved[new_name].set_size(source.size)
+                kvstore.set(moved[new_name])
+
+            new_thumbnail = self.get_thumbnail_file(
+                new_name, geometry_string, **options
+            )
+            if link_media(
+                thumbnail.storage, thumbnail.name, new_thumbnail.name
+            ):
+                new_thumbnail.set_size(thumbnail.size)
+                kvstore.set(new_thumbnail, moved[new_name])
+                linked += 1
+        return linked
+
+    def deserialize_thumbnails(self, keys, values):
+        return [
+            None
+            if values[key] == EMPTY_VALUE
+            else deserialize_image_file(values[key])
+            for key in keys
+        ]
+
+
+def thumbnails_queued_key(image_pk):
+    return f"thumbnails-queued:{image_pk}"
+
+
+def queue_thumbnails(image_pks):
+    """
+    Enqueues thumbnail generation for the images, except those queued less
+    than ``THUMBNAIL_TASK_TIMEOUT`` seconds ago. Images still missing
+    thumbnails afterwards, because their task was lost or failed, are
+    queued again the next time.
+    """
+    for image_pk in image_pks:
+        if cache.add(
+            thumbnails_queued_key(image_pk),
+            True,
+            settings.THUMBNAIL_TASK_TIMEOUT,
+        ):
+            enqueue(generate_thumbnails, image_pk)
+
+
+def pending_images(thumbnails):
+    return {
+        image_pk
+        for (image_pk, _), thumbnail in thumbnails.items()
+        if thumbnail is None
+    }
+
+
+def thumbnail_lookups(images, heights, variant=None):
+    options = thumbnail_options(variant)
+    pairs = [(image, height) for image in images for height in heights]
+    lookups = [
+        (image.image, thumbnail_geometry(height), options)
+        for image, height in pairs
+    ]
+    return [(image.pk, height) for image, height in pairs], lookups
+
+
+def resolve_thumbnails(images, heights, variant=None):
+    """
+    Looks up already generated thumbnails for a page of images in one batch
+    and queues those missing. Returns ``{(image.pk, height): ImageFile or
+    None}``.
+    """
+    pairs, lookups = thumbnail_lookups(images, heights, variant)
+    thumbnails = default.backend.get_cached_thumbnails(lookups)
+    thumbnails = dict(zip(pairs, thumbnails))
+    queue_thumbnails(pending_images(thumbnails))
+    return thumbnails
+
+
+async def aresolve_thumbnails(images, heights, variant=None):
+    """
+    ``resolve_thumbnails`` for async views.
+    """
+    pairs, lookups = thumbnail_lookups(images, heights, variant)
+    thumbnails = await default.backend.aget_cached_thumbnails(lookups)
+    thumbnails = dict(zip(pairs, thumbnails))
+    pending = pending_images(thumbnails)
+    if pending:
+        await sync_to_async(queue_thumbnails)(pending)
+    return thumbnails
+
+
+def generate_thumbnails(image_pk):
+    """
+    Generate every thumbnail the image owner's tier gives access to, in the
+    legacy format and every variant.
+    """
+    image = (
+        core.models.Image.objects.select_related("user")
+        .filter(pk=image_pk)
+        .first()
+    )
+    tier = None if image is None else get_tier(image.user.tier_id)
+    if tier is None:
+        return
+
+    for height in tier.heights:
+        for variant in (None, *THUMBNAIL_VARIANTS):
+            default.backend.get_thumbnail(
+                image.image,
+                thumbnail_geometry(height),
+                **thumbnail_options(variant),
+            )
@@ -0,0 +1,88 @@
+import time
+
+from collections import namedtuple
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+
+import core.models
+
+TIERS_VERSION_KEY = "tiers:version"
+
+TierConfig = namedtuple(
+    "TierConfig", ("id", "name", "heights", "can_create_link")
+)
+
+_tiers = None
+_version = None
+_checked_at = 0.0
+
+
+def load_tiers():
+    """
+    Reads every tier with its sorted thumbnail heights in two queries.
+    """
+    heights = {}
+    through = core.models.Tier.thumbnails.through.objects.values_list(
+        "tier_id", "thumbnail__value"
+    )
+    for tier_id, height in through.order_by("thumbnail__value"):
+        heights.setdefault(tier_id, []).append(height)
+
+    return {
+        tier.id: TierConfig(
+            tier.id,
+            tier.name,
+            tuple(heights.get(tier.id, ())),
+            tier.can_create_link,
+        )
+        for tier in core.models.Tier.objects.all()
+    }
+
+
+def get_tier(tier_id):
+    """
+    Returns the ``TierConfig`` of ``tier_id``, or None when there is no
+    such tier.
+
+    Configurations are cached per process until the shared version key
+    changes. The key is read at most every ``TIERS_VERSION_CHECK_INTERVAL``
+    seconds, so once warm this usually costs no cache read nor query.
+    """
+    global _tiers, _version, _checked_at
+
+    if tier_id is None:
+        return None
+
+    tiers = _tiers
+    now = time.monotonic()
+    if (
+        tiers is None
+        or now - _checked_at >= settings.TIERS_VERSION_CHECK_INTERVAL
+    ):
+        version = cache.get(TIERS_VERSION_KEY)
+        _checked_at = now
+        if tiers is None or version != _version:
+            tiers = load_tiers()
+            _tiers, _version = tiers, version
+
+    return tiers.get(tier_id)
+
+
+def clear_tiers():
+    """
+    Drops the configurations cached by this process.
+    """
+    global _tiers
+
+    _tiers = None
+
+
+def bump_tiers_version():
+    """
+    Makes every process reload its tier configurations, this one on the
+    next call.
+    """
+    cache.set(TIERS_VERSION_KEY, uuid4().hex, None)
+    clear_tiers()
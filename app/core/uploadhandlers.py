@@ -0,0 +1,135 @@
+import hashlib
+
+from io import BytesIO
+
+from PIL import Image as pillow_image
+
+from django.conf import settings
+from django.core.files.uploadhandler import (
+    SkipFile,
+    StopUpload,
+    TemporaryFileUploadHandler,
+)
+from django.utils.translation import gettext as _
+
+IMAGE_FORMATS = ("JPEG", "PNG")
+
+
+def sniff_image(fp):
+    """
+    Returns ``(format, size)`` read from the image header. Pillow opens
+    images lazily, so no pixel data is decoded here.
+    """
+    with pillow_image.open(fp, formats=IMAGE_FORMATS) as image:
+        return image.format, image.size
+
+
+def validate_image_file(path):
+    """
+    Fully decodes the image at ``path``. Returns an error message, or None
+    when it is a valid JPEG or PNG.
+    """
+    try:
+        with pillow_image.open(path, formats=IMAGE_FORMATS) as image:
+            image.load()
+    except (
+        pillow_image.UnidentifiedImageError,
+        pillow_image.DecompressionBombError,
+        OSError,
+        SyntaxError,
+    ):
+        return _("Upload a valid JPEG or PNG image.")
+    return None
+
+
+class ImageUploadHandler(TemporaryFileUploadHandler):
+    """
+    Streams every uploaded file straight to a temporary file and validates
+    it from its header while the body is still arriving, hashing the content
+    on the way. Rejected files are skipped and reported on
+    ``request.rejected_uploads``. Parsing stops at the file after the first
+    ``IMAGE_BATCH_UPLOAD_MAX_FILES``, setting ``request.too_many_uploads``.
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.file_count = 0
+        if request is not None:
+            request.rejected_uploads = []
+            request.too_many_uploads = False
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.file_count += 1
+        if self.file_count > settings.IMAGE_BATCH_UPLOAD_MAX_FILES:
+            if self.request is not None:
+                self.request.too_many_uploads = True
+            # The parser closes the file just opened and drains the body.
+            raise StopUpload(connection_reset=False)
+
+        self.header = b""
+        self.received = 0
+        self.image_format = None
+        self.image_size = None
+        self.hasher = hashlib.sha256()
+
+        if (
+            self.content_length is not None
+            and self.content_length > settings.IMAGE_UPLOAD_MAX_BYTES
+        ):
+            self.reject(_("File is too large."))
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > settings.IMAGE_UPLOAD_MAX_BYTES:
+            self.reject(_("File is too large."))
+
+        if self.image_format is None:
+            self.sniff(raw_data)
+
+        self.hasher.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        if self.image_format is None:
+            self.reject(_("Upload a valid JPEG or PNG image."), skip=False)
+            return None
+
+        file = super().file_complete(file_size)
+        file.image_format = self.image_format
+        file.image_size = self.image_size
+        file.content_hash = self.hasher.hexdigest()
+        return file
+
+    def sniff(self, raw_data):
+        self.header = (self.header + raw_data)[
+            : settings.IMAGE_HEADER_MAX_BYTES
+        ]
+
+        try:
+            self.image_format, self.image_size = sniff_image(
+                BytesIO(self.header)
+            )
+        except (pillow_image.UnidentifiedImageError, OSError):
+            if len(self.header) >= settings.IMAGE_HEADER_MAX_BYTES:
+                self.reject(_("Upload a valid JPEG or PNG image."))
+            return
+
+        self.header = b""
+        width, height = self.image_size
+        if width * height > settings.IMAGE_UPLOAD_MAX_PIXELS:
+            self.reject(_("Image dimensions are too large."))
+
+    def reject(self, message, skip=True):
+        if self.request is not None:
+            self.request.rejected_uploads.append(
+                {
+                    "field": self.field_name,
+                    "name": self.file_name,
+                    "error": message,
+                }
+            )
+        self.file.close()
+
+        if skip:
+            raise SkipFile(message)
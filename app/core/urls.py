@@ -1,8 +1,9 @@
+from django.conf import settings
 from django.urls import path, include
 
 from rest_framework.routers import DefaultRouter
 
-from . import views
+from . import async_views, views
 
 router = DefaultRouter()
 router.register("images", views.ImageListViewSet, basename="images")
@@ -11,6 +12,12 @@ app_name = "core"
 
 urlpatterns = [
     path("", include(router.urls)),
+    path("token/", views.ObtainTokenView.as_view(), name="token"),
+    path(
+        "token/revoke/",
+        views.RevokeTokenView.as_view(),
+        name="revoke-token",
+    ),
     path(
         "images/<int:image_pk>/create/",
         views.CreateBinaryLinkView.as_view(),
@@ -22,3 +29,13 @@ urlpatterns = [
         name="get-binary-link",
     ),
 ]
+
+if settings.ASYNC_VIEWS:
+    urlpatterns = [
+        path("images/", async_views.image_list, name="images-list"),
+        path(
+            "images/<uuid:binary_pk>/",
+            async_views.retrieve_binary_link,
+            name="get-binary-link",
+        ),
+    ] + urlpatterns
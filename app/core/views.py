@@ -1,20 +1,86 @@
-from io import BytesIO
-from datetime import timedelta
-
-from PIL import Image as pillow_image
-
-from rest_framework import viewsets, status, mixins, generics, views
+from rest_framework import (
+    viewsets,
+    status,
+    mixins,
+    generics,
+    views,
+    serializers,
+)
+from rest_framework.authtoken.serializers import AuthTokenSerializer
 from rest_framework.decorators import action
+from rest_framework.exceptions import PermissionDenied
 from rest_framework.response import Response
 
+from sorl.thumbnail import default
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.images import ImageFile
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Max, Q
+from django.http import Http404, HttpResponse
 from django.urls import reverse
-from django.core.files.uploadedfile import InMemoryUploadedFile
 from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from django.utils.cache import patch_vary_headers
 from django.utils.translation import gettext_lazy as _
 
 from .models import Image, BinaryImageLink
-from .serializers import ImagesSerializer, ExistSecondsSerializer
+from .serializers import (
+    ImagesSerializer,
+    ExistSecondsSerializer,
+    image_ext_validator,
+)
+from .authentication import (
+    SignedTokenAuthentication,
+    create_token,
+    revoke_token,
+)
 from .permissions import DoesUserHaveTier, IsAuthenticated, CanUserCreateLink
+from .pagination import ImageCursorPagination
+from .media import IMMUTABLE_MAX_AGE, normalize_media_name, serve_media
+from .metrics import exposition
+from .binary_images import (
+    binary_link_cache_key,
+    binary_link_url,
+    cache_binary_link,
+    load_binary_link,
+    render_binary_image,
+)
+from .tasks import enqueue, run_parallel
+from .thumbnails import negotiate_variant, queue_thumbnails
+from .tiers import get_tier
+from .uploadhandlers import ImageUploadHandler, validate_image_file
+
+TIER_FIELDS = {
+    "Basic": ("thumbnails",),
+    "Premium": ("image", "thumbnails"),
+}
+
+
+class ObtainTokenView(views.APIView):
+    permission_classes = ()
+    authentication_classes = ()
+    serializer_class = AuthTokenSerializer
+
+    def post(self, request):
+        serializer = self.serializer_class(
+            data=request.data, context={"request": request}
+        )
+        serializer.is_valid(raise_exception=True)
+
+        token = create_token(serializer.validated_data["user"])
+        return Response({"token": token}, status=status.HTTP_201_CREATED)
+
+
+class RevokeTokenView(views.APIView):
+    permission_classes = (IsAuthenticated,)
+    authentication_classes = (SignedTokenAuthentication,)
+
+    def post(self, request):
+        revoke_token(request.auth)
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
 
 class ImageListViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
@@ -22,37 +88,135 @@ class ImageListViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
     serializer_class = ImagesSerializer
 
     def get_queryset(self):
-        queryset = Image.objects.select_related("user").filter(
-            user=self.get_object()
-        ).order_by('id')
+        queryset = Image.objects.filter(user=self.get_object()).order_by('id')
         return queryset
 
     def get_object(self):
         return self.request.user
 
+    @property
+    def paginator(self):
+        """
+        Cursor pagination when the client sends ``cursor`` (empty for the
+        first page), limit/offset otherwise for backwards compatibility.
+        """
+        cursor_param = ImageCursorPagination.cursor_query_param
+        if cursor_param in self.request.query_params:
+            if not hasattr(self, "_cursor_paginator"):
+                self._cursor_paginator = ImageCursorPagination()
+            return self._cursor_paginator
+        return super().paginator
+
+    def initialize_request(self, request, *args, **kwargs):
+        request.upload_handlers = [ImageUploadHandler(request)]
+        return super().initialize_request(request, *args, **kwargs)
+
     @action(detail=False, methods=["post"], name="image-upload")
     def image_upload(self, request):
         serializer = self.get_serializer(data=request.data)
 
+        rejected = [upload["error"] for upload in request.rejected_uploads]
+        if rejected:
+            raise serializers.ValidationError({"image": rejected})
+
         if serializer.is_valid(raise_exception=True):
-            serializer.save()
+            image = serializer.save()
+            queue_thumbnails([image.pk])
             msg = {'image': _('Successfuly created.')}
             return Response(msg, status=status.HTTP_201_CREATED)
 
+    @action(
+        detail=False,
+        methods=["post"],
+        url_path="batch-upload",
+        name="batch-upload",
+    )
+    def batch_upload(self, request):
+        files = request.FILES.getlist("images")
+        results = [
+            {
+                "name": upload["name"],
+                "status": 400,
+                "errors": [upload["error"]],
+            }
+            for upload in request.rejected_uploads
+        ]
+
+        if request.too_many_uploads:
+            msg = _("Too many files in one batch.")
+            raise serializers.ValidationError({"images": [msg]})
+        if not files and not results:
+            msg = _("No file was submitted.")
+            raise serializers.ValidationError({"images": [msg]})
+
+        errors = run_parallel(
+            validate_image_file,
+            [file.temporary_file_path() for file in files],
+        )
+
+        images, names = [], []
+        batch_names = set()
+        for file, error in zip(files, errors):
+            if error is None:
+                try:
+                    image_ext_validator(file)
+                except serializers.ValidationError as exc:
+                    error = exc.detail[0]
+
+            if error is not None:
+                results.append(
+                    {"name": file.name, "status": 400, "errors": [error]}
+                )
+                continue
+
+            images.append(Image(user=request.user, image=file))
+            names.append(file.name)
+
+        written = []
+        try:
+            with transaction.atomic():
+                for image in images:
+                    image.deduplicate(batch_names)
+                written = [
+                    image for image in images if not image.image._committed
+                ]
+                Image.objects.bulk_create(images)
+        except Exception:
+            # Files shared with stored images are not written again, so
+            # only the files written by this batch are removed.
+            for image in written:
+                if image.image._committed:
+                    image.image.storage.delete(image.image.name)
+            raise
+
+        queue_thumbnails([image.pk for image in images])
+        for image, name in zip(images, names):
+            results.append({"name": name, "status": 201, "id": image.pk})
+
+        if not images:
+            response_status = status.HTTP_400_BAD_REQUEST
+        elif len(images) == len(results):
+            response_status = status.HTTP_201_CREATED
+        else:
+            response_status = status.HTTP_207_MULTI_STATUS
+        return Response({"results": results}, status=response_status)
+
     def list(self, request):
+        tier = get_tier(self.get_object().tier_id)
         queryset = self.paginate_queryset(self.get_queryset())
-        serializer = self.get_serializer(queryset, many=True)
 
-        if self.get_object().tier.name == "Basic":
-            serializer = self.get_serializer(
-                queryset, fields=("thumbnails",), many=True
-            )
-
-        if self.get_object().tier.name == "Premium":
-            serializer = self.get_serializer(
-                queryset, fields=("image", "thumbnails"), many=True
-            )
-        return self.get_paginated_response(serializer.data)
+        context = self.get_serializer_context()
+        context["thumbnail_heights"] = tier.heights
+        context["thumbnail_variant"] = negotiate_variant(request)
+        serializer = self.get_serializer_class()(
+            queryset,
+            fields=TIER_FIELDS.get(tier.name),
+            many=True,
+            context=context,
+        )
+        response = self.get_paginated_response(serializer.data)
+        patch_vary_headers(response, ("Accept",))
+        return response
 
 
 class CreateBinaryLinkView(generics.CreateAPIView):
@@ -63,48 +227,117 @@ class CreateBinaryLinkView(generics.CreateAPIView):
         serializer = self.get_serializer(data=request.data)
 
         if serializer.is_valid(raise_exception=True):
-            image = Image.objects.get(pk=kwargs["image_pk"]).image
+            image = Image.objects.get(pk=kwargs["image_pk"])
 
-            with pillow_image.open(image) as binary_img:
-                io_img = BytesIO()
+            if not image.binary_image:
+                enqueue(render_binary_image, image.pk)
+                image.refresh_from_db(fields=["binary_image"])
 
-                binary_img = binary_img.convert("L")
-                binary_img.save(io_img, "png", quality="kepp")
-                binary_img = InMemoryUploadedFile(
-                    io_img, "image", "image.png", "PNG", io_img.tell(), None
-                )
-
-                binary_link = BinaryImageLink.objects.create(
-                    binary_image=binary_img,
-                    exist_seconds=serializer.data["exist_seconds"],
-                    user=self.request.user,
-                )
-                binary_link.save()
+            binary_link = BinaryImageLink.objects.create(
+                image=image,
+                exist_seconds=serializer.data["exist_seconds"],
+                user=self.request.user,
+            )
+            cache_binary_link(binary_link)
 
             pattern = reverse("core:get-binary-link", args=[binary_link.id])
             url = self.request.build_absolute_uri(pattern)
 
-        return Response({"link": url}, status=status.HTTP_201_CREATED)
+        if image.binary_image:
+            return Response({"link": url}, status=status.HTTP_201_CREATED)
+        return Response({"link": url}, status=status.HTTP_202_ACCEPTED)
 
 
 class RetrieveBinaryLinkView(views.APIView):
     def get(self, request, **kwargs):
+        url = cache.get(binary_link_cache_key(kwargs["binary_pk"]))
 
-        try:
-            binary_link = BinaryImageLink.objects.get(id=kwargs["binary_pk"])
-        except BinaryImageLink.DoesNotExist:
-            msg = _("Link expired")
-            return Response({"image": msg}, status=status.HTTP_400_BAD_REQUEST)
+        if url is None:
+            binary_link = load_binary_link(kwargs["binary_pk"])
+
+            if binary_link is None:
+                msg = _("Link expired")
+                return Response(
+                    {"image": msg}, status=status.HTTP_400_BAD_REQUEST
+                )
 
-        time_created = binary_link.date_created
-        exist_seconds = timedelta(seconds=binary_link.exist_seconds)
-        final_time = time_created + exist_seconds
+            binary_image = binary_link.rendered_image
+            if not binary_image:
+                msg = _("Rendering in progress")
+                return Response(
+                    {"image": msg}, status=status.HTTP_202_ACCEPTED
+                )
 
-        if final_time < timezone.now():
-            binary_link.delete()
-            msg = _("Link expired")
-            return Response({"image": msg}, status=status.HTTP_400_BAD_REQUEST)
+            url = binary_link_url(binary_link)
 
-        url = self.request.build_absolute_uri(binary_link.binary_image.url)
+        url = self.request.build_absolute_uri(url)
 
         return Response({"image": url}, status=status.HTTP_200_OK)
+
+
+class ServeMediaView(views.APIView):
+    """
+    Checks access to a media file and lets the front proxy send it.
+    """
+
+    def get(self, request, path):
+        name = normalize_media_name(path)
+        user = request.user
+
+        if name.startswith(thumbnail_settings.THUMBNAIL_PREFIX):
+            if not user.is_authenticated or user.tier_id is None:
+                raise Http404
+            thumbnail = default.kvstore.get(ImageFile(name, default.storage))
+            if thumbnail is None:
+                raise Http404
+            if thumbnail.y not in get_tier(user.tier_id).heights:
+                raise Http404
+            source = default.kvstore.get_source_name(thumbnail)
+            if source is None:
+                raise Http404
+            if not Image.objects.filter(user=user, image=source).exists():
+                raise Http404
+            return serve_media(request, name, IMMUTABLE_MAX_AGE)
+
+        if "/binary/" in name:
+            expires_at = BinaryImageLink.objects.filter(
+                Q(image__binary_image=name) | Q(binary_image=name),
+                expires_at__gt=timezone.now(),
+            ).aggregate(expires_at=Max("expires_at"))["expires_at"]
+            if expires_at is None:
+                raise Http404
+
+            remaining = expires_at - timezone.now()
+            return serve_media(
+                request, name, int(remaining.total_seconds()), immutable=False
+            )
+
+        if not user.is_authenticated or user.tier_id is None:
+            raise Http404
+        if not Image.objects.filter(user=user, image=name).exists():
+            raise Http404
+
+        fields = TIER_FIELDS.get(get_tier(user.tier_id).name)
+        if fields is not None and "image" not in fields:
+            raise PermissionDenied(_("Your tier does not include originals."))
+
+        return serve_media(request, name, IMMUTABLE_MAX_AGE)
+
+
+def metrics(request):
+    """
+    Prometheus scrape endpoint. Requires ``Authorization: Bearer
+    <METRICS_TOKEN>``, and is only open without a token under ``DEBUG``.
+    """
+    if settings.METRICS_TOKEN:
+        expected = f"Bearer {settings.METRICS_TOKEN}"
+        if not constant_time_compare(
+            request.META.get("HTTP_AUTHORIZATION", ""), expected
+        ):
+            raise Http404
+    elif not settings.DEBUG:
+        raise Http404
+
+    return HttpResponse(
+        exposition(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )